@@ -0,0 +1,280 @@
+"""
+benchmark de DataHandler y de las rutas de controller.py y controller2.py.
+
+Genera un data.json sintetico de cada tamaño pedido, mide carga, guardado y
+consultas de DataHandler y luego recorre las rutas con app.test_client().
+El resultado es un JSON para comparar entre commits:
+
+    python -m bench.benchmark --sizes 10000,100000 --requests 200 --output bench_output.txt
+"""
+import argparse
+import atexit
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from src.data_handler import DataHandler
+from src.response_cache import ResponseCache
+from src.storage_backend import seat_counters
+
+STATUSES = ["ready", "inprogress", "completed"]
+PARTICIPANT_STATUSES = {
+    "ready": ["waiting", "confirmed", "rejected"],
+    "inprogress": ["inprogress", "missing", "rejected"],
+    "completed": ["completed", "missing", "notmarked", "rejected"],
+}
+
+
+def generate_dataset(users, rides, participants_per_ride=3, seed=0):
+    """usuarios, rides y participaciones con la forma de data.json"""
+    rnd = random.Random(seed)
+    user_list = [{"alias": f"user{i}", "name": f"Usuario {i}", "car_plate": f"ABC-{i % 1000:03d}" if i % 3 else None}
+                 for i in range(users)]
+    ride_list = []
+    for ride_id in range(1, rides + 1):
+        driver = user_list[rnd.randrange(users)]
+        status = rnd.choice(STATUSES)
+        participants = []
+        for participant in rnd.sample(user_list, min(participants_per_ride, users)):
+            if participant is driver:
+                continue
+            participants.append({"confirmation": None, "destination": f"Destino {rnd.randrange(100)}",
+                                 "occupiedSpaces": 1, "participant": {"alias": participant["alias"]},
+                                 "status": rnd.choice(PARTICIPANT_STATUSES[status])})
+        ride_list.append({"id": ride_id, "rideDateAndTime": f"2025-07-{1 + ride_id % 28:02d}T18:00:00",
+                          "finalAddress": f"Av. Javier Prado {ride_id}", "allowedSpaces": participants_per_ride + 1,
+                          "rideDriver": {"alias": driver["alias"]}, "status": status, "participants": participants,
+                          **seat_counters(participants)})
+    # ya normalizado: la carga no migra ni reescribe el archivo
+    return {"entities": [], "User": user_list, "Ride": ride_list, "_normalized": True}
+
+
+def summarize(samples):
+    """percentiles en milisegundos y operaciones por segundo de una lista de duraciones"""
+    ordered = sorted(samples)
+    total = sum(ordered)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "ops_per_sec": round(len(ordered) / total, 1) if total else None,
+    }
+
+
+def measure(fn, repeat):
+    # los resultados se guardan hasta el final para que liberarlos no caiga
+    # dentro de la medicion
+    samples, keep = [], []
+    for i in range(repeat):
+        start = time.perf_counter()
+        keep.append(fn(i))
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_data_handler(filename, dataset, repeat):
+    users = [u["alias"] for u in dataset["User"]]
+    rides = len(dataset["Ride"])
+    rnd = random.Random(1)
+    results = {}
+
+    # archivo escrito por json.dump, sin indice de secciones
+    results["load_data"] = measure(lambda i: DataHandler(filename), max(1, repeat // 20))
+    handler = DataHandler(filename)
+    results["save_data"] = measure(lambda i: handler.save_data(), max(1, repeat // 20))
+
+    # con el snapshot ya guardado por save_data la carga lazy solo lee el indice
+    results["load_data_lazy"] = measure(lambda i: DataHandler(filename, lazy=True), max(1, repeat // 20))
+    results["load_data_lazy_first_get"] = measure(
+        lambda i: DataHandler(filename, lazy=True).get_by_key("User", users[0]), max(1, repeat // 20))
+
+    results["get_by_key"] = measure(lambda i: handler.get_by_key("Ride", rnd.randint(1, rides)), repeat)
+    results["filter_indexed"] = measure(
+        lambda i: handler.get_entities_filter("Ride", {"rideDriver.alias": rnd.choice(users)}), repeat)
+    results["filter_unindexed"] = measure(
+        lambda i: handler.get_entities_filter("Ride", {"finalAddress": f"Av. Javier Prado {rnd.randint(1, rides)}"}),
+        max(1, repeat // 10))
+    results["participant_stats"] = measure(lambda i: handler.get_participant_stats(rnd.choice(users)), repeat)
+    results["page"] = measure(lambda i: handler.get_entities_page("Ride", {"status": "ready"}, limit=100), repeat)
+    return results
+
+
+def _post(client, url, body):
+    response = client.post(url, json=body)
+    return response.get_json(silent=True) or {}
+
+
+def _controller_flows(client, users, rnd):
+    """
+    secuencias de pasos por cada ruta de controller.py; las rutas que mutan se
+    encadenan para que cada paso encuentre el estado que espera
+    """
+    state = {}
+
+    def create_ride(i):
+        state["driver"] = driver = rnd.choice(users)
+        state["riders"] = rnd.sample([u for u in users[:1000] if u != driver], 2)
+        ride = _post(client, "/rides", {"rideDateAndTime": "2025-07-16T18:00:00", "finalAddress": "Av. Arequipa",
+                                        "allowedSpaces": 3, "driverAlias": driver}).get("ride", {})
+        state["ride"] = ride.get("id")
+
+    def ride_url(suffix):
+        return f"/usuarios/{state['driver']}/rides/{state['ride']}/{suffix}"
+
+    return [
+        ("GET /usuarios", lambda i: client.get("/usuarios?limit=100")),
+        ("GET /usuarios/<alias>", lambda i: client.get(f"/usuarios/{rnd.choice(users)}")),
+        ("GET /usuarios/<alias>/rides", lambda i: client.get(f"/usuarios/{rnd.choice(users)}/rides")),
+        ("GET /rides", lambda i: client.get("/rides?limit=100")),
+        ("POST /usuarios", lambda i: client.post("/usuarios", json={"alias": f"bench{i}", "name": "Bench"})),
+        ("POST /rides", create_ride),
+        ("GET /usuarios/<alias>/rides/<rideid>", lambda i: client.get(ride_url("")[:-1])),
+        ("POST requestToJoin", lambda i: [client.post(ride_url(f"requestToJoin/{alias}"),
+                                                      json={"destination": "Lima"})
+                                          for alias in state["riders"]]),
+        ("POST accept", lambda i: client.post(ride_url(f"accept/{state['riders'][0]}"))),
+        ("POST reject", lambda i: client.post(ride_url(f"reject/{state['riders'][1]}"))),
+        ("POST start", lambda i: client.post(ride_url("start"),
+                                             json={"presentParticipants": [state["riders"][0]]})),
+        ("POST unloadParticipant", lambda i: client.post(ride_url("unloadParticipant"),
+                                                         json={"participantAlias": state["riders"][0]})),
+        ("POST end", lambda i: client.post(ride_url("end"))),
+    ]
+
+
+def _controller2_flows(client, users, rnd):
+    state = {}
+
+    def create_ride(i):
+        state["driver"] = rnd.choice(users)
+        state["rider"] = f"bench2_{i}"
+        ride = _post(client, "/Crear/Ride", {"fechaHora": "2025-07-16T18:00:00", "direccion": "Av. Arequipa",
+                                             "espacios": 3, "conductor": state["driver"]})
+        state["ride"] = ride.get("viaje", {}).get("id")
+
+    return [
+        ("GET /", lambda i: client.get("/")),
+        ("GET /All/User", lambda i: client.get("/All/User?limit=100")),
+        ("GET /usuarios/<alias>/rides", lambda i: client.get(f"/usuarios/{rnd.choice(users)}/rides")),
+        ("POST /Create/User", lambda i: client.post("/Create/User", json={"alias": f"bench2_{i}", "name": "Bench"})),
+        ("POST /Crear/Ride", create_ride),
+        ("GET /usuarios/<alias>/rides/<rideId>",
+         lambda i: client.get(f"/usuarios/{state['driver']}/rides/{state['ride']}")),
+        ("POST /rides/<rideId>/join", lambda i: client.post(f"/rides/{state['ride']}/join",
+                                                            json={"alias": state["rider"], "destination": "Lima"})),
+        ("PUT participant status", lambda i: client.put(f"/rides/{state['ride']}/participants/{state['rider']}/status",
+                                                        json={"status": "confirmed"})),
+    ]
+
+
+def bench_routes(module_name, flows, filename, users, repeat):
+    """
+    corre cada flujo repeat veces contra la app del modulo, con su data_handler
+    apuntando al dataset generado. Si Flask no esta instalado se reporta el
+    motivo en vez de resultados
+    """
+    # al importarse el modulo abre data.json en el directorio actual (y
+    # registra su guardado con atexit): se importa desde un directorio vacio
+    # y ese handler se cierra antes de reemplazarlo
+    fresh = module_name not in sys.modules
+    cwd = os.getcwd()
+    if fresh:
+        os.chdir(tempfile.mkdtemp(dir=os.path.dirname(filename)))
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as error:
+        return {"skipped": str(error)}
+    finally:
+        os.chdir(cwd)
+    if fresh:
+        atexit.unregister(module.data_handler.close)
+        module.data_handler.close()
+    module.data_handler = DataHandler(filename, journal=True, lazy=True)
+    if hasattr(module, "service"):
+        module.service.data_handler = module.data_handler
+    # las rutas GET cacheadas leen versiones y toman locks del handler del cache
+    if hasattr(module, "response_cache"):
+        module.response_cache = ResponseCache(module.data_handler)
+    module.app.config["TESTING"] = True
+    client = module.app.test_client()
+
+    steps = flows(client, users, random.Random(2))
+    samples = {name: [] for name, _ in steps}
+    for i in range(repeat):
+        for name, step in steps:
+            start = time.perf_counter()
+            step(i)
+            samples[name].append(time.perf_counter() - start)
+    module.data_handler.compact()
+    module.data_handler.close()
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, participants_per_ride, repeat, seed):
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {"sizes": sizes, "participants_per_ride": participants_per_ride, "requests": repeat, "seed": seed},
+        "results": [],
+    }
+    for size in sizes:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "data.json")
+            dataset = generate_dataset(size, size, participants_per_ride, seed)
+            with open(filename, "w") as f:
+                json.dump(dataset, f)
+            users = [u["alias"] for u in dataset["User"]]
+            result = {"users": size, "rides": size, "file_bytes": os.path.getsize(filename),
+                      "data_handler": bench_data_handler(filename, dataset, repeat)}
+            del dataset
+            result["controller"] = bench_routes("src.controller", _controller_flows, filename, users, repeat)
+            result["controller2"] = bench_routes("src.controller2", _controller2_flows, filename, users, repeat)
+            report["results"].append(result)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark de DataHandler y de las rutas de la API")
+    parser.add_argument("--sizes", default="10000",
+                        help="cantidades de usuarios y rides separadas por coma, p. ej. 10000,100000,1000000")
+    parser.add_argument("--participants", type=int, default=3, help="participaciones por ride")
+    parser.add_argument("--requests", type=int, default=200, help="repeticiones por operacion y por ruta")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="archivo donde escribir el JSON (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report = json.dumps(run(sizes, args.participants, args.requests, args.seed), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+
+from src.models.records import to_dict
+from src.query import Query
+from src.storage_backend import PARTICIPANT_STATS, empty_participant_stats
+
+# estados de un ride terminado: ya no cambia y puede salir de memoria
+ARCHIVED_STATUSES = ("completed", "done")
+
+DRIVER_PATH = "rideDriver.alias"
+PARTICIPANT_PATH = "participants[].participant.alias"
+
+
+def _equal_values(query, path):
+    # valores de una condicion eq/in sobre path, o None si no la hay
+    condition = query.where.get(path)
+    if condition is None:
+        return None
+    ops = Query.operators(condition)
+    if "eq" in ops:
+        return [ops["eq"]]
+    if "in" in ops:
+        return list(ops["in"])
+    return None
+
+
+class RideArchive:
+    """
+    segmento de solo agregado con los rides terminados, fuera de memoria.
+    <filename> tiene un ride por linea en JSON compacto y <filename>.idx una
+    linea [id, offset, largo, conductor, [[alias, estado], ...]] por ride.
+    En memoria solo queda ese indice: por id, por conductor y por
+    participante, mas las estadisticas de cada participante; los rides se
+    leen del disco cuando se piden
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._by_driver = {}
+        self._by_participant = {}
+        self._stats = {}
+        self._size = 0
+        self._load_index()
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > self._size:
+            # linea a medio escribir por una caida: se descarta para que los
+            # offsets del indice sigan valiendo
+            os.truncate(self.filename, self._size)
+        self._data = open(self.filename, 'ab+')
+        self._index = open(self.index_filename, 'a', encoding='utf-8')
+
+    def _load_index(self):
+        valid = 0
+        try:
+            with open(self.index_filename, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # linea a medio escribir por una caida: se corta y
+                        # se rehace desde los datos
+                        break
+                    self._register(*json.loads(line))
+                    valid += len(line)
+            if os.path.getsize(self.index_filename) > valid:
+                os.truncate(self.index_filename, valid)
+        except FileNotFoundError:
+            pass
+        # rides que llegaron a los datos pero no al indice por una caida
+        missing = []
+        try:
+            with open(self.filename, 'rb') as f:
+                f.seek(self._size)
+                offset = self._size
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    missing.append(self._entry(json.loads(line), offset, len(line) - 1))
+                    offset += len(line)
+        except FileNotFoundError:
+            return
+        if missing:
+            with open(self.index_filename, 'a', encoding='utf-8') as f:
+                for entry in missing:
+                    self._register(*entry)
+                    f.write(json.dumps(entry) + "\n")
+
+    @staticmethod
+    def _entry(ride, offset, length):
+        driver = (ride.get("rideDriver") or {}).get("alias")
+        participants = [[(p.get("participant") or {}).get("alias"), p.get("status")]
+                        for p in ride.get("participants") or [] if isinstance(p, dict)]
+        return [ride.get("id"), offset, length, driver, participants]
+
+    def _register(self, ride_id, offset, length, driver, participants):
+        self._positions[ride_id] = (offset, length)
+        self._by_driver.setdefault(driver, []).append(ride_id)
+        for alias, status in participants:
+            self._by_participant.setdefault(alias, []).append(ride_id)
+            stats = self._stats.setdefault(alias, empty_participant_stats())
+            stats["previousRidesTotal"] += 1
+            field = PARTICIPANT_STATS.get(status)
+            if field:
+                stats[field] += 1
+        self._size = max(self._size, offset + length + 1)
+
+    def __contains__(self, ride_id):
+        return ride_id in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def append(self, rides):
+        """
+        agrega rides terminados (los que ya estan se saltan) y los deja en
+        disco antes de volver, asi se pueden sacar de memoria
+        """
+        with self._lock:
+            entries, lines, offset = [], [], self._size
+            for ride in rides:
+                ride = to_dict(ride)
+                if ride.get("id") in self._positions:
+                    continue
+                line = json.dumps(ride, separators=(",", ":")).encode()
+                entries.append(self._entry(ride, offset, len(line)))
+                lines.append(line + b"\n")
+                offset += len(line) + 1
+            if not entries:
+                return 0
+            self._data.write(b"".join(lines))
+            self._data.flush()
+            os.fsync(self._data.fileno())
+            self._index.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            self._index.flush()
+            os.fsync(self._index.fileno())
+            for entry in entries:
+                self._register(*entry)
+            return len(entries)
+
+    def get(self, ride_id):
+        position = self._positions.get(ride_id)
+        if position is None:
+            return None
+        offset, length = position
+        return json.loads(os.pread(self._data.fileno(), length, offset))
+
+    def find(self, filters):
+        """
+        rides archivados que cumplen filters. Con conductor o participante
+        fijos (eq/in) solo se leen esos rides; si el filtro pide un estado
+        que no se archiva no se lee nada; si no, se recorre el archivo
+        """
+        query = filters if isinstance(filters, Query) else Query(filters)
+        statuses = _equal_values(query, "status")
+        if statuses is not None and not set(statuses) & set(ARCHIVED_STATUSES):
+            return []
+        ids = None
+        for path, index in ((DRIVER_PATH, self._by_driver), (PARTICIPANT_PATH, self._by_participant)):
+            values = _equal_values(query, path)
+            if values is not None:
+                found = {ride_id for value in values for ride_id in index.get(value, [])}
+                ids = found if ids is None else ids & found
+        if ids is None:
+            ids = self._positions
+        rides = (self.get(ride_id) for ride_id in sorted(ids, key=lambda i: self._positions[i][0]))
+        return list(query.filter(rides))
+
+    def participant_stats(self, alias):
+        return dict(self._stats.get(alias) or empty_participant_stats())
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
@@ -1,94 +1,111 @@
-from flask import Flask, jsonify, request
+import atexit
+import os
+
+from flask import Flask, Response, jsonify, request
 from werkzeug.exceptions import BadRequest
 
-from src.data_handler import DataHandler
+from src.event_bus import EVENT_BUS, STREAM_CONTENT_TYPE
+from src.metrics import CONTENT_TYPE, REGISTRY, instrument
 from src.class_error import NotFound, BusinessValidacion
+from src.models.app import Ride, User
+from src.participation_decisions import DECISIONES, decidir_participaciones
+from src.pagination import (MAX_LIMIT, parse_event_filters, parse_pagination, parse_seats, parse_time_window, get_page,
+                            stream_entities)
+from src.response_cache import ResponseCache, ride_dependencies
 from src.service import Service
+from src.sharded_data_handler import open_data_handler
+from src.storage_backend import free_seats, ride_seats
 from datetime import datetime
 
 app = Flask(__name__)
-data_handler = DataHandler()
+instrument(app)
+# con DATA_SHARDS > 1 usuarios y rides se reparten por alias del conductor
+# en data.shard<N>.json (ver ShardedDataHandler); cada ruta de un conductor
+# valida y escribe en su particion con data_handler.shard(alias)
+data_handler = open_data_handler(shards=int(os.environ.get("DATA_SHARDS", "1")), journal=True, lazy=True, archive=True)
+atexit.register(data_handler.close)
+response_cache = ResponseCache(data_handler)
 service = Service(data_handler)
-
-
-class RideParticipation:
-    def __init__(self, confirmation, destination, occupiedSpaces, participant, status="waiting"):
-        self.confirmation = confirmation
-        self.destination = destination
-        self.occupiedSpaces = occupiedSpaces
-        self.participant = participant
-        self.status = status
-
-    def to_dict(self):
-        return {
-            "confirmation": self.confirmation.isoformat() if self.confirmation else None,
-            "destination": self.destination,
-            "occupiedSpaces": self.occupiedSpaces,
-            "participant": self.participant.to_dict() if hasattr(self.participant, 'to_dict') else self.participant,
-            "status": self.status
-        }
-
-
-class Ride:
-    def __init__(self, rideDateAndTime, finalAddress, allowedSpaces, rideDriver, status="ready", participants=None,
-                 rideId=None):
-        self.id = rideId
-        self.rideDateAndTime = rideDateAndTime
-        self.finalAddress = finalAddress
-        self.allowedSpaces = allowedSpaces
-        self.rideDriver = rideDriver
-        self.status = status
-        self.participants = participants if participants else []
-
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "rideDateAndTime": self.rideDateAndTime.isoformat(),
-            "finalAddress": self.finalAddress,
-            "allowedSpaces": self.allowedSpaces,
-            "rideDriver": self.rideDriver.to_dict() if hasattr(self.rideDriver, 'to_dict') else self.rideDriver,
-            "status": self.status,
-            "participants": [p.to_dict() if hasattr(p, "to_dict") else p for p in self.participants]
-        }
-
-
-class User:
-    def __init__(self, alias, name, car_plate=None):
-        self.alias = alias
-        self.name = name
-        self.car_plate = car_plate
-        self.rides = []
-
-    def to_dict(self):
-        return {
-            "alias": self.alias,
-            "name": self.name,
-            "car_plate": self.car_plate
-        }
+errores_manejados = REGISTRY.counter("http_handled_errors_total", "excepciones convertidas en respuesta JSON por tipo",
+                                     ("type",))
 
 
 def handler_error(error):
+    errores_manejados.inc(type=type(error).__name__)
     if isinstance(error, NotFound):
         return jsonify({"error": str(error)}), 404
     if isinstance(error, BusinessValidacion):
         return jsonify({"error": str(error)}), 422
     if isinstance(error, BadRequest):
         return jsonify({"error": str(error)}), 400
+    # un error inesperado queda en el log con su traceback, no solo en el JSON
+    app.logger.error("Error no controlado: %s", error, exc_info=error)
     return jsonify({"error": str(error)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/events', methods=['GET'])
+def get_events():
+    # server-sent events con los cambios de rides y participaciones, por
+    # ?rideId= y/o ?alias= (conductor o participante): reemplaza consultar el ride
+    try:
+        filtros = parse_event_filters(request.args, request.headers)
+        return Response(EVENT_BUS.stream(**filtros), mimetype=STREAM_CONTENT_TYPE,
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except Exception as error:
+        return handler_error(error)
+
+
+def leer_lote(data, clave):
+    # un lote llega como arreglo JSON o como {clave: [...]}
+    filas = data.get(clave) if isinstance(data, dict) else data
+    if not isinstance(filas, list) or not filas:
+        raise BadRequest(f"Se esperaba un arreglo no vacío en '{clave}'")
+    return filas
+
+
+def errores_de_lote(errores):
+    # un lote con errores no aplica ninguna fila
+    return jsonify({"error": f"El lote tiene {len(errores)} errores y no se aplicó", "errores": errores}), 422
+
+
+def respuesta_cacheada(entrada):
+    # 304 sin cuerpo si el cliente ya tiene esta version (If-None-Match)
+    respuesta = Response(entrada.body, mimetype="application/json", headers=entrada.headers)
+    respuesta.set_etag(entrada.etag)
+    return respuesta.make_conditional(request)
+
+
 @app.route('/usuarios', methods=['GET'])
 def get_usuarios():
     try:
-        usuarios = data_handler.get_entities("User") or []
-        usuarios_dict = []
-        for usuario in usuarios:
-            if isinstance(usuario, dict):
-                usuarios_dict.append(usuario)
-            else:
-                usuarios_dict.append(usuario.to_dict())
-
-        return jsonify(usuarios_dict), 200
+        paginacion = parse_pagination(request.args)
+        if paginacion and paginacion["stream"]:
+            return Response(stream_entities(data_handler, "User", offset=paginacion["offset"],
+                                            after=paginacion["after"]), mimetype="application/json")
+
+        if not paginacion:
+            # la lista completa sale de una vista inmutable: se serializa sin
+            # frenar a los escritores
+            return jsonify(data_handler.snapshot().get_entities("User") or []), 200
+
+        with data_handler.read():
+            usuarios, siguiente = get_page(data_handler, "User", None, paginacion)
+            usuarios_dict = []
+            for usuario in usuarios:
+                if isinstance(usuario, dict):
+                    usuarios_dict.append(usuario)
+                else:
+                    usuarios_dict.append(usuario.to_dict())
+
+            respuesta = jsonify(usuarios_dict)
+            if siguiente:
+                respuesta.headers["X-Next-Cursor"] = siguiente
+            return respuesta, 200
     except Exception as error:
         return handler_error(error)
 
@@ -96,49 +113,50 @@ def get_usuarios():
 @app.route('/usuarios/<alias>', methods=['GET'])
 def get_usuario(alias):
     try:
-        usuarios = data_handler.get_entities("User") or []
-        usuario = next((u for u in usuarios if u.get("alias") == alias), None)
+        with data_handler.read():
+            usuario = data_handler.get_by_key("User", alias)
 
-        if not usuario:
-            raise NotFound(f"Usuario con alias '{alias}' no encontrado")
+            if not usuario:
+                raise NotFound(f"Usuario con alias '{alias}' no encontrado")
 
-        return jsonify(usuario), 200
+            return jsonify(usuario), 200
     except Exception as error:
         return handler_error(error)
 
 
 @app.route('/usuarios/<alias>/rides', methods=['GET'])
 def get_rides_by_user(alias):
-    try:
-        usuarios = data_handler.get_entities("User") or []
-        usuario = next((u for u in usuarios if u.get("alias") == alias), None)
+    def construir():
+        usuario = data_handler.get_by_key("User", alias)
 
         if not usuario:
             raise NotFound(f"Usuario con alias '{alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        rides_usuario = [ride for ride in rides if ride.get("rideDriver", {}).get("alias") == alias]
+        rides_usuario = data_handler.get_entities_filter("Ride", {"rideDriver.alias": alias}) or []
 
-        return jsonify(rides_usuario), 200
+        dependencias = {("User", alias), ("Ride.driver", alias)} | ride_dependencies(rides_usuario)
+        return data_handler.join("Ride", rides_usuario), dependencias, None
+
+    try:
+        return respuesta_cacheada(response_cache.get_or_build(("rides_by_user", alias), construir))
     except Exception as error:
         return handler_error(error)
 
 
 @app.route('/usuarios/<alias>/rides/<int:rideid>', methods=['GET'])
 def get_ride_with_stats(alias, rideid):
-    try:
-        usuarios = data_handler.get_entities("User") or []
-        usuario = next((u for u in usuarios if u.get("alias") == alias), None)
+    def construir():
+        usuario = data_handler.get_by_key("User", alias)
 
         if not usuario:
             raise NotFound(f"Usuario con alias '{alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        ride = next((r for r in rides if r.get("id") == rideid and r.get("rideDriver", {}).get("alias") == alias), None)
+        ride = data_handler.get_by_key("Ride", rideid)
 
-        if not ride:
+        if not ride or ride.get("rideDriver", {}).get("alias") != alias:
             raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
 
+        ride = data_handler.expand("Ride", ride)
         participantes_stats = []
         for p in ride.get("participants", []):
             alias_participante = p.get("participant", {}).get("alias")
@@ -168,36 +186,17 @@ def get_ride_with_stats(alias, rideid):
             }
         }
 
-        return jsonify(response), 200
+        dependencias = {("User", alias), ("Ride", rideid)} | ride_dependencies([ride], stats=True)
+        return response, dependencias, None
+
+    try:
+        return respuesta_cacheada(response_cache.get_or_build(("ride_with_stats", alias, rideid), construir))
     except Exception as error:
         return handler_error(error)
 
 
 def get_stats_participante(alias_participante):
-    stats = {
-        "previousRidesTotal": 0,
-        "previousRidesCompleted": 0,
-        "previousRidesMissing": 0,
-        "previousRidesNotMarked": 0,
-        "previousRidesRejected": 0
-    }
-
-    rides = data_handler.get_entities("Ride") or []
-    for ride in rides:
-        for participacion in ride.get("participants", []):
-            if participacion.get("participant", {}).get("alias") == alias_participante:
-                stats["previousRidesTotal"] += 1
-                estado = participacion.get("status")
-                if estado == "completed":
-                    stats["previousRidesCompleted"] += 1
-                elif estado == "missing":
-                    stats["previousRidesMissing"] += 1
-                elif estado == "notmarked":
-                    stats["previousRidesNotMarked"] += 1
-                elif estado == "rejected":
-                    stats["previousRidesRejected"] += 1
-
-    return stats
+    return data_handler.get_participant_stats(alias_participante)
 
 
 @app.route('/usuarios/<alias>/rides/<int:rideid>/requestToJoin/<participant_alias>', methods=['POST'])
@@ -213,44 +212,49 @@ def request_to_join_ride(alias, rideid, participant_alias):
         if not destino:
             raise BadRequest("El destino es requerido")
 
-        usuarios = data_handler.get_entities("User") or []
-        conductor = next((u for u in usuarios if u.get("alias") == alias), None)
-        if not conductor:
-            raise NotFound(f"Usuario conductor '{alias}' no encontrado")
-
-        participante = next((u for u in usuarios if u.get("alias") == participant_alias), None)
+        # el participante puede estar en otra particion: se lee antes de
+        # tomar la del conductor
+        participante = data_handler.get_by_key("User", participant_alias)
         if not participante:
             raise NotFound(f"Usuario participante '{participant_alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        ride = next((r for r in rides if r.get("id") == rideid and r.get("rideDriver", {}).get("alias") == alias), None)
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            conductor = particion.get_by_key("User", alias)
+            if not conductor:
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
 
-        if not ride:
-            raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
+            ride = particion.get_by_key("Ride", rideid)
 
-        if ride.get("status") != "ready":
-            raise BusinessValidacion("Solo se puede unir a un ride antes de que inicie (status ready)")
+            if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
 
-        participantes = ride.get("participants", [])
-        for p in participantes:
-            if p.get("participant", {}).get("alias") == participant_alias:
-                raise BusinessValidacion("El participante ya ha solicitado unirse a este ride")
+            if ride.get("status") != "ready":
+                raise BusinessValidacion("Solo se puede unir a un ride antes de que inicie (status ready)")
 
-        espacios_ocupados = sum(p.get("occupiedSpaces", 1) for p in participantes)
-        if espacios_ocupados + espacios > ride.get("allowedSpaces"):
-            raise BusinessValidacion("No hay espacios suficientes disponibles")
+            participantes = ride.get("participants", [])
+            for p in participantes:
+                if p.get("participant", {}).get("alias") == participant_alias:
+                    raise BusinessValidacion("El participante ya ha solicitado unirse a este ride")
 
-        nueva_participacion = {
-            "confirmation": None,
-            "destination": destino,
-            "occupiedSpaces": espacios,
-            "participant": participante,
-            "status": "waiting"
-        }
+            # los asientos de solicitudes pendientes quedan reservados
+            if espacios > free_seats(ride):
+                raise BusinessValidacion("No hay espacios suficientes disponibles")
 
-        ride["participants"].append(nueva_participacion)
-        data_handler.save_data()
+            nueva_participacion = {
+                "confirmation": None,
+                "destination": destino,
+                "occupiedSpaces": espacios,
+                "participant": participante,
+                "status": "waiting"
+            }
+
+            participantes = participantes + [nueva_participacion]
+            particion.update_entity_filter("Ride", {"id": rideid}, {"participants": participantes})
+            particion.save_data()
 
+        # los eventos salen despues de que el cambio quedo guardado
+        EVENT_BUS.publish("requestToJoin", dict(ride, participants=participantes), participant_alias, status="waiting")
         return jsonify({"message": "Solicitud para unirse al ride enviada exitosamente",
                         "participacion": nueva_participacion}), 201
 
@@ -261,44 +265,44 @@ def request_to_join_ride(alias, rideid, participant_alias):
 @app.route('/usuarios/<alias>/rides/<int:rideid>/accept/<participant_alias>', methods=['POST'])
 def accept_participant(alias, rideid, participant_alias):
     try:
-        usuarios = data_handler.get_entities("User") or []
-        conductor = next((u for u in usuarios if u.get("alias") == alias), None)
-        if not conductor:
-            raise NotFound(f"Usuario conductor '{alias}' no encontrado")
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            conductor = particion.get_by_key("User", alias)
+            if not conductor:
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        ride = next((r for r in rides if r.get("id") == rideid and r.get("rideDriver", {}).get("alias") == alias), None)
+            ride = particion.get_by_key("Ride", rideid)
 
-        if not ride:
-            raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
+            if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
 
-        participantes = ride.get("participants", [])
-        participacion = None
-        for p in participantes:
-            if p.get("participant", {}).get("alias") == participant_alias:
-                participacion = p
-                break
+            participantes = ride.get("participants", [])
+            participacion = None
+            for p in participantes:
+                if p.get("participant", {}).get("alias") == participant_alias:
+                    participacion = p
+                    break
 
-        if not participacion:
-            raise NotFound(f"Participante '{participant_alias}' no encontrado en este ride")
+            if not participacion:
+                raise NotFound(f"Participante '{participant_alias}' no encontrado en este ride")
 
-        if participacion.get("status") != "waiting":
-            raise BusinessValidacion("Solo se puede aceptar una solicitud en estado 'waiting'")
+            if participacion.get("status") != "waiting":
+                raise BusinessValidacion("Solo se puede aceptar una solicitud en estado 'waiting'")
 
-        espacios_ocupados = sum(p.get("occupiedSpaces", 1) for p in participantes if
-                                p.get("participant", {}).get("alias") != participant_alias and p.get(
-                                    "status") == "confirmed")
+            confirmados, _ = ride_seats(ride)
+            if confirmados + participacion.get("occupiedSpaces", 1) > ride.get("allowedSpaces"):
+                raise BusinessValidacion("No hay espacios suficientes disponibles")
 
-        if espacios_ocupados + participacion.get("occupiedSpaces", 1) > ride.get("allowedSpaces"):
-            raise BusinessValidacion("No hay espacios suficientes disponibles")
+            participacion["status"] = "confirmed"
+            participacion["confirmation"] = datetime.now().isoformat()
 
-        participacion["status"] = "confirmed"
-        participacion["confirmation"] = datetime.now().isoformat()
-
-        data_handler.save_data()
+            particion.update_entity_filter("Ride", {"id": rideid}, {"participants": participantes})
+            particion.save_data()
 
+        EVENT_BUS.publish("accepted", ride, participant_alias, status="confirmed")
+        # join lee usuarios de otras particiones: fuera de la transaccion
         return jsonify({"message": f"Participante '{participant_alias}' aceptado exitosamente",
-                        "participacion": participacion}), 200
+                        "participacion": data_handler.expand("RideParticipation", participacion)}), 200
 
     except Exception as error:
         return handler_error(error)
@@ -307,36 +311,38 @@ def accept_participant(alias, rideid, participant_alias):
 @app.route('/usuarios/<alias>/rides/<int:rideid>/reject/<participant_alias>', methods=['POST'])
 def reject_participant(alias, rideid, participant_alias):
     try:
-        usuarios = data_handler.get_entities("User") or []
-        conductor = next((u for u in usuarios if u.get("alias") == alias), None)
-        if not conductor:
-            raise NotFound(f"Usuario conductor '{alias}' no encontrado")
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            conductor = particion.get_by_key("User", alias)
+            if not conductor:
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        ride = next((r for r in rides if r.get("id") == rideid and r.get("rideDriver", {}).get("alias") == alias), None)
+            ride = particion.get_by_key("Ride", rideid)
 
-        if not ride:
-            raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
+            if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
 
-        participantes = ride.get("participants", [])
-        participacion = None
-        for p in participantes:
-            if p.get("participant", {}).get("alias") == participant_alias:
-                participacion = p
-                break
+            participantes = ride.get("participants", [])
+            participacion = None
+            for p in participantes:
+                if p.get("participant", {}).get("alias") == participant_alias:
+                    participacion = p
+                    break
 
-        if not participacion:
-            raise NotFound(f"Participante '{participant_alias}' no encontrado en este ride")
+            if not participacion:
+                raise NotFound(f"Participante '{participant_alias}' no encontrado en este ride")
 
-        if participacion.get("status") != "waiting":
-            raise BusinessValidacion("Solo se puede rechazar una solicitud en estado 'waiting'")
+            if participacion.get("status") != "waiting":
+                raise BusinessValidacion("Solo se puede rechazar una solicitud en estado 'waiting'")
 
-        participacion["status"] = "rejected"
+            participacion["status"] = "rejected"
 
-        data_handler.save_data()
+            particion.update_entity_filter("Ride", {"id": rideid}, {"participants": participantes})
+            particion.save_data()
 
+        EVENT_BUS.publish("rejected", ride, participant_alias, status="rejected")
         return jsonify({"message": f"Participante '{participant_alias}' rechazado exitosamente",
-                        "participacion": participacion}), 200
+                        "participacion": data_handler.expand("RideParticipation", participacion)}), 200
 
     except Exception as error:
         return handler_error(error)
@@ -348,39 +354,41 @@ def start_ride(alias, rideid):
         data = request.get_json()
         presentes = data.get("presentParticipants", []) if data else []
 
-        usuarios = data_handler.get_entities("User") or []
-        conductor = next((u for u in usuarios if u.get("alias") == alias), None)
-        if not conductor:
-            raise NotFound(f"Usuario conductor '{alias}' no encontrado")
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            conductor = particion.get_by_key("User", alias)
+            if not conductor:
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        ride = next((r for r in rides if r.get("id") == rideid and r.get("rideDriver", {}).get("alias") == alias), None)
+            ride = particion.get_by_key("Ride", rideid)
 
-        if not ride:
-            raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
+            if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
 
-        if ride.get("status") != "ready":
-            raise BusinessValidacion("Solo se puede iniciar un ride en estado 'ready'")
+            if ride.get("status") != "ready":
+                raise BusinessValidacion("Solo se puede iniciar un ride en estado 'ready'")
 
-        participantes = ride.get("participants", [])
-        for p in participantes:
-            if p.get("status") not in ["rejected", "confirmed"]:
-                raise BusinessValidacion(
-                    "Solo se puede iniciar un ride cuando todas las solicitudes estén en estado 'rejected' o 'confirmed'")
-
-        for p in participantes:
-            if p.get("status") == "confirmed":
-                alias_participante = p.get("participant", {}).get("alias")
-                if alias_participante in presentes:
-                    p["status"] = "inprogress"
-                else:
-                    p["status"] = "missing"
+            participantes = ride.get("participants", [])
+            for p in participantes:
+                if p.get("status") not in ["rejected", "confirmed"]:
+                    raise BusinessValidacion(
+                        "Solo se puede iniciar un ride cuando todas las solicitudes estén en estado 'rejected' o 'confirmed'")
 
-        ride["status"] = "inprogress"
+            for p in participantes:
+                if p.get("status") == "confirmed":
+                    alias_participante = p.get("participant", {}).get("alias")
+                    if alias_participante in presentes:
+                        p["status"] = "inprogress"
+                    else:
+                        p["status"] = "missing"
 
-        data_handler.save_data()
+            ride["status"] = "inprogress"
+            particion.update_entity_filter("Ride", {"id": rideid},
+                                        {"participants": participantes, "status": ride["status"]})
+            particion.save_data()
 
-        return jsonify({"message": "Ride iniciado exitosamente", "ride": ride}), 200
+        EVENT_BUS.publish("started", ride)
+        return jsonify({"message": "Ride iniciado exitosamente", "ride": data_handler.expand("Ride", ride)}), 200
 
     except Exception as error:
         return handler_error(error)
@@ -389,30 +397,34 @@ def start_ride(alias, rideid):
 @app.route('/usuarios/<alias>/rides/<int:rideid>/end', methods=['POST'])
 def end_ride(alias, rideid):
     try:
-        usuarios = data_handler.get_entities("User") or []
-        conductor = next((u for u in usuarios if u.get("alias") == alias), None)
-        if not conductor:
-            raise NotFound(f"Usuario conductor '{alias}' no encontrado")
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            conductor = particion.get_by_key("User", alias)
+            if not conductor:
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        ride = next((r for r in rides if r.get("id") == rideid and r.get("rideDriver", {}).get("alias") == alias), None)
+            ride = particion.get_by_key("Ride", rideid)
 
-        if not ride:
-            raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
-
-        if ride.get("status") != "inprogress":
-            raise BusinessValidacion("Solo se puede terminar un ride en estado 'inprogress'")
+            if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
 
-        participantes = ride.get("participants", [])
-        for p in participantes:
-            if p.get("status") == "inprogress":
-                p["status"] = "notmarked"
+            if ride.get("status") != "inprogress":
+                raise BusinessValidacion("Solo se puede terminar un ride en estado 'inprogress'")
 
-        ride["status"] = "completed"
+            participantes = ride.get("participants", [])
+            for p in participantes:
+                if p.get("status") == "inprogress":
+                    p["status"] = "notmarked"
 
-        data_handler.save_data()
+            ride["status"] = "completed"
+            particion.update_entity_filter("Ride", {"id": rideid},
+                                        {"participants": participantes, "status": ride["status"]})
+            # terminado ya no cambia: sale de memoria al archivo
+            particion.archive_rides([rideid])
+            particion.save_data()
 
-        return jsonify({"message": "Ride terminado exitosamente", "ride": ride}), 200
+        EVENT_BUS.publish("ended", ride)
+        return jsonify({"message": "Ride terminado exitosamente", "ride": data_handler.expand("Ride", ride)}), 200
 
     except Exception as error:
         return handler_error(error)
@@ -429,39 +441,41 @@ def unload_participant(alias, rideid):
         if not alias_participante:
             raise BadRequest("El alias del participante es requerido")
 
-        usuarios = data_handler.get_entities("User") or []
-        conductor = next((u for u in usuarios if u.get("alias") == alias), None)
-        if not conductor:
-            raise NotFound(f"Usuario conductor '{alias}' no encontrado")
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            conductor = particion.get_by_key("User", alias)
+            if not conductor:
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
 
-        rides = data_handler.get_entities("Ride") or []
-        ride = next((r for r in rides if r.get("id") == rideid and r.get("rideDriver", {}).get("alias") == alias), None)
+            ride = particion.get_by_key("Ride", rideid)
 
-        if not ride:
-            raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
+            if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
 
-        if ride.get("status") != "inprogress":
-            raise BusinessValidacion("Solo se puede bajar de un ride en estado 'inprogress'")
+            if ride.get("status") != "inprogress":
+                raise BusinessValidacion("Solo se puede bajar de un ride en estado 'inprogress'")
 
-        participantes = ride.get("participants", [])
-        participacion = None
-        for p in participantes:
-            if p.get("participant", {}).get("alias") == alias_participante:
-                participacion = p
-                break
+            participantes = ride.get("participants", [])
+            participacion = None
+            for p in participantes:
+                if p.get("participant", {}).get("alias") == alias_participante:
+                    participacion = p
+                    break
 
-        if not participacion:
-            raise NotFound(f"Participante '{alias_participante}' no encontrado en este ride")
+            if not participacion:
+                raise NotFound(f"Participante '{alias_participante}' no encontrado en este ride")
 
-        if participacion.get("status") != "inprogress":
-            raise BusinessValidacion("Solo se puede bajar un participante en estado 'inprogress'")
+            if participacion.get("status") != "inprogress":
+                raise BusinessValidacion("Solo se puede bajar un participante en estado 'inprogress'")
 
-        participacion["status"] = "completed"
+            participacion["status"] = "completed"
 
-        data_handler.save_data()
+            particion.update_entity_filter("Ride", {"id": rideid}, {"participants": participantes})
+            particion.save_data()
 
+        EVENT_BUS.publish("unloaded", ride, alias_participante, status="completed")
         return jsonify({"message": f"Participante '{alias_participante}' bajó del ride exitosamente",
-                        "participacion": participacion}), 200
+                        "participacion": data_handler.expand("RideParticipation", participacion)}), 200
 
     except Exception as error:
         return handler_error(error)
@@ -470,10 +484,82 @@ def unload_participant(alias, rideid):
 @app.route('/rides', methods=['GET'])
 def get_active_rides():
     try:
-        rides = data_handler.get_entities("Ride") or []
-        rides_activos = [ride for ride in rides if ride.get("status") == "ready"]
+        paginacion = parse_pagination(request.args)
+        ventana = parse_time_window(request.args)
+        if paginacion and paginacion["stream"] and not ventana:
+            return Response(stream_entities(data_handler, "Ride", {"status": "ready"}, offset=paginacion["offset"],
+                                            after=paginacion["after"]), mimetype="application/json")
+
+        def construir():
+            # cualquier ride puede entrar o salir de la lista, y join trae datos de usuarios
+            dependencias = {("Ride", "*"), ("User", "*")}
+            if ventana:
+                # ?from=...&to=...&limit=N: los proximos rides de la ventana
+                # por fecha de salida, sacados del indice ordenado
+                rides_activos = data_handler.query(
+                    "Ride", {"status": "ready", "rideDateAndTime": ventana},
+                    limit=paginacion["limit"] if paginacion else MAX_LIMIT, order_by="rideDateAndTime")
+                rides_activos = data_handler.join("Ride", rides_activos)
+                return ({"message": f"Se encontraron {len(rides_activos)} rides activos", "rides": rides_activos},
+                        dependencias, None)
+            if paginacion:
+                rides_activos, siguiente = get_page(data_handler, "Ride", {"status": "ready"}, paginacion)
+                return ({"message": f"Se encontraron {len(rides_activos)} rides activos",
+                         "rides": rides_activos, "nextCursor": siguiente},
+                        dependencias, {"X-Next-Cursor": siguiente} if siguiente else None)
+
+            rides_activos = data_handler.get_entities_filter("Ride", {"status": "ready"}) or []
+            rides_activos = data_handler.join("Ride", rides_activos)
+
+            return ({"message": f"Se encontraron {len(rides_activos)} rides activos", "rides": rides_activos},
+                    dependencias, None)
+
+        return respuesta_cacheada(response_cache.get_or_build(("active_rides", request.query_string), construir))
+
+    except Exception as error:
+        return handler_error(error)
+
+
+@app.route('/rides/available', methods=['GET'])
+def get_available_rides():
+    try:
+        asientos = parse_seats(request.args)
+        paginacion = parse_pagination(request.args)
+        limite = paginacion["limit"] if paginacion else MAX_LIMIT
+
+        def construir():
+            # ?seats=N: rides activos con al menos N asientos libres, sacados
+            # de los buckets por asientos libres sin recorrer participantes
+            rides = data_handler.join("Ride", data_handler.rides_with_free_seats(asientos, limit=limite))
+            return ({"message": f"Se encontraron {len(rides)} rides con {asientos} asientos libres o más",
+                     "rides": rides}, {("Ride", "*"), ("User", "*")}, None)
+
+        return respuesta_cacheada(response_cache.get_or_build(("available_rides", request.query_string), construir))
+
+    except Exception as error:
+        return handler_error(error)
 
-        return jsonify({"message": f"Se encontraron {len(rides_activos)} rides activos", "rides": rides_activos}), 200
+
+@app.route('/rides/search', methods=['GET'])
+def search_rides():
+    try:
+        texto = request.args.get("q", "").strip()
+        if not texto:
+            raise BadRequest("El parámetro 'q' es requerido")
+        paginacion = parse_pagination(request.args)
+        limite = paginacion["limit"] if paginacion else MAX_LIMIT
+
+        def construir():
+            # ?q=javier pra: rides activos cuyo destino o el de algun participante
+            # tiene esas palabras (pueden estar incompletas), mejores primero
+            encontrados = data_handler.search("Ride", texto, {"status": "ready"}, limit=limite)
+            rides = data_handler.join("Ride", [ride for ride, _ in encontrados])
+            for ride, (_, puntaje) in zip(rides, encontrados):
+                ride["score"] = round(puntaje, 4)
+            return ({"message": f"Se encontraron {len(rides)} rides", "rides": rides},
+                    {("Ride", "*"), ("User", "*")}, None)
+
+        return respuesta_cacheada(response_cache.get_or_build(("search_rides", request.query_string), construir))
 
     except Exception as error:
         return handler_error(error)
@@ -493,16 +579,198 @@ def create_user():
         if not alias or not nombre:
             raise BadRequest("Alias y nombre son requeridos")
 
-        usuarios = data_handler.get_entities("User") or []
-        for usuario in usuarios:
-            if usuario.get("alias") == alias:
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            if particion.get_by_key("User", alias):
                 raise BusinessValidacion("El alias ya está registrado")
 
-        nuevo_usuario = User(alias=alias, name=nombre, car_plate=placa)
-        data_handler.add_entity("User", nuevo_usuario)
-        data_handler.save_data()
+            nuevo_usuario = User(alias=alias, name=nombre, car_plate=placa)
+            particion.add_entity("User", nuevo_usuario)
+            particion.save_data()
+
+            return jsonify({"message": "Usuario creado correctamente", "usuario": nuevo_usuario.to_dict()}), 201
+
+    except Exception as error:
+        return handler_error(error)
+
+
+@app.route('/usuarios/bulk', methods=['POST'])
+def create_users_bulk():
+    try:
+        filas = leer_lote(request.get_json(), "usuarios")
+
+        with data_handler.transaction():
+            errores, usuarios, vistos = [], [], set()
+            for i, fila in enumerate(filas):
+                if not isinstance(fila, dict) or not fila.get("alias") or not fila.get("name"):
+                    errores.append({"fila": i, "error": "Alias y nombre son requeridos"})
+                    continue
+                alias = fila["alias"]
+                if alias in vistos or data_handler.get_by_key("User", alias):
+                    errores.append({"fila": i, "error": f"El alias '{alias}' ya está registrado"})
+                    continue
+                vistos.add(alias)
+                usuarios.append(User(alias=alias, name=fila["name"], car_plate=fila.get("car_plate")).to_dict())
+
+            if errores:
+                return errores_de_lote(errores)
+
+            data_handler.add_entities("User", usuarios)
+            data_handler.save_data()
+
+            return jsonify({"message": f"Se crearon {len(usuarios)} usuarios"}), 201
+
+    except Exception as error:
+        return handler_error(error)
+
+
+@app.route('/rides/bulk', methods=['POST'])
+def create_rides_bulk():
+    try:
+        filas = leer_lote(request.get_json(), "rides")
+
+        with data_handler.transaction():
+            errores, validas, conductores = [], [], {}
+            for i, fila in enumerate(filas):
+                if not isinstance(fila, dict):
+                    errores.append({"fila": i, "error": "Faltan datos obligatorios"})
+                    continue
+                fecha_ride = fila.get("rideDateAndTime")
+                direccion = fila.get("finalAddress")
+                espacios = fila.get("allowedSpaces")
+                alias_conductor = fila.get("driverAlias")
+                if not all([fecha_ride, direccion, espacios, alias_conductor]):
+                    errores.append({"fila": i, "error": "Faltan datos obligatorios"})
+                    continue
+                try:
+                    fecha_ride = datetime.fromisoformat(fecha_ride)
+                    espacios = int(espacios)
+                except (TypeError, ValueError):
+                    errores.append({"fila": i, "error": "La fecha o los espacios no tienen el formato correcto"})
+                    continue
+                if alias_conductor not in conductores:
+                    conductores[alias_conductor] = data_handler.get_by_key("User", alias_conductor) is not None
+                if not conductores[alias_conductor]:
+                    errores.append({"fila": i, "error": f"Conductor '{alias_conductor}' no encontrado"})
+                    continue
+                validas.append((fecha_ride, direccion, espacios, alias_conductor))
+
+            if errores:
+                return errores_de_lote(errores)
+
+            # un solo bloque de ids por particion: cada ride toma el suyo de
+            # la particion de su conductor
+            por_particion = {}
+            for i, (_, _, _, alias_conductor) in enumerate(validas):
+                por_particion.setdefault(data_handler.shard(alias_conductor), []).append(i)
+            ids = {}
+            for particion, filas_particion in por_particion.items():
+                primer_id = particion.next_id("Ride", len(filas_particion))
+                for j, i in enumerate(filas_particion):
+                    ids[i] = primer_id + j * particion.id_step
+            rides = [Ride(rideDateAndTime=fecha_ride, finalAddress=direccion, allowedSpaces=espacios,
+                          rideDriver={"alias": alias_conductor}, rideId=ids[i])
+                     for i, (fecha_ride, direccion, espacios, alias_conductor) in enumerate(validas)]
+            data_handler.add_entities("Ride", rides)
+            data_handler.save_data()
+
+            return jsonify({"message": f"Se crearon {len(rides)} rides",
+                            "ids": [ride.id for ride in rides]}), 201
 
-        return jsonify({"message": "Usuario creado correctamente", "usuario": nuevo_usuario.to_dict()}), 201
+    except Exception as error:
+        return handler_error(error)
+
+
+@app.route('/usuarios/<alias>/rides/decisions', methods=['POST'])
+def decide_participants_bulk(alias):
+    try:
+        filas = leer_lote(request.get_json(), "decisiones")
+
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            if not particion.get_by_key("User", alias):
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
+
+            errores, por_ride = [], {}
+            for i, fila in enumerate(filas):
+                if not isinstance(fila, dict) or not isinstance(fila.get("rideId"), int) \
+                        or not fila.get("participantAlias") or fila.get("decision") not in DECISIONES:
+                    errores.append({"fila": i, "error": "Se requiere rideId, participantAlias y decision "
+                                                        "('accept', 'reject' o 'unload')"})
+                    continue
+                por_ride.setdefault(fila["rideId"], []).append((i, fila["participantAlias"], fila["decision"]))
+
+            operaciones, eventos = [], []
+            for ride_id, decisiones in por_ride.items():
+                ride = particion.get_by_key("Ride", ride_id)
+                if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                    errores.extend({"fila": fila, "error": f"Ride con ID {ride_id} no encontrado para el usuario {alias}"}
+                                   for fila, _, _ in decisiones)
+                    continue
+                participantes, errores_ride = decidir_participaciones(ride, decisiones)
+                errores.extend(errores_ride)
+                operaciones.append({"op": "update", "filters": {"id": ride_id},
+                                    "updates": {"participants": participantes}})
+                eventos.extend((dict(ride, participants=participantes), alias_participante, decision)
+                               for _, alias_participante, decision in decisiones)
+
+            if errores:
+                return errores_de_lote(errores)
+
+            particion.batch("Ride", operaciones)
+            particion.save_data()
+
+        for ride, alias_participante, decision in eventos:
+            tipo, estado = DECISIONES[decision]
+            EVENT_BUS.publish(tipo, ride, alias_participante, status=estado)
+        return jsonify({"message": f"Se aplicaron {len(filas)} decisiones en {len(operaciones)} rides"}), 200
+
+    except Exception as error:
+        return handler_error(error)
+
+
+@app.route('/usuarios/<alias>/rides/<int:rideid>/decisions', methods=['POST'])
+def decide_ride_participants(alias, rideid):
+    # accept/reject/unload de varios participantes de un ride: una validacion,
+    # un chequeo de capacidad y una escritura; si una falla no se aplica ninguna
+    try:
+        filas = leer_lote(request.get_json(), "decisiones")
+
+        errores, decisiones = [], []
+        for i, fila in enumerate(filas):
+            if not isinstance(fila, dict) or not fila.get("participantAlias") or fila.get("decision") not in DECISIONES:
+                errores.append({"fila": i, "error": "Se requiere participantAlias y decision "
+                                                    "('accept', 'reject' o 'unload')"})
+                continue
+            decisiones.append((i, fila["participantAlias"], fila["decision"]))
+
+        particion = data_handler.shard(alias)
+        with particion.transaction():
+            conductor = particion.get_by_key("User", alias)
+            if not conductor:
+                raise NotFound(f"Usuario conductor '{alias}' no encontrado")
+
+            ride = particion.get_by_key("Ride", rideid)
+
+            if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+                raise NotFound(f"Ride con ID {rideid} no encontrado para el usuario {alias}")
+
+            participantes, errores_ride = decidir_participaciones(ride, decisiones)
+            errores.extend(errores_ride)
+            if errores:
+                return errores_de_lote(errores)
+
+            particion.update_entity_filter("Ride", {"id": rideid}, {"participants": participantes})
+            particion.save_data()
+
+        ride = dict(ride, participants=participantes)
+        for _, alias_participante, decision in decisiones:
+            tipo, estado = DECISIONES[decision]
+            EVENT_BUS.publish(tipo, ride, alias_participante, status=estado)
+        decididos = {alias_participante for _, alias_participante, _ in decisiones}
+        decididas = [p for p in participantes if p.get("participant", {}).get("alias") in decididos]
+        return jsonify({"message": f"Se aplicaron {len(decisiones)} decisiones en el ride {rideid}",
+                        "participaciones": data_handler.join("RideParticipation", decididas)}), 200
 
     except Exception as error:
         return handler_error(error)
@@ -528,24 +796,24 @@ def create_ride():
         except ValueError:
             raise BadRequest("La fecha no tiene el formato correcto")
 
-        usuarios = data_handler.get_entities("User") or []
-        conductor_data = next((u for u in usuarios if u.get("alias") == alias_conductor), None)
-        if not conductor_data:
-            raise NotFound("Conductor no encontrado")
+        particion = data_handler.shard(alias_conductor)
+        with particion.transaction():
+            conductor_data = particion.get_by_key("User", alias_conductor)
+            if not conductor_data:
+                raise NotFound("Conductor no encontrado")
 
-        conductor = User(alias=conductor_data["alias"], name=conductor_data["name"],
-                         car_plate=conductor_data.get("car_plate"))
+            conductor = User(alias=conductor_data["alias"], name=conductor_data["name"],
+                             car_plate=conductor_data.get("car_plate"))
 
-        rides = data_handler.get_entities("Ride") or []
-        nuevo_id = max([r.get("id", 0) for r in rides if isinstance(r, dict)], default=0) + 1
+            nuevo_id = particion.next_id("Ride")
 
-        ride = Ride(rideDateAndTime=fecha_ride, finalAddress=direccion, allowedSpaces=int(espacios),
-                    rideDriver=conductor, rideId=nuevo_id)
+            ride = Ride(rideDateAndTime=fecha_ride, finalAddress=direccion, allowedSpaces=int(espacios),
+                        rideDriver=conductor, rideId=nuevo_id)
 
-        data_handler.add_entity("Ride", ride)
-        data_handler.save_data()
+            particion.add_entity("Ride", ride)
+            particion.save_data()
 
-        return jsonify({"message": "Ride creado exitosamente", "ride": ride.to_dict()}), 201
+            return jsonify({"message": "Ride creado exitosamente", "ride": ride.to_dict()}), 201
 
     except Exception as error:
         return handler_error(error)
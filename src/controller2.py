@@ -1,109 +1,95 @@
-from flask import Flask, jsonify, request
+import atexit
+import os
+
+from flask import Flask, Response, jsonify, request
 from werkzeug.exceptions import BadRequest
 
-from src.data_handler import DataHandler
+from src.event_bus import EVENT_BUS, STREAM_CONTENT_TYPE
+from src.metrics import CONTENT_TYPE, REGISTRY, instrument
 from src.class_error import NotFound, BusinessValidacion
+from src.models.app import Ride, RideParticipation, User
+from src.pagination import parse_event_filters, parse_pagination, get_page, stream_entities
+from src.response_cache import ResponseCache, ride_dependencies
 from src.service import Service
+from src.sharded_data_handler import open_data_handler
+from src.storage_backend import free_seats
 from datetime import datetime
-from typing import List, Optional
 
 app = Flask(__name__)
-data_handler = DataHandler()
+instrument(app)
+# DATA_SHARDS como en controller.py; aca las transacciones toman todas las particiones
+data_handler = open_data_handler(shards=int(os.environ.get("DATA_SHARDS", "1")), journal=True, lazy=True, archive=True)
+atexit.register(data_handler.close)
+response_cache = ResponseCache(data_handler)
 service = Service(data_handler)
-
-
-class RideParticipation:
-    def __init__(
-            self,
-            confirmation: datetime,
-            destination: str,
-            occupiedSpaces: int,
-            participant: 'User',
-            status: str = "waiting"
-    ):
-        self.confirmation = confirmation
-        self.destination = destination
-        self.occupiedSpaces = occupiedSpaces
-        self.participant = participant
-        self.status = status
-
-    def to_dict(self):
-        return {
-            "confirmation": self.confirmation.isoformat(),
-            "destination": self.destination,
-            "occupiedSpaces": self.occupiedSpaces,
-            "participant": self.participant.to_dict(),
-            "status": self.status
-        }
-
-
-class Ride:
-    def __init__(
-            self,
-            rideDateAndTime: datetime,
-            finalAddress: str,
-            allowedSpaces: int,
-            rideDriver: 'User',
-            status: str = "ready",
-            participants: Optional[List['RideParticipation']] = None,
-            rideId: Optional[int] = None
-    ):
-        self.id = rideId
-        self.rideDateAndTime = rideDateAndTime
-        self.finalAddress = finalAddress
-        self.allowedSpaces = allowedSpaces
-        self.rideDriver = rideDriver
-        self.status = status
-        self.participants = participants if participants else []
-
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "rideDateAndTime": self.rideDateAndTime.isoformat(),
-            "finalAddress": self.finalAddress,
-            "allowedSpaces": self.allowedSpaces,
-            "rideDriver": self.rideDriver.to_dict(),
-            "status": self.status,
-            "participants": [
-                p.to_dict() if hasattr(p, "to_dict") else p for p in self.participants
-            ]
-        }
-
-
-class User:
-    def __init__(self, alias: str, name: str, car_plate: Optional[str] = None):
-        self.alias = alias
-        self.name = name
-        self.car_plate = car_plate
-        self.rides: List['RideParticipation'] = []
-
-    def to_dict(self):
-        return {
-            "alias": self.alias,
-            "name": self.name,
-            "car_plate": self.car_plate
-        }
+errores_manejados = REGISTRY.counter("http_handled_errors_total", "excepciones convertidas en respuesta JSON por tipo",
+                                     ("type",))
+# get_by_key tambien encuentra los rides archivados, pero ya no se pueden modificar
+VIAJE_ARCHIVADO = "El viaje ya terminó y está archivado; no admite cambios"
 
 
 def handler_error(error):
+    errores_manejados.inc(type=type(error).__name__)
     if isinstance(error, NotFound):
         return jsonify({"error": str(error)}), 404
     if isinstance(error, BusinessValidacion):
         return jsonify({"error": str(error)}), 422
     if isinstance(error, BadRequest):
         return jsonify({"error": str(error)}), 400
+    # un error inesperado queda en el log con su traceback, no solo en el JSON
+    app.logger.error("Error no controlado: %s", error, exc_info=error)
     return jsonify({"error": str(error)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/events', methods=['GET'])
+def obtenerEventos():
+    # server-sent events de cambios de viajes, por ?rideId= y/o ?alias=
+    try:
+        filtros = parse_event_filters(request.args, request.headers)
+        return Response(EVENT_BUS.stream(**filtros), mimetype=STREAM_CONTENT_TYPE,
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except Exception as error:
+        return handler_error(error)
+
+
+def respuesta_cacheada(entrada):
+    # 304 sin cuerpo si el cliente ya tiene esta version (If-None-Match)
+    respuesta = Response(entrada.body, mimetype="application/json", headers=entrada.headers)
+    respuesta.set_etag(entrada.etag)
+    return respuesta.make_conditional(request)
+
+
 @app.route('/All/User', methods=['GET'])
 def get_all_users():
     try:
-        users = data_handler.get_entities("User")
-        if users is None or not isinstance(users, list):
-            return jsonify({"error": "No se pudo obtener la lista de usuarios."}), 500
-        if len(users) == 0:
-            return jsonify({"message": "No hay usuarios registrados actualmente.", "usuarios": []}), 200
-        return jsonify({"message": "Todos los Usuarios", "usuarios": users}), 200
+        paginacion = parse_pagination(request.args)
+        if paginacion and paginacion["stream"]:
+            return Response(stream_entities(data_handler, "User", offset=paginacion["offset"],
+                                            after=paginacion["after"]), mimetype="application/json")
+
+        with data_handler.read():
+            siguiente = None
+            if paginacion:
+                users, siguiente = get_page(data_handler, "User", None, paginacion)
+            else:
+                users = data_handler.get_entities("User")
+            if users is None or not isinstance(users, list):
+                return jsonify({"error": "No se pudo obtener la lista de usuarios."}), 500
+            if len(users) == 0:
+                return jsonify({"message": "No hay usuarios registrados actualmente.", "usuarios": []}), 200
+            if not paginacion:
+                return jsonify({"message": "Todos los Usuarios", "usuarios": users}), 200
+            respuesta = jsonify({"message": "Todos los Usuarios", "usuarios": users, "nextCursor": siguiente})
+            if siguiente:
+                respuesta.headers["X-Next-Cursor"] = siguiente
+            return respuesta, 200
+    except BadRequest as error:
+        return handler_error(error)
     except Exception as e:
         return jsonify({"error": "Error interno al obtener usuarios", "detalle": str(e)}), 500
 
@@ -122,23 +108,22 @@ def create_user():
         if not alias or not name:
             return jsonify({"error": "Alias and name are required"}), 400
 
-        users = data_handler.get_entities("User") or []
-        for user in users:
-            if user.get("alias") == alias:
+        with data_handler.transaction():
+            if data_handler.get_by_key("User", alias):
                 raise BusinessValidacion("El alias ya está registrado")
 
-        new_user = User(alias=alias, name=name, car_plate=car_plate)
-        data_handler.add_entity("User", new_user)
-        data_handler.save_data()
+            new_user = User(alias=alias, name=name, car_plate=car_plate)
+            data_handler.add_entity("User", new_user)
+            data_handler.save_data()
 
-        return jsonify({
-            "message": "Usuario creado correctamente",
-            "usuario": {
-                "alias": new_user.alias,
-                "name": new_user.name,
-                "car_plate": new_user.car_plate
-            }
-        }), 201
+            return jsonify({
+                "message": "Usuario creado correctamente",
+                "usuario": {
+                    "alias": new_user.alias,
+                    "name": new_user.name,
+                    "car_plate": new_user.car_plate
+                }
+            }), 201
 
     except Exception as error:
         return handler_error(error)
@@ -168,36 +153,36 @@ def crearViaje():
         if estado not in ["ready", "inprogress", "done"]:
             return jsonify({"error": "Estado no permitido"}), 400
 
-        listaUsuarios = data_handler.get_entities("User") or []
-        datosConductor = next((u for u in listaUsuarios if u["alias"] == aliasConductor), None)
-        if not datosConductor:
-            return jsonify({"error": "Conductor no encontrado"}), 404
-
-        conductor = User(
-            alias=datosConductor["alias"],
-            name=datosConductor["name"],
-            car_plate=datosConductor.get("car_plate")
-        )
-
-        listaViajes = data_handler.get_entities("Ride") or []
-        nuevoId = max([v.get("id", 0) for v in listaViajes if isinstance(v, dict)], default=0) + 1
-
-        viaje = Ride(
-            rideDateAndTime=fechaHora,
-            finalAddress=direccion,
-            allowedSpaces=int(espacios),
-            rideDriver=conductor,
-            status=estado,
-            rideId=nuevoId
-        )
-
-        data_handler.add_entity("Ride", viaje)
-        data_handler.save_data()
-
-        return jsonify({
-            "mensaje": "Viaje creado con exito",
-            "viaje": viaje.to_dict()
-        }), 201
+        with data_handler.transaction():
+            datosConductor = data_handler.get_by_key("User", aliasConductor)
+            if not datosConductor:
+                return jsonify({"error": "Conductor no encontrado"}), 404
+
+            conductor = User(
+                alias=datosConductor["alias"],
+                name=datosConductor["name"],
+                car_plate=datosConductor.get("car_plate")
+            )
+
+            # el id sale de la particion del conductor, que es donde va el ride
+            nuevoId = data_handler.shard(aliasConductor).next_id("Ride")
+
+            viaje = Ride(
+                rideDateAndTime=fechaHora,
+                finalAddress=direccion,
+                allowedSpaces=int(espacios),
+                rideDriver=conductor,
+                status=estado,
+                rideId=nuevoId
+            )
+
+            data_handler.add_entity("Ride", viaje)
+            data_handler.save_data()
+
+            return jsonify({
+                "mensaje": "Viaje creado con exito",
+                "viaje": viaje.to_dict()
+            }), 201
 
     except Exception as error:
         return handler_error(error)
@@ -205,18 +190,18 @@ def crearViaje():
 
 @app.route('/usuarios/<alias>/rides', methods=['GET'])
 def obtenerViajesPorUsuario(alias):
-    try:
-        listaViajes = data_handler.get_entities("Ride") or []
-
-        viajesDelUsuario = [
-            ride for ride in listaViajes
-            if ride.get("rideDriver", {}).get("alias") == alias
-        ]
+    def construir():
+        viajesDelUsuario = data_handler.get_entities_filter("Ride", {"rideDriver.alias": alias}) or []
+        dependencias = {("Ride.driver", alias)} | ride_dependencies(viajesDelUsuario)
+        viajesDelUsuario = data_handler.join("Ride", viajesDelUsuario)
 
-        return jsonify({
+        return {
             "mensaje": f"Se encontraron {len(viajesDelUsuario)} viaje(s) del usuario '{alias}'",
             "viajes": viajesDelUsuario
-        }), 200
+        }, dependencias, None
+
+    try:
+        return respuesta_cacheada(response_cache.get_or_build(("viajes_usuario", alias), construir))
 
     except Exception as error:
         return handler_error(error)
@@ -224,47 +209,21 @@ def obtenerViajesPorUsuario(alias):
 
 @app.route('/usuarios/<alias>/rides/<int:rideId>', methods=['GET'])
 def obtenerRideConEstadisticas(alias, rideId):
-    try:
-        listaViajes = data_handler.get_entities("Ride") or []
+    def construir():
+        ride = data_handler.get_by_key("Ride", rideId)
 
-        ride = next(
-            (r for r in listaViajes
-             if r.get("id") == rideId and r.get("rideDriver", {}).get("alias") == alias),
-            None
-        )
+        if not ride or ride.get("rideDriver", {}).get("alias") != alias:
+            raise NotFound("Ride no encontrado para ese usuario")
 
-        if not ride:
-            return jsonify({"error": "Ride no encontrado para ese usuario"}), 404
-
-        participantes = ride.get("participants", [])
-
-        for p in participantes:
+        ride = data_handler.expand("Ride", ride)
+        participantes = []
+        for p in ride.get("participants", []):
             aliasParticipante = p.get("participant", {}).get("alias")
-            estadisticas = {
-                "previousRidesTotal": 0,
-                "previousRidesCompleted": 0,
-                "previousRidesMissing": 0,
-                "previousRidesNotMarked": 0,
-                "previousRidesRejected": 0
-            }
+            estadisticas = data_handler.get_participant_stats(aliasParticipante)
 
-            todosLosViajes = data_handler.get_entities("Ride") or []
-            for otroRide in todosLosViajes:
-                for participacion in otroRide.get("participants", []):
-                    part = participacion.get("participant", {})
-                    if part.get("alias") == aliasParticipante:
-                        estadisticas["previousRidesTotal"] += 1
-                        estado = participacion.get("status")
-                        if estado == "completed":
-                            estadisticas["previousRidesCompleted"] += 1
-                        elif estado == "missing":
-                            estadisticas["previousRidesMissing"] += 1
-                        elif estado == "not_marked":
-                            estadisticas["previousRidesNotMarked"] += 1
-                        elif estado == "rejected":
-                            estadisticas["previousRidesRejected"] += 1
-
-            p["participant"].update(estadisticas)
+            participante = dict(p)
+            participante["participant"] = dict(p.get("participant", {}), **estadisticas)
+            participantes.append(participante)
 
         respuesta = {
             "ride": {
@@ -277,7 +236,11 @@ def obtenerRideConEstadisticas(alias, rideId):
             }
         }
 
-        return jsonify(respuesta), 200
+        dependencias = {("Ride", rideId)} | ride_dependencies([ride], stats=True)
+        return respuesta, dependencias, None
+
+    try:
+        return respuesta_cacheada(response_cache.get_or_build(("ride_estadisticas", alias, rideId), construir))
 
     except Exception as error:
         return handler_error(error)
@@ -297,39 +260,40 @@ def join_ride(rideId):
         if not alias or not destination:
             return jsonify({"error": "Alias y destino son requeridos"}), 400
 
-        listaViajes = data_handler.get_entities("Ride") or []
-        ride = next((r for r in listaViajes if r.get("id") == rideId), None)
+        with data_handler.transaction():
+            ride = data_handler.get_by_key("Ride", rideId)
 
-        if not ride:
-            return jsonify({"error": "Viaje no encontrado"}), 404
+            if not ride:
+                return jsonify({"error": "Viaje no encontrado"}), 404
 
-        listaUsuarios = data_handler.get_entities("User") or []
-        datosUsuario = next((u for u in listaUsuarios if u["alias"] == alias), None)
+            datosUsuario = data_handler.get_by_key("User", alias)
 
-        if not datosUsuario:
-            return jsonify({"error": "Usuario no encontrado"}), 404
+            if not datosUsuario:
+                return jsonify({"error": "Usuario no encontrado"}), 404
 
-        espaciosOcupados = sum(p.get("occupiedSpaces", 1) for p in ride.get("participants", []))
-        if espaciosOcupados + occupiedSpaces > ride.get("allowedSpaces"):
-            return jsonify({"error": "No hay espacios suficientes disponibles"}), 422
+            if occupiedSpaces > free_seats(ride):
+                return jsonify({"error": "No hay espacios suficientes disponibles"}), 422
 
-        usuario = User(
-            alias=datosUsuario["alias"],
-            name=datosUsuario["name"],
-            car_plate=datosUsuario.get("car_plate")
-        )
+            usuario = User(
+                alias=datosUsuario["alias"],
+                name=datosUsuario["name"],
+                car_plate=datosUsuario.get("car_plate")
+            )
 
-        participation = RideParticipation(
-            confirmation=datetime.now(),
-            destination=destination,
-            occupiedSpaces=occupiedSpaces,
-            participant=usuario,
-            status="confirmed"
-        )
+            participation = RideParticipation(
+                confirmation=datetime.now(),
+                destination=destination,
+                occupiedSpaces=occupiedSpaces,
+                participant=usuario,
+                status="confirmed"
+            )
 
-        ride["participants"].append(participation.to_dict())
-        data_handler.save_data()
+            participantes = ride.get("participants", []) + [participation.to_dict()]
+            if not data_handler.update_entity_filter("Ride", {"id": rideId}, {"participants": participantes}):
+                raise BusinessValidacion(VIAJE_ARCHIVADO)
+            data_handler.save_data()
 
+        EVENT_BUS.publish("joined", dict(ride, participants=participantes), alias, status="confirmed")
         return jsonify({
             "mensaje": "Te has unido al viaje exitosamente",
             "participacion": participation.to_dict()
@@ -352,26 +316,29 @@ def update_participant_status(rideId, alias):
         if new_status not in valid_statuses:
             return jsonify({"error": f"Estado no válido. Estados permitidos: {valid_statuses}"}), 400
 
-        listaViajes = data_handler.get_entities("Ride") or []
-        ride = next((r for r in listaViajes if r.get("id") == rideId), None)
+        with data_handler.transaction():
+            ride = data_handler.get_by_key("Ride", rideId)
 
-        if not ride:
-            return jsonify({"error": "Viaje no encontrado"}), 404
+            if not ride:
+                return jsonify({"error": "Viaje no encontrado"}), 404
 
-        participantes = ride.get("participants", [])
-        participante_encontrado = False
+            participantes = ride.get("participants", [])
+            participante_encontrado = False
 
-        for p in participantes:
-            if p.get("participant", {}).get("alias") == alias:
-                p["status"] = new_status
-                participante_encontrado = True
-                break
+            for p in participantes:
+                if p.get("participant", {}).get("alias") == alias:
+                    p["status"] = new_status
+                    participante_encontrado = True
+                    break
 
-        if not participante_encontrado:
-            return jsonify({"error": "Participante no encontrado en este viaje"}), 404
+            if not participante_encontrado:
+                return jsonify({"error": "Participante no encontrado en este viaje"}), 404
 
-        data_handler.save_data()
+            if not data_handler.update_entity_filter("Ride", {"id": rideId}, {"participants": participantes}):
+                raise BusinessValidacion(VIAJE_ARCHIVADO)
+            data_handler.save_data()
 
+        EVENT_BUS.publish("participantStatus", ride, alias, status=new_status)
         return jsonify({
             "mensaje": "Estado del participante actualizado exitosamente",
             "alias": alias,
@@ -1,76 +1,556 @@
-import json
+import threading
+from contextlib import contextmanager
+
+from src.archive import ARCHIVED_STATUSES, RideArchive
+from src.flusher import Flusher
+from src.json_backend import JsonBackend
+from src.metrics import REGISTRY
+from src.models.records import to_dict
+from src.query import Query
+from src.rwlock import ReadWriteLock
+from src.storage_backend import SEAT_COUNTERS, get_path, seat_counters, sort_key
+
+
+def _reference(user):
+    # un usuario embebido se guarda solo como referencia a su alias
+    if isinstance(user, dict) and "alias" in user:
+        return {"alias": user["alias"]}
+    return user
+
+
+def normalize_references(entity):
+    """
+    copia de un ride (o de los campos a actualizar de un ride) con el
+    conductor y los participantes reducidos a {"alias": ...}. Si trae
+    participantes tambien trae sus contadores de asientos, asi cambian en la
+    misma escritura que cada transicion de una participacion
+    """
+    entity = dict(entity)
+    if "rideDriver" in entity:
+        entity["rideDriver"] = _reference(entity["rideDriver"])
+    if "participants" in entity:
+        entity["participants"] = [dict(p, participant=_reference(p.get("participant")))
+                                  if isinstance(p, dict) and "participant" in p else p
+                                  for p in entity["participants"] or []]
+        entity.update(seat_counters(entity["participants"]))
+    return entity
+
+
+def version_keys(name_entity, entity, primary_key):
+    """
+    claves de version que cambian cuando se muta la entidad: la entidad por
+    su clave, la coleccion completa y, en un ride, su conductor y cada
+    participante (de eso dependen los listados y las estadisticas)
+    """
+    keys = [(name_entity, "*")]
+    if primary_key is not None:
+        keys.append((name_entity, entity.get(primary_key)))
+    if name_entity == "Ride":
+        driver = entity.get("rideDriver")
+        if isinstance(driver, dict):
+            keys.append(("Ride.driver", driver.get("alias")))
+        for p in entity.get("participants") or []:
+            if isinstance(p, dict) and isinstance(p.get("participant"), dict):
+                keys.append(("Ride.participant", p["participant"].get("alias")))
+    return keys
+
+
+def join_entities(name_entity, entities, get_user):
+    """join() con get_user(alias) para leer cada usuario una sola vez"""
+    users = {}
+
+    def user(reference):
+        if not isinstance(reference, dict) or "alias" not in reference:
+            return reference
+        alias = reference["alias"]
+        if alias not in users:
+            found = get_user(alias)
+            users[alias] = dict(reference, **found) if found else reference
+        return dict(users[alias])
+
+    def participation(p):
+        return dict(p, participant=user(p.get("participant"))) if isinstance(p, dict) else p
+
+    if name_entity == "Ride":
+        # los contadores de asientos son internos y no salen en la respuesta
+        return [dict({k: v for k, v in ride.items() if k not in SEAT_COUNTERS},
+                     rideDriver=user(ride.get("rideDriver")),
+                     participants=[participation(p) for p in ride.get("participants") or []])
+                for ride in entities]
+    if name_entity == "RideParticipation":
+        return [participation(p) for p in entities]
+    return list(entities)
+
+
+class Snapshot:
+    """
+    vista de solo lectura de los datos en un momento (ver
+    DataHandler.snapshot). Se lee sin locks: las mutaciones posteriores
+    arman registros nuevos y no tocan los de la vista. No incluye los rides
+    archivados
+    """
+
+    def __init__(self, entities, primary_keys):
+        self._entities = entities
+        self.primary_keys = primary_keys
+        self._by_key = {}
+
+    def has_entity(self, name_entity):
+        return name_entity in self._entities
+
+    def get_entities(self, name_entity):
+        if name_entity not in self._entities:
+            return None
+        return [to_dict(entity) for entity in self._entities[name_entity]]
+
+    def get_by_key(self, name_entity, key):
+        if name_entity not in self.primary_keys:
+            raise KeyError(f"La entidad '{name_entity}' no tiene clave primaria")
+        index = self._by_key.get(name_entity)
+        if index is None:
+            # el indice por clave se arma la primera vez que se usa
+            pk = self.primary_keys[name_entity]
+            index = self._by_key[name_entity] = {entity.get(pk): entity
+                                                 for entity in self._entities.get(name_entity, ())}
+        return to_dict(index.get(key))
+
+    def query(self, name_entity, where, limit=None, order_by=None):
+        """como DataHandler.query, recorriendo la vista"""
+        query = Query(where)
+        found = query.filter(self._entities.get(name_entity, ()), None if order_by else limit)
+        if order_by is not None:
+            found = sorted(found, key=lambda entity: sort_key(get_path(entity, order_by)))[:limit]
+        return [to_dict(entity) for entity in found]
+
+    def join(self, name_entity, entities):
+        return join_entities(name_entity, entities, lambda alias: self.get_by_key("User", alias))
+
+
+OPERATION_SECONDS = REGISTRY.histogram("datahandler_operation_seconds", "duracion de las operaciones de DataHandler",
+                                       ("operation",))
+
+# cuando save_data espera a que lo guardado llegue a disco
+DURABILITY = ("request", "interval", "shutdown")
 
 
 class DataHandler:
-    def __init__(self, filename='data.json'):
-        self.filename = filename
+    """
+    punto de acceso a los datos para los controladores. Serializa el acceso
+    entre hilos y delega el almacenamiento en un backend: por defecto
+    JsonBackend sobre data.json, o SQLiteBackend para compartir una base
+    entre varios procesos.
+
+    Las escrituras a disco las hace un hilo que junta los save_data() de
+    varios requests en una sola (group commit). Con durability="request"
+    cada save_data espera esa escritura, con "interval" se escribe cada
+    flush_interval_ms y con "shutdown" solo al llamar close().
 
-        self.dict_entities = {
-            "entities": [],
-            "User":[],
-            "Ride":[]
-        }
+    Con archive=True los rides terminados (ARCHIVED_STATUSES) salen de la
+    memoria a un archivo de solo agregado, <filename>.archive (ver
+    RideArchive). get_by_key, get_entities_filter y get_participant_stats
+    los siguen viendo; los listados de rides activos solo recorren los que
+    quedan en memoria.
+    """
+
+    def __init__(self, filename='data.json', journal=False, compact_every=1000, backend=None, lazy=False,
+                 durability="request", flush_interval_ms=50, archive=False, shard=(0, 1)):
+        if durability not in DURABILITY:
+            raise ValueError(f"Durabilidad no válida: {durability}. Permitidas: {DURABILITY}")
+        self.filename = filename
+        # (indice, total) cuando es una particion de ShardedDataHandler: sus
+        # ids son los congruentes con el indice modulo el total
+        self.shard_index, self.shard_count = shard
+        self._lock = ReadWriteLock()
+        # dos hilos lectores no deben escribir el archivo a la vez
+        self._save_lock = threading.Lock()
+        if backend is None:
+            backend = JsonBackend(filename, journal=journal, compact_every=compact_every, lazy=lazy)
+        self.backend = backend
+        self.primary_keys = backend.primary_keys
+        # contadores de version por clave (ver version_keys), para que los
+        # caches sepan si lo que leyeron cambio
+        self._versions = {}
+        self.durability = durability
+        self._flusher = Flusher(self._flush, flush_interval_ms / 1000 if durability == "interval" else None)
+        # tickets que el hilo espera al soltar el lock (ver save_data)
+        self._local = threading.local()
+        self.archive = RideArchive(filename + '.archive') if archive else None
         self.load_data()
 
-    def save_data(self):
-        with open(self.filename, 'w') as f:
-            json.dump(self.dict_entities, f)
+    @property
+    def shared(self):
+        """True si otros procesos escriben el mismo almacenamiento (ver StorageBackend.shared)"""
+        return self.backend.shared
+
+    @property
+    def id_step(self):
+        """distancia entre los ids seguidos que reserva next_id(count)"""
+        return self.shard_count
+
+    def shard(self, key):
+        """
+        el DataHandler que guarda la clave de particion key (alias de un
+        usuario o del conductor de un ride); sin particiones, el mismo
+        """
+        return self
+
+    @contextmanager
+    def read(self):
+        """
+        vista consistente para varias lecturas seguidas: las escrituras
+        esperan hasta que termine el bloque, las otras lecturas no
+        """
+        with self._lock.read():
+            with self.backend.read_transaction():
+                yield
+        self._wait_deferred()
+
+    @contextmanager
+    def transaction(self):
+        """
+        bloque exclusivo para validar y mutar sin que otro hilo cambie los
+        datos en medio (chequeos de capacidad, transiciones de estado)
+        """
+        with self._lock.write():
+            with self.backend.transaction():
+                yield
+        self._wait_deferred()
+
+    @OPERATION_SECONDS.timed(operation="save_data")
+    def save_data(self, wait=None):
+        """
+        pide persistir los cambios y devuelve un FlushTicket. Con wait=None
+        espera segun la durabilidad configurada; wait=True espera siempre
+        (adelantando la escritura) y wait=False vuelve enseguida. Dentro de
+        transaction() o read() la espera se hace al soltar el lock, porque
+        la escritura necesita leer los datos
+        """
+        if wait is None:
+            wait = self.durability == "request"
+        ticket = self._flusher.request(urgent=wait)
+        if wait:
+            if self._lock.held():
+                self._local.ticket = ticket
+            else:
+                ticket.wait()
+        return ticket
 
+    def _wait_deferred(self):
+        ticket = getattr(self._local, "ticket", None)
+        if ticket is not None and not self._lock.held():
+            self._local.ticket = None
+            ticket.wait()
+
+    @OPERATION_SECONDS.timed(operation="flush")
+    def _flush(self):
+        # con el lock solo se toma lo que hay que escribir; la serializacion
+        # y el fsync no frenan a los escritores
+        with self._save_lock:
+            with self.read():
+                write = self.backend.prepare_save()
+            write()
+
+    def snapshot(self):
+        """
+        Snapshot del estado actual para leer sin locks ni copias hasta que se
+        use: varias lecturas sobre el quedan consistentes entre si aunque
+        otros hilos escriban. Con JsonBackend se arma una vez por mutacion
+        """
+        with self.read():
+            return Snapshot(self.backend.freeze(), self.primary_keys)
+
+    def close(self):
+        """
+        escribe lo pendiente y cierra el backend; llamar al apagar el proceso
+        (los controladores lo registran con atexit)
+        """
+        self._flusher.close()
+        with self._lock.write():
+            self.backend.close()
+            if self.archive is not None:
+                self.archive.close()
+
+    @OPERATION_SECONDS.timed(operation="load_data")
     def load_data(self):
-        try:
-            with open(self.filename, 'r') as f:
-                data = json.load(f)
-                for k in data.keys():
-                    self.dict_entities[k] = data.get(k, [])
-        except FileNotFoundError:
-            for k in self.dict_entities.keys():
-                self.dict_entities[k] = []
+        with self._lock.write():
+            self.backend.load()
+            self._touch_all()
+        if not self.backend.normalized and self.normalize_rides():
+            # archivo escrito antes de guardar referencias: se migra una vez y
+            # el snapshot nuevo ya queda marcado como normalizado
+            self.save_data(wait=True)
+            self.compact()
+        if self.archive is not None:
+            # rides que terminaron antes de activar el archivo, o que una
+            # caida dejo en los dos lados
+            if self.archive_rides():
+                self.save_data(wait=False)
+
+    def archive_rides(self, ride_ids=None):
+        """
+        mueve al archivo los rides terminados (todos, o los de ride_ids que
+        lo esten) y los saca del backend. Devuelve cuantos salieron; el
+        llamador persiste el cambio con save_data
+        """
+        if self.archive is None:
+            return 0
+        where = {"status": {"in": list(ARCHIVED_STATUSES)}}
+        if ride_ids is not None:
+            where["id"] = {"in": list(ride_ids)}
+        with self.transaction():
+            if not self.backend.has_entity("Ride"):
+                return 0
+            rides = self.backend.query("Ride", Query(where))
+            if not rides:
+                return 0
+            # primero al disco del archivo: si algo falla despues el ride
+            # queda en los dos lados y la proxima carga lo vuelve a sacar
+            self.archive.append(rides)
+            self.backend.batch("Ride", [{"op": "delete", "filters": {"id": {"in": [r.get("id") for r in rides]}}}])
+            self._touch("Ride", rides)
+            return len(rides)
+
+    def version(self, key):
+        """version actual de una clave de version_keys; sube con cada mutacion"""
+        return self._versions.get(key, 0) + self._versions.get("*", 0)
 
+    def _touch(self, name_entity, entities):
+        pk = self.primary_keys.get(name_entity)
+        for entity in entities:
+            for key in version_keys(name_entity, entity, pk):
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _touch_all(self):
+        self._versions["*"] = self._versions.get("*", 0) + 1
+
+    @OPERATION_SECONDS.timed(operation="add_entity")
     def add_entity(self, name_entity, entity):
-        if name_entity not in self.dict_entities:
-            self.dict_entities[name_entity] = []
         if hasattr(entity, 'to_dict') and callable(entity.to_dict):
-            self.dict_entities[name_entity].append(entity.to_dict())
-        elif isinstance(entity, dict):
-            self.dict_entities[name_entity].append(entity)
-        else:
+            entity = entity.to_dict()
+        elif not isinstance(entity, dict):
             raise TypeError("Entidad no válida: debe ser un dict o tener .to_dict()")
+        if name_entity == "Ride":
+            entity = normalize_references(entity)
+        with self.transaction():
+            self.backend.add(name_entity, entity)
+            self._touch(name_entity, [entity])
 
+    @OPERATION_SECONDS.timed(operation="batch")
+    def batch(self, name_entity, operations):
+        """
+        aplica un lote de mutaciones sobre un tipo de entidad en una sola
+        transaccion: {"op": "add", "data": entidad}, {"op": "update",
+        "filters": ..., "updates": ...} o {"op": "delete", "filters": ...}.
+        Los datos ya deben estar validados; el lote se persiste con un solo
+        save_data del llamador
+        """
+        prepared = []
+        for operation in operations:
+            operation = dict(operation)
+            if operation.get("op") not in ("add", "update", "delete"):
+                raise ValueError(f"Operación desconocida: {operation.get('op')}")
+            if operation["op"] == "add":
+                data = operation["data"]
+                if hasattr(data, 'to_dict') and callable(data.to_dict):
+                    data = data.to_dict()
+                operation["data"] = normalize_references(data) if name_entity == "Ride" else data
+            elif operation["op"] == "update" and name_entity == "Ride":
+                operation["updates"] = normalize_references(operation["updates"])
+            prepared.append(operation)
 
-    def _get_by_filter(self, entities,filters):
-        filtered_tasks = entities
-        for key, value in filters.items():
-            filtered_tasks = [t for t in filtered_tasks if t.get(key) == value]
-        return filtered_tasks
-
-    def _delete_by_filter(self, entities, filters):
-        entities = [t for t in entities if not all(t.get(k) == v for k, v in filters.items())]
-        return entities
+        with self.transaction():
+            touched = []
+            for operation in prepared:
+                if operation["op"] == "add":
+                    touched.append(operation["data"])
+                elif self.backend.has_entity(name_entity):
+                    previous = self.backend.find(name_entity, operation["filters"])
+                    touched.extend(previous)
+                    if operation["op"] == "update":
+                        # tambien las claves de lo que se escribe, por si la
+                        # entidad la agrego una operacion anterior del lote
+                        touched.append(operation["updates"])
+                        touched.extend(dict(entity, **operation["updates"]) for entity in previous)
+            self.backend.batch(name_entity, prepared)
+            self._touch(name_entity, touched)
 
-    def _update_by_filter(self, entities, filters, updates):
-        for task in entities:
-            if all(task.get(k) == v for k, v in filters.items()):
-                task.update(updates)
-        return entities
+    def add_entities(self, name_entity, entities):
+        """agrega muchas entidades como un solo lote"""
+        self.batch(name_entity, [{"op": "add", "data": entity} for entity in entities])
 
+    @OPERATION_SECONDS.timed(operation="get_entities_filter")
     def get_entities_filter(self, name_entity, filters):
-        if name_entity in self.dict_entities:
-            return self._get_by_filter(self.dict_entities[name_entity], filters)
+        with self.read():
+            if self.backend.has_entity(name_entity):
+                found = self.backend.find(name_entity, filters)
+                if name_entity == "Ride" and self.archive is not None:
+                    hot = {ride.get("id") for ride in found}
+                    found += [ride for ride in self.archive.find(filters) if ride.get("id") not in hot]
+                return found
 
+    @OPERATION_SECONDS.timed(operation="delete_entity_filter")
     def delete_entity_filter(self, name_entity, filters):
-        if name_entity in self.dict_entities:
-            self.dict_entities[name_entity] = self._delete_by_filter(self.dict_entities[name_entity], filters)
+        with self.transaction():
+            if self.backend.has_entity(name_entity):
+                previous = self.backend.find(name_entity, filters)
+                self.backend.delete(name_entity, filters)
+                self._touch(name_entity, previous)
 
+    @OPERATION_SECONDS.timed(operation="update_entity_filter")
     def update_entity_filter(self, name_entity, filters, updates):
-        if name_entity in self.dict_entities:
-            self.dict_entities[name_entity] = self._update_by_filter(self.dict_entities[name_entity], filters, updates)
+        """
+        aplica updates a las entidades que cumplen filters y devuelve cuantas
+        eran. Los rides archivados no se modifican (ni cuentan): el archivo es
+        de solo agregado
+        """
+        if name_entity == "Ride":
+            updates = normalize_references(updates)
+        with self.transaction():
+            if not self.backend.has_entity(name_entity):
+                return 0
+            previous = self.backend.find(name_entity, filters)
+            self.backend.update(name_entity, filters, updates)
+            self._touch(name_entity, previous + [dict(entity, **updates) for entity in previous])
+            return len(previous)
 
+    @OPERATION_SECONDS.timed(operation="query")
+    def query(self, name_entity, where, limit=None, order_by=None):
+        """
+        entidades que cumplen where, con rutas anidadas ("rideDriver.alias",
+        "participants[].participant.alias") y operadores eq, in, gt, gte,
+        lt, lte y exists (ver Query). Se compila una vez, se recorre en una
+        pasada que corta en limit y usa los indices que haya. Con order_by
+        salen ordenadas por ese campo (sin valor al final); si el campo tiene
+        indice ordenado un rango sobre el se resuelve con busqueda binaria
+        """
+        query = Query(where)
+        with self.read():
+            if not self.backend.has_entity(name_entity):
+                return []
+            return self.backend.query(name_entity, query, limit, order_by)
 
+    @OPERATION_SECONDS.timed(operation="search")
+    def search(self, name_entity, text, where=None, limit=None):
+        """
+        busqueda de texto: (entidad, puntaje) de las entidades cuyos campos
+        de texto (StorageBackend.text_indexes) tienen todas las palabras de
+        text, o palabras que empiezan con ellas, y que cumplen where; las
+        mejores primero
+        """
+        query = Query(where) if where else None
+        with self.read():
+            if not self.backend.has_entity(name_entity):
+                return []
+            return self.backend.search(name_entity, text, query, limit)
 
+    @OPERATION_SECONDS.timed(operation="rides_with_free_seats")
+    def rides_with_free_seats(self, seats, limit=None):
+        """
+        rides ready con al menos seats asientos sin confirmar ni pedir, los
+        de menos asientos libres primero
+        """
+        with self.read():
+            if not self.backend.has_entity("Ride"):
+                return []
+            return self.backend.rides_with_free_seats(seats, limit)
+
+    @OPERATION_SECONDS.timed(operation="get_entities")
     def get_entities(self, name_entity):
-        if name_entity in self.dict_entities:
-            return self.dict_entities[name_entity]
+        with self.read():
+            if self.backend.has_entity(name_entity):
+                return self.backend.all(name_entity)
         return None
 
-    def __del__(self):
-        self.save_data()
+    @OPERATION_SECONDS.timed(operation="get_entities_page")
+    def get_entities_page(self, name_entity, filters=None, limit=None, offset=0, after=None):
+        """
+        pagina de entidades: por limit/offset o continuando desde after, la
+        posicion que devolvio la pagina anterior. Devuelve (entidades,
+        siguiente) con siguiente en None cuando no quedan mas
+        """
+        with self.read():
+            if not self.backend.has_entity(name_entity):
+                return None, None
+            return self.backend.page(name_entity, filters or {}, limit, offset, after)
+
+    def get_by_key(self, name_entity, key):
+        if name_entity not in self.primary_keys:
+            raise KeyError(f"La entidad '{name_entity}' no tiene clave primaria")
+        with self.read():
+            found = self.backend.get_by_key(name_entity, key)
+            if found is None and name_entity == "Ride" and self.archive is not None:
+                found = self.archive.get(key)
+            return found
+
+    def join(self, name_entity, entities):
+        """
+        copias de rides o participaciones con las referencias a usuarios
+        expandidas a los datos actuales del usuario, para armar la respuesta.
+        Una referencia a un usuario que ya no existe queda como {"alias": ...}
+        y los rides salen sin sus contadores de asientos (SEAT_COUNTERS)
+        """
+        with self.read():
+            return join_entities(name_entity, entities, lambda alias: self.backend.get_by_key("User", alias))
+
+    def expand(self, name_entity, entity):
+        """join() de una sola entidad"""
+        if entity is None:
+            return None
+        return self.join(name_entity, [entity])[0]
+
+    def normalize_rides(self):
+        """
+        reescribe los rides guardados con copias completas de los usuarios
+        (anteriores a guardar referencias) para que guarden solo el alias, y
+        agrega los contadores de asientos a los que no los tienen. load_data
+        lo llama cuando el backend avisa que hace falta (un data.json sin
+        marca de normalizado); una base SQLite anterior a las referencias se
+        migra llamandolo una vez a mano. Devuelve cuantos rides cambiaron
+        """
+        changed = 0
+        with self.transaction():
+            if not self.backend.has_entity("Ride"):
+                return changed
+            for ride in self.backend.all("Ride"):
+                references = {k: ride[k] for k in ("rideDriver", "participants") + SEAT_COUNTERS if k in ride}
+                normalized = normalize_references(references)
+                if normalized != references:
+                    self.backend.update("Ride", {"id": ride.get("id")}, normalized)
+                    changed += 1
+            self._touch_all()
+        return changed
+
+    def create_index(self, name_entity, path):
+        """
+        declara un indice secundario sobre un campo, que puede ser anidado
+        (por ejemplo "rideDriver.alias"); get_entities_filter lo usa cuando
+        el filtro incluye ese campo
+        """
+        with self.transaction():
+            self.backend.create_index(name_entity, path)
+
+    def next_id(self, name_entity, count=1):
+        """
+        siguiente valor de la secuencia de ids de una entidad; no se repite
+        entre hilos, workers ni reinicios. Con count reserva esa cantidad de
+        ids seguidos empezando por el devuelto, separados por id_step
+        """
+        if self.shard_count == 1:
+            return self.backend.next_id(name_entity, count)
+        # se reserva un bloque de count * shard_count valores y se usan los
+        # de esta particion; las otras usan otros restos, asi no chocan
+        first = self.backend.next_id(name_entity, count * self.shard_count)
+        return first + (self.shard_index - first) % self.shard_count
+
+    def get_participant_stats(self, alias):
+        """estadisticas historicas de un participante en todos los rides"""
+        with self.read():
+            stats = self.backend.participant_stats(alias)
+            if self.archive is not None:
+                for field, value in self.archive.participant_stats(alias).items():
+                    stats[field] += value
+            return stats
+
+    def compact(self, background=False):
+        with self._lock.write():
+            self.backend.compact(background)
@@ -0,0 +1,177 @@
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+from src.metrics import REGISTRY
+
+STREAM_CONTENT_TYPE = "text/event-stream"
+# segundos sin eventos antes de mandar un comentario; asi el proxy no corta
+# la conexion y se detecta al cliente que ya se fue
+KEEPALIVE_SECONDS = 15
+
+SUBSCRIBERS = REGISTRY.gauge("event_bus_subscribers", "clientes conectados al stream de eventos")
+PUBLISHED = REGISTRY.counter("event_bus_published_total", "eventos publicados por tipo", ("type",))
+
+
+def ride_aliases(ride):
+    """(conductor, participantes) de un ride, como alias"""
+    driver = (ride.get("rideDriver") or {}).get("alias")
+    participants = [(p.get("participant") or {}).get("alias") for p in ride.get("participants") or []
+                    if isinstance(p, dict)]
+    return driver, participants
+
+
+def format_event(event):
+    """un evento en el formato de server-sent events; el reset no lleva id"""
+    head = f"id: {event['id']}\n" if "id" in event else ""
+    return f"{head}event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+class Subscription:
+    """
+    eventos pendientes de un cliente, filtrados por ride y/o alias (como
+    conductor o participante). Si el cliente no los lee y se juntan mas de
+    max_pending se descartan y recibe un evento "reset": debe volver a leer
+    el estado por la API
+    """
+
+    def __init__(self, ride_id=None, alias=None, max_pending=1000):
+        self.ride_id = ride_id
+        self.alias = alias
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._reset = False
+
+    def matches(self, event):
+        if self.ride_id is not None and event["rideId"] != self.ride_id:
+            return False
+        if self.alias is not None:
+            return self.alias == event["driver"] or self.alias == event["participant"] \
+                or self.alias in event["participants"]
+        return True
+
+    def push(self, event):
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self._pending.clear()
+                self._reset = True
+            else:
+                self._pending.append(event)
+            self._cond.notify_all()
+
+    def reset(self):
+        with self._cond:
+            self._reset = True
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """los eventos pendientes; espera hasta timeout si no hay ninguno"""
+        with self._cond:
+            if not self._pending and not self._reset:
+                self._cond.wait(timeout)
+            events = list(self._pending)
+            self._pending.clear()
+            if self._reset:
+                self._reset = False
+                events.insert(0, {"type": "reset"})
+            return events
+
+
+class EventBus:
+    """
+    eventos de cambios de estado de rides y participaciones, publicados por
+    los controladores despues de cada mutacion. Cada publicacion se entrega
+    solo a las suscripciones que coinciden, asi un cliente conectado cuesta
+    lo que cambia y no lo que consulta: las suscripciones estan indexadas
+    por ride y por alias y solo se revisan las que pueden coincidir. Guarda los ultimos history eventos
+    para que un cliente que se reconecta con su ultimo id no pierda nada.
+    Vive en el proceso: cada worker tiene su bus
+    """
+
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._history = deque(maxlen=history)
+        # suscripciones por ride, por alias y sin filtro
+        self._by_ride = {}
+        self._by_alias = {}
+        self._unfiltered = set()
+
+    def publish(self, event_type, ride, participant=None, **data):
+        """
+        publica un cambio de ride (dict con su estado despues del cambio);
+        participant es el alias de la participacion que cambio, si fue una
+        """
+        driver, participants = ride_aliases(ride)
+        with self._lock:
+            self._last_id += 1
+            event = dict(data, id=self._last_id, type=event_type, rideId=ride.get("id"),
+                         rideStatus=ride.get("status"), driver=driver, participant=participant,
+                         participants=participants, at=datetime.now().isoformat())
+            self._history.append(event)
+            candidates = set(self._unfiltered) | self._by_ride.get(event["rideId"], set())
+            for alias in {driver, participant, *participants}:
+                candidates |= self._by_alias.get(alias, set())
+            for subscription in candidates:
+                if subscription.matches(event):
+                    subscription.push(event)
+        PUBLISHED.inc(type=event_type)
+        return event
+
+    def subscribe(self, ride_id=None, alias=None, last_event_id=None):
+        """
+        nueva suscripcion; con last_event_id primero recibe los eventos
+        posteriores que siguen en el historial, o un "reset" si ya salieron
+        """
+        subscription = Subscription(ride_id, alias)
+        with self._lock:
+            if last_event_id is not None and last_event_id != self._last_id:
+                # un id mayor que el ultimo es de antes de un reinicio
+                if last_event_id > self._last_id or not self._history \
+                        or self._history[0]["id"] > last_event_id + 1:
+                    subscription.reset()
+                for event in self._history:
+                    if event["id"] > last_event_id and subscription.matches(event):
+                        subscription.push(event)
+            self._index(subscription).add(subscription)
+        SUBSCRIBERS.inc()
+        return subscription
+
+    def _index(self, subscription):
+        # el conjunto donde se busca la suscripcion al publicar; con ride se
+        # usa el ride, que es el filtro mas selectivo
+        if subscription.ride_id is not None:
+            return self._by_ride.setdefault(subscription.ride_id, set())
+        if subscription.alias is not None:
+            return self._by_alias.setdefault(subscription.alias, set())
+        return self._unfiltered
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            index = self._index(subscription)
+            if subscription not in index:
+                return
+            index.discard(subscription)
+            if not index and index is not self._unfiltered:
+                key = subscription.ride_id if subscription.ride_id is not None else subscription.alias
+                (self._by_ride if subscription.ride_id is not None else self._by_alias).pop(key, None)
+        SUBSCRIBERS.dec()
+
+    def stream(self, ride_id=None, alias=None, last_event_id=None, keepalive=KEEPALIVE_SECONDS):
+        """genera el cuerpo de una respuesta text/event-stream hasta que el cliente se desconecta"""
+        subscription = self.subscribe(ride_id, alias, last_event_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                events = subscription.get(keepalive)
+                if not events:
+                    yield ": keepalive\n\n"
+                for event in events:
+                    yield format_event(event)
+        finally:
+            self.unsubscribe(subscription)
+
+
+EVENT_BUS = EventBus()
@@ -0,0 +1,117 @@
+import threading
+import time
+
+
+class FlushTicket:
+    """
+    comprobante de un pedido de guardado; wait() vuelve cuando una escritura
+    que incluye ese pedido termino
+    """
+
+    def __init__(self, flusher, seq):
+        self._flusher = flusher
+        self.seq = seq
+
+    @property
+    def done(self):
+        return self._flusher.flushed >= self.seq
+
+    def wait(self, timeout=None):
+        return self._flusher.wait(self.seq, timeout)
+
+
+class Flusher:
+    """
+    hilo que junta los pedidos de guardado de muchos requests y los persiste
+    con una sola llamada a flush(). Con interval (segundos) escribe como
+    mucho una vez por intervalo; sin interval solo escribe cuando alguien
+    espera un ticket, pide urgent o al cerrar
+    """
+
+    def __init__(self, flush, interval=None):
+        self._flush = flush
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._requested = 0
+        self.flushed = 0
+        self._urgent = False
+        self._closed = False
+        # (ultimo seq que cubria, excepcion) de la ultima escritura fallida
+        self._failed = None
+        self._last_flush = time.monotonic()
+        self._thread = None
+
+    def request(self, urgent=False):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("El flusher ya está cerrado")
+            self._requested += 1
+            ticket = FlushTicket(self, self._requested)
+            self._urgent = self._urgent or urgent
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="data-flusher", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return ticket
+
+    def wait(self, seq, timeout=None):
+        with self._cond:
+            if self.flushed < seq:
+                # quien espera un ticket no espera al intervalo
+                self._urgent = True
+                self._cond.notify_all()
+            done = self._cond.wait_for(lambda: self.flushed >= seq or self._failed_for(seq), timeout)
+            if self.flushed < seq and self._failed_for(seq):
+                raise self._failed[1]
+            return done
+
+    def _failed_for(self, seq):
+        return self._failed is not None and self._failed[0] >= seq
+
+    def close(self):
+        """escribe lo pendiente y termina el hilo"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        if self._requested > self.flushed and self._failed is not None:
+            raise self._failed[1]
+
+    def _due(self):
+        if self._urgent or self._closed:
+            return True
+        return self.interval is not None and time.monotonic() - self._last_flush >= self.interval
+
+    def _run(self):
+        with self._cond:
+            while True:
+                pending = self._requested > self.flushed
+                if not pending and self._closed:
+                    return
+                if pending and self._due():
+                    target = self._requested
+                    self._urgent = False
+                    self._cond.release()
+                    try:
+                        self._flush()
+                        error = None
+                    except Exception as e:
+                        error = e
+                    finally:
+                        self._cond.acquire()
+                    self._last_flush = time.monotonic()
+                    if error is None:
+                        self.flushed = target
+                        self._failed = None
+                    else:
+                        self._failed = (target, error)
+                    self._cond.notify_all()
+                    if error is not None and self._closed:
+                        return
+                    continue
+                timeout = None
+                if pending and self.interval is not None:
+                    timeout = max(0.0, self.interval - (time.monotonic() - self._last_flush))
+                self._cond.wait(timeout)
@@ -0,0 +1,763 @@
+import json
+import mmap
+import os
+import threading
+from bisect import bisect_left, bisect_right
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se serializa dentro del proceso
+    fcntl = None
+
+from src.metrics import REGISTRY
+from src.models.records import Record, to_dict, to_record
+from src.query import Query
+from src.storage_backend import (StorageBackend, PARTICIPANT_STATS, ENTITIES_SCANNED, empty_participant_stats,
+                                 free_seats, get_path, sort_key)
+from src.text_index import TextIndex
+
+BYTES_WRITTEN = REGISTRY.counter("datahandler_bytes_written_total", "bytes escritos a disco por archivo",
+                                 ("file",))
+
+
+def sync_directory(filename):
+    """fsync del directorio de filename, para que un os.replace ya hecho sobreviva a una caida"""
+    if not hasattr(os, "O_DIRECTORY"):  # Windows: no se puede abrir un directorio
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JsonBackend(StorageBackend):
+    """
+    todas las entidades en memoria con indices hash, persistidas en un
+    archivo JSON (reescrito completo o con journal de mutaciones).
+
+    Una entidad guardada no se modifica: un update la reemplaza por una copia
+    con los cambios (copy-on-write). Asi freeze() puede publicar el estado
+    como tuplas de registros que siguen valiendo despues de otras
+    mutaciones, y el snapshot se serializa sin tener el lock
+    """
+
+    def __init__(self, filename='data.json', journal=False, compact_every=1000, lazy=False):
+        self.filename = filename
+        # modo lazy: el snapshot se mapea en memoria y cada tipo de entidad se
+        # decodifica recien cuando se usa por primera vez
+        self.lazy = lazy
+        self._map = None
+        self._map_file = None
+        self._lazy_sections = {}
+        self._deferred = {}
+        self._materialize_lock = threading.Lock()
+        # modo journal: cada mutacion se agrega como un registro pequeño a
+        # <filename>.log y el snapshot completo solo se reescribe al compactar
+        self.journal = journal
+        self.journal_filename = filename + '.log'
+        self.compact_every = compact_every
+        self._journal_file = None
+        self._journal_seq = 0
+        self._journal_pending = 0
+        self._compaction = None
+        self.sequence_filename = filename + '.seq'
+        self._sequence_lock = threading.Lock()
+
+        self.dict_entities = {
+            "entities": [],
+            "User":[],
+            "Ride":[]
+        }
+        # posicion de cada entidad en su lista, para reemplazarla en un update
+        self._positions = {}
+        # ultimo freeze(); None despues de cada mutacion
+        self._frozen = None
+        self._pk_index = {}
+        self._max_pk = {}
+        self._secondary_paths = {k: list(v) for k, v in self.secondary_indexes.items()}
+        self._secondary_index = {}
+        self._indexed = {}
+        # indices ordenados: por entidad y ruta, las claves (sort_key) y las
+        # entidades en listas paralelas; _sorted_keys guarda la clave con la
+        # que se inserto cada entidad
+        self._sorted_paths = {k: list(v) for k, v in self.sorted_indexes.items()}
+        self._sorted_index = {}
+        self._sorted_keys = {}
+        self._text_index = {}
+        # rides ready por cantidad de asientos libres
+        self._free_seat_buckets = {}
+        self._free_seats_of = {}
+        self._participant_stats = {}
+        self._stats_contrib = {}
+
+    def save(self):
+        self.prepare_save()()
+
+    def prepare_save(self):
+        # con el lock solo se toma la vista inmutable (o se vacia el buffer
+        # del journal); serializar y sincronizar el disco queda para despues
+        if self.journal:
+            journal_file = self._journal_file
+            if journal_file is None:
+                return lambda: None
+            journal_file.flush()
+            return lambda: self._sync_journal(journal_file)
+        entities, seq = self.freeze(), self._journal_seq
+        return lambda: self._replace_file(self._snapshot(entities, seq))
+
+    def _replace_file(self, snapshot):
+        # se reemplaza el archivo en vez de truncarlo (otro handler en modo
+        # lazy puede tenerlo mapeado en memoria) y el nuevo se sincroniza
+        # antes: una caida no puede dejar un data.json vacio o cortado
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+        sync_directory(self.filename)
+        BYTES_WRITTEN.inc(len(snapshot), file="snapshot")
+
+    @staticmethod
+    def _sync_journal(journal_file):
+        try:
+            os.fsync(journal_file.fileno())
+        except ValueError:
+            # una compactacion lo cerro, despues de sincronizarlo
+            pass
+
+    def freeze(self):
+        """
+        el estado actual como {tipo de entidad: tupla de registros}. Se arma
+        una vez por mutacion y no cambia despues: los registros se reemplazan,
+        no se modifican
+        """
+        frozen = self._frozen
+        if frozen is None:
+            self._materialize_all()
+            frozen = self._frozen = {name: tuple(entities) for name, entities in self.dict_entities.items()}
+        return frozen
+
+    def load(self):
+        self._frozen = None
+        self._release_map()
+        self._lazy_sections = {}
+        self._deferred = {}
+        for k in self.dict_entities.keys():
+            self.dict_entities[k] = []
+        self.normalized = True
+        footer = self._map_snapshot() if self.lazy else None
+        if footer is not None:
+            self._journal_seq = footer.get("_seq", 0)
+            self.normalized = footer.get("_normalized", False)
+            for k in footer["_sections"]:
+                self.dict_entities.pop(k, None)
+            self._lazy_sections = footer["_sections"]
+        else:
+            try:
+                with open(self.filename, 'r') as f:
+                    data = json.load(f)
+                    self._journal_seq = data.pop("_seq", 0)
+                    self.normalized = data.pop("_normalized", False)
+                    data.pop("_sections", None)
+                    for k in data.keys():
+                        self.dict_entities[k] = [to_record(k, e) for e in data.get(k, [])]
+            except FileNotFoundError:
+                pass
+        self._build_indexes()
+        if self.journal:
+            self._replay_journal()
+
+    @staticmethod
+    def _snapshot(dict_entities, seq):
+        """
+        serializa las entidades de freeze(); al final agrega _seq y _sections
+        con el rango de bytes de cada tipo de entidad para poder cargarlo lazy
+        """
+        parts, sections, offset = [], {}, 1
+        for name_entity, entities in dict_entities.items():
+            head = (", " if parts else "") + json.dumps(name_entity) + ": "
+            body = json.dumps(entities, default=to_dict)
+            offset += len(head)
+            sections[name_entity] = [offset, offset + len(body)]
+            offset += len(body)
+            parts.append(head + body)
+        # _normalized: los rides van con referencias a usuarios y sus
+        # contadores (ver DataHandler.normalize_rides)
+        footer = (", " if parts else "") + f'"_seq": {seq}, "_sections": {json.dumps(sections)}'
+        footer += ', "_normalized": true'
+        return "{" + "".join(parts) + footer + "}"
+
+    def _map_snapshot(self):
+        # json.dumps escapa todo a ASCII, asi que los offsets en caracteres
+        # que guarda _snapshot son tambien offsets en bytes
+        try:
+            f = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return None
+        if os.fstat(f.fileno()).st_size == 0:
+            f.close()
+            return None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = mapped.rfind(b'"_seq": ')
+        try:
+            footer = json.loads(b"{" + mapped[start:].rstrip()) if start >= 0 else None
+        except json.JSONDecodeError:
+            footer = None
+        if not footer or "_sections" not in footer:
+            # archivo sin indice de secciones (escrito por una version previa)
+            mapped.close()
+            f.close()
+            return None
+        self._map, self._map_file = mapped, f
+        return footer
+
+    def _release_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map_file.close()
+            self._map = self._map_file = None
+
+    def _materialize(self, name_entity):
+        """decodifica un tipo de entidad pendiente del snapshot mapeado"""
+        if name_entity not in self._lazy_sections:
+            return
+        with self._materialize_lock:
+            if name_entity not in self._lazy_sections:
+                return
+            start, end = self._lazy_sections[name_entity]
+            self.dict_entities[name_entity] = [to_record(name_entity, e)
+                                               for e in json.loads(self._map[start:end])]
+            self._reposition(name_entity)
+            for entity in self.dict_entities[name_entity]:
+                self._index(name_entity, entity)
+            for record in self._deferred.pop(name_entity, []):
+                self._apply(record, log=False)
+            del self._lazy_sections[name_entity]
+            if not self._lazy_sections:
+                self._release_map()
+
+    def _materialize_all(self):
+        for name_entity in list(self._lazy_sections):
+            self._materialize(name_entity)
+
+    def has_entity(self, name_entity):
+        return name_entity in self.dict_entities or name_entity in self._lazy_sections
+
+    def add(self, name_entity, entity):
+        self._materialize(name_entity)
+        self._apply({"op": "add", "entity": name_entity, "data": entity})
+
+    def batch(self, name_entity, operations):
+        # todo el lote va al journal como un solo registro
+        self._materialize(name_entity)
+        self._apply({"op": "batch", "entity": name_entity, "records": operations})
+
+
+    def _get_by_filter(self, entities, filters):
+        return list(Query(filters).filter(entities))
+
+    def _delete_by_filter(self, entities, filters):
+        query = Query(filters)
+        return [t for t in entities if not query.matches(t)]
+
+    @staticmethod
+    def _updated(entity, updates):
+        # copia con los cambios; la entidad guardada no se toca
+        if isinstance(entity, Record):
+            return entity.copy(updates)
+        return dict(entity, **updates)
+
+    def _reposition(self, name_entity):
+        self._positions[name_entity] = {id(e): i for i, e in enumerate(self.dict_entities.get(name_entity, []))}
+
+    def find(self, name_entity, filters):
+        return self.query(name_entity, Query(filters))
+
+    def query(self, name_entity, query, limit=None, order_by=None):
+        self._materialize(name_entity)
+        if order_by is None:
+            found = [to_dict(e) for e in query.filter(self._candidates(name_entity, query), limit)]
+        else:
+            ordered = self._sorted_range(name_entity, order_by, query.range_bounds(order_by))
+            if ordered is None:
+                found = sorted(query.filter(self._candidates(name_entity, query)),
+                               key=lambda e: sort_key(get_path(e, order_by)))
+                found = [to_dict(e) for e in found[:limit]]
+            else:
+                # el indice ya da el orden: se recorre solo la ventana del
+                # rango y se corta en cuanto hay limit resultados
+                found = [to_dict(e) for e in query.filter(ordered, limit)]
+        ENTITIES_SCANNED.observe(query.scanned, entity=name_entity)
+        return found
+
+    def search(self, name_entity, text, query=None, limit=None):
+        self._materialize(name_entity)
+        index = self._text_index.get(name_entity)
+        if index is None:
+            return super().search(name_entity, text, query, limit)
+        found = []
+        for entity, score in index.search(text):
+            if query is None or query.matches(entity):
+                found.append((to_dict(entity), score))
+                if limit is not None and len(found) == limit:
+                    break
+        return found
+
+    def rides_with_free_seats(self, seats, limit=None):
+        # solo se recorren los buckets con suficientes asientos, nunca los participantes
+        self._materialize("Ride")
+        found = []
+        for free in sorted(free for free in self._free_seat_buckets if free >= seats):
+            for ride in self._free_seat_buckets[free].values():
+                if limit is not None and len(found) == limit:
+                    return found
+                found.append(to_dict(ride))
+        return found
+
+    def delete(self, name_entity, filters):
+        self._materialize(name_entity)
+        self._apply({"op": "delete", "entity": name_entity, "filters": filters})
+
+    def update(self, name_entity, filters, updates):
+        self._materialize(name_entity)
+        self._apply({"op": "update", "entity": name_entity, "filters": filters, "updates": updates})
+
+    def all(self, name_entity):
+        self._materialize(name_entity)
+        return [to_dict(e) for e in self.dict_entities[name_entity]]
+
+    def get_by_key(self, name_entity, key):
+        self._materialize(name_entity)
+        return to_dict(self._pk_index.get(name_entity, {}).get(key))
+
+    def page(self, name_entity, filters, limit=None, offset=0, after=None):
+        self._materialize(name_entity)
+        query = Query(filters)
+        candidates = self._candidates(name_entity, query)
+        start = offset if after is None else self._resume(name_entity, candidates, after)
+        items = []
+        position = start
+        while position < len(candidates) and (limit is None or len(items) < limit):
+            entity = candidates[position]
+            position += 1
+            if query.matches(entity):
+                items.append(to_dict(entity))
+        ENTITIES_SCANNED.observe(position - start, entity=name_entity)
+        if position < len(candidates) and items:
+            return items, [position, self._page_key(name_entity, candidates[position - 1])]
+        return items, None
+
+    def _page_key(self, name_entity, entity):
+        pk = self.primary_keys.get(name_entity)
+        return entity.get(pk) if pk is not None else None
+
+    def _resume(self, name_entity, candidates, after):
+        # la posicion guardada se valida con la clave de la ultima entidad
+        # devuelta; si hubo borrados antes de ella se busca por clave
+        position, key = after
+        if 0 < position <= len(candidates) and self._page_key(name_entity, candidates[position - 1]) == key:
+            return position
+        if key is not None:
+            for i, entity in enumerate(candidates):
+                if self._page_key(name_entity, entity) == key:
+                    return i + 1
+        return min(position, len(candidates))
+
+    def create_index(self, name_entity, path):
+        self._materialize(name_entity)
+        paths = self._secondary_paths.setdefault(name_entity, [])
+        if path in paths:
+            return
+        paths.append(path)
+        index = self._secondary_index.setdefault(name_entity, {}).setdefault(path, {})
+        for entity in self.dict_entities.get(name_entity, []):
+            self._index_value(index, self._indexed_values(name_entity, entity), path, entity)
+
+    def next_id(self, name_entity, count=1):
+        """
+        siguiente valor de la secuencia de ids de una entidad, reservando
+        count valores seguidos desde ese; la secuencia vive en
+        <filename>.seq y se incrementa con un lock de archivo, asi que no se
+        repite entre hilos, workers ni reinicios
+        """
+        self._materialize(name_entity)
+        with self._sequence_lock:
+            with open(self.sequence_filename, 'a+', encoding='utf-8') as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    sequences = json.loads(content) if content else {}
+                    value = max(sequences.get(name_entity, 0), self._max_pk.get(name_entity, 0)) + 1
+                    sequences[name_entity] = value + count - 1
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(sequences))
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return value
+
+    def _build_indexes(self):
+        self._pk_index = {}
+        self._max_pk = {}
+        self._secondary_index = {}
+        self._indexed = {}
+        self._sorted_index = {}
+        self._sorted_keys = {}
+        self._text_index = {}
+        self._free_seat_buckets = {}
+        self._free_seats_of = {}
+        self._participant_stats = {}
+        self._stats_contrib = {}
+        self._positions = {}
+        for name_entity in self.dict_entities:
+            self._reposition(name_entity)
+        for name_entity in (set(self.primary_keys) | set(self._secondary_paths) | set(self._sorted_paths)
+                            | set(self.text_indexes)):
+            for entity in self.dict_entities.get(name_entity, []):
+                self._index(name_entity, entity)
+
+    def participant_stats(self, alias):
+        self._materialize("Ride")
+        return dict(self._participant_stats.get(alias) or empty_participant_stats())
+
+    def _count_participations(self, ride, sign):
+        # los contadores se actualizan con la contribucion de cada ride; al
+        # sacarlo se resta la que se registro al indexarlo
+        if sign > 0:
+            contrib = ride.participant_statuses()
+            self._stats_contrib[id(ride)] = contrib
+        else:
+            contrib = self._stats_contrib.pop(id(ride), [])
+        for alias, status in contrib:
+            stats = self._participant_stats.setdefault(alias, empty_participant_stats())
+            stats["previousRidesTotal"] += sign
+            field = PARTICIPANT_STATS.get(status)
+            if field:
+                stats[field] += sign
+
+    def _indexed_values(self, name_entity, entity):
+        # se guardan los valores con los que se indexo cada entidad para poder
+        # sacarla del indice aunque el dict se haya modificado en el lugar
+        return self._indexed.setdefault(name_entity, {}).setdefault(id(entity), {})
+
+    def _index_value(self, index, indexed, path, entity):
+        value = get_path(entity, path)
+        try:
+            index.setdefault(value, {})[id(entity)] = entity
+        except TypeError:
+            # valores no hashables (listas, dicts) no se indexan
+            return
+        indexed[path] = value
+
+    def _index(self, name_entity, entity):
+        pk = self.primary_keys.get(name_entity)
+        if pk is not None:
+            key = entity.get(pk)
+            if key is not None:
+                self._pk_index.setdefault(name_entity, {}).setdefault(key, entity)
+                if isinstance(key, int) and key > self._max_pk.get(name_entity, 0):
+                    self._max_pk[name_entity] = key
+
+        paths = self._secondary_paths.get(name_entity)
+        if paths:
+            indexed = self._indexed_values(name_entity, entity)
+            indexes = self._secondary_index.setdefault(name_entity, {})
+            for path in paths:
+                self._index_value(indexes.setdefault(path, {}), indexed, path, entity)
+
+        paths = self._sorted_paths.get(name_entity)
+        if paths:
+            keys = self._sorted_keys.setdefault(name_entity, {}).setdefault(id(entity), {})
+            indexes = self._sorted_index.setdefault(name_entity, {})
+            for path in paths:
+                sorted_keys, entities, unsorted = indexes.setdefault(path, ([], [], {}))
+                key = sort_key(get_path(entity, path))
+                try:
+                    position = bisect_right(sorted_keys, key)
+                except TypeError:
+                    # un valor que no se compara con los demas queda aparte
+                    unsorted[id(entity)] = entity
+                    continue
+                sorted_keys.insert(position, key)
+                entities.insert(position, entity)
+                keys[path] = key
+
+        fields = self.text_indexes.get(name_entity)
+        if fields:
+            if name_entity not in self._text_index:
+                self._text_index[name_entity] = TextIndex(fields)
+            self._text_index[name_entity].add(entity)
+
+        if name_entity == "Ride":
+            self._count_participations(entity, 1)
+            if entity.get("status") == "ready":
+                free = free_seats(entity)
+                self._free_seat_buckets.setdefault(free, {})[id(entity)] = entity
+                self._free_seats_of[id(entity)] = free
+
+    def _unindex(self, name_entity, entity):
+        pk = self.primary_keys.get(name_entity)
+        if pk is not None:
+            index = self._pk_index.get(name_entity, {})
+            key = entity.get(pk)
+            if index.get(key) is entity:
+                del index[key]
+
+        indexed = self._indexed.get(name_entity, {}).pop(id(entity), {})
+        indexes = self._secondary_index.get(name_entity, {})
+        for path, value in indexed.items():
+            bucket = indexes[path].get(value)
+            if bucket is not None:
+                bucket.pop(id(entity), None)
+                if not bucket:
+                    del indexes[path][value]
+
+        keys = self._sorted_keys.get(name_entity, {}).pop(id(entity), {})
+        indexes = self._sorted_index.get(name_entity, {})
+        for path in self._sorted_paths.get(name_entity, []):
+            sorted_keys, entities, unsorted = indexes.get(path, ([], [], {}))
+            if path not in keys:
+                unsorted.pop(id(entity), None)
+                continue
+            position = bisect_left(sorted_keys, keys[path])
+            while position < len(entities) and entities[position] is not entity:
+                position += 1
+            if position < len(entities):
+                del sorted_keys[position]
+                del entities[position]
+
+        if name_entity in self._text_index:
+            self._text_index[name_entity].remove(entity)
+
+        if name_entity == "Ride":
+            self._count_participations(entity, -1)
+            free = self._free_seats_of.pop(id(entity), None)
+            if free is not None:
+                bucket = self._free_seat_buckets[free]
+                bucket.pop(id(entity), None)
+                if not bucket:
+                    del self._free_seat_buckets[free]
+
+    def _sorted_range(self, name_entity, path, bounds):
+        """
+        entidades con valor en path dentro de bounds (operadores gt, gte, lt,
+        lte), en orden, sacadas del indice ordenado con bisect; sin bounds
+        son todas, con las que no tienen valor al final. None si la ruta no
+        tiene indice ordenado o no se puede usar
+        """
+        index = self._sorted_index.get(name_entity, {}).get(path)
+        if path not in self._sorted_paths.get(name_entity, []):
+            return None
+        sorted_keys, entities, unsorted = index or ([], [], {})
+        if unsorted:
+            return None
+        start, end = 0, len(sorted_keys)
+        try:
+            if "gte" in bounds:
+                start = max(start, bisect_left(sorted_keys, (False, bounds["gte"])))
+            if "gt" in bounds:
+                start = max(start, bisect_right(sorted_keys, (False, bounds["gt"])))
+            if "lte" in bounds:
+                end = min(end, bisect_right(sorted_keys, (False, bounds["lte"])))
+            if "lt" in bounds:
+                end = min(end, bisect_left(sorted_keys, (False, bounds["lt"])))
+            if bounds:
+                # los None (clave (True, None)) nunca cumplen un rango
+                end = min(end, bisect_left(sorted_keys, (True, None)))
+        except TypeError:
+            return None
+        return entities[start:end]
+
+    def _candidates(self, name_entity, filters):
+        # si el filtro fija la clave primaria (eq o in) basta con mirar el
+        # indice; si no, se usa el indice secundario que de menos candidatos
+        query = filters if isinstance(filters, Query) else Query(filters)
+        pk = self.primary_keys.get(name_entity)
+        best = None
+        indexes = self._secondary_index.get(name_entity, {})
+        for path, values in query.index_hints():
+            if path == pk:
+                index = self._pk_index.get(name_entity, {})
+                found = {}
+                for value in values:
+                    try:
+                        entity = index.get(value)
+                    except TypeError:
+                        continue
+                    if entity is not None:
+                        found[id(entity)] = entity
+                return list(found.values())
+            if path not in indexes:
+                continue
+            try:
+                buckets = [indexes[path].get(value, {}) for value in values]
+            except TypeError:
+                continue
+            size = sum(len(bucket) for bucket in buckets)
+            if best is None or size < best[0]:
+                best = (size, buckets)
+        for path, bounds in query.ranges():
+            window = self._sorted_range(name_entity, path, bounds)
+            if window is not None and (best is None or len(window) < best[0]):
+                best = (len(window), [window])
+        if best is None:
+            return self.dict_entities[name_entity]
+        if isinstance(best[1][0], list):
+            return best[1][0]
+        if len(best[1]) == 1:
+            return list(best[1][0].values())
+        found = {}
+        for bucket in best[1]:
+            found.update(bucket)
+        return list(found.values())
+
+    def _apply(self, record, log=True):
+        # aplica la mutacion en memoria y, en modo journal, la registra en el log
+        name_entity = record["entity"]
+        op = record["op"]
+        self._frozen = None
+        if op == "add":
+            if name_entity not in self.dict_entities:
+                self.dict_entities[name_entity] = []
+            entity = to_record(name_entity, record["data"])
+            if entity is record["data"]:
+                # sin registro compacto se guarda una copia, no el dict del llamador
+                entity = dict(entity)
+            entities = self.dict_entities[name_entity]
+            self._positions.setdefault(name_entity, {})[id(entity)] = len(entities)
+            entities.append(entity)
+            self._index(name_entity, entity)
+        elif op == "update":
+            matched = self._get_by_filter(self._candidates(name_entity, record["filters"]), record["filters"])
+            entities = self.dict_entities[name_entity]
+            positions = self._positions[name_entity]
+            for entity in matched:
+                self._unindex(name_entity, entity)
+                updated = self._updated(entity, record["updates"])
+                position = positions.pop(id(entity))
+                entities[position] = updated
+                positions[id(updated)] = position
+                self._index(name_entity, updated)
+        elif op == "delete":
+            matched = self._get_by_filter(self._candidates(name_entity, record["filters"]), record["filters"])
+            for entity in matched:
+                self._unindex(name_entity, entity)
+            if matched:
+                removed = set(map(id, matched))
+                self.dict_entities[name_entity] = [t for t in self.dict_entities[name_entity]
+                                                   if id(t) not in removed]
+                self._reposition(name_entity)
+        elif op == "batch":
+            for operation in record["records"]:
+                if operation["op"] == "batch":
+                    raise ValueError("Un lote no puede contener otro lote")
+                self._apply(dict(operation, entity=name_entity), log=False)
+        else:
+            raise ValueError(f"Operación de journal desconocida: {op}")
+
+        if self.journal and log:
+            self._append_journal(record)
+
+    def _open_journal(self):
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_filename, 'a', encoding='utf-8')
+        return self._journal_file
+
+    def _append_journal(self, record):
+        self._journal_seq += 1
+        line = json.dumps(dict(record, seq=self._journal_seq))
+        self._open_journal().write(line + "\n")
+        BYTES_WRITTEN.inc(len(line) + 1, file="journal")
+        self._journal_pending += 1
+        if self._journal_pending >= self.compact_every:
+            self.compact(background=True)
+
+    def _flush_journal(self):
+        if self._journal_file is not None:
+            self._journal_file.flush()
+            os.fsync(self._journal_file.fileno())
+
+    def _read_journal(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # ultima linea truncada por una caida: se descarta
+                        break
+        except FileNotFoundError:
+            return
+
+    def _replay_journal(self):
+        # el .log.old existe si una compactacion no llego a terminar; los
+        # registros ya incluidos en el snapshot se saltan por su seq. Los de un
+        # tipo de entidad todavia sin decodificar se aplican al decodificarlo
+        for path in (self.journal_filename + '.old', self.journal_filename):
+            for record in self._read_journal(path):
+                if record.get("seq", 0) <= self._journal_seq:
+                    continue
+                if record["entity"] in self._lazy_sections:
+                    self._deferred.setdefault(record["entity"], []).append(record)
+                else:
+                    self._apply(record, log=False)
+                self._journal_seq = record["seq"]
+                self._journal_pending += 1
+
+    def compact(self, background=False):
+        """
+        escribe un snapshot con todo el estado actual y descarta el log que ya
+        quedo incluido en el; con background=True la escritura del snapshot
+        se hace en un hilo aparte
+        """
+        if not self.journal:
+            return
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+        entities, seq = self.freeze(), self._journal_seq
+        old_journal = self.journal_filename + '.old'
+        if self._journal_file is not None:
+            self._flush_journal()
+            self._journal_file.close()
+            self._journal_file = None
+        if os.path.exists(old_journal):
+            # quedo de una compactacion interrumpida: se conserva hasta que el
+            # nuevo snapshot este en disco
+            with open(old_journal, 'a', encoding='utf-8') as dst, \
+                    open(self.journal_filename, 'a+', encoding='utf-8') as src:
+                src.seek(0)
+                dst.write(src.read())
+            os.remove(self.journal_filename)
+        elif os.path.exists(self.journal_filename):
+            os.replace(self.journal_filename, old_journal)
+        self._journal_pending = 0
+
+        # la vista de freeze() no cambia: se puede serializar en otro hilo
+        if background:
+            self._compaction = threading.Thread(target=self._write_snapshot, args=(entities, seq, old_journal))
+            self._compaction.start()
+        else:
+            self._write_snapshot(entities, seq, old_journal)
+
+    def _write_snapshot(self, entities, seq, old_journal):
+        self._replace_file(self._snapshot(entities, seq))
+        if os.path.exists(old_journal):
+            os.remove(old_journal)
+
+    def close(self):
+        if self.journal:
+            if self._compaction is not None:
+                self._compaction.join()
+            self._flush_journal()
+        else:
+            self.save()
+        self._release_map()
@@ -1,5 +1,7 @@
 from datetime import datetime
 class User:
+    __slots__ = ("alias", "name", "car_plate", "rides")
+
     def __init__(self, alias, name, car_plate=None):
         self.alias = alias
         self.name = name
@@ -15,6 +17,8 @@ class User:
 
 
 class RideParticipation:
+    __slots__ = ("confirmation", "destination", "occupiedSpaces", "participant", "status")
+
     def __init__(self, confirmation, destination, occupiedSpaces, participant, status="waiting"):
         self.confirmation = confirmation
         self.destination = destination
@@ -33,6 +37,8 @@ class RideParticipation:
 
 
 class Ride:
+    __slots__ = ("id", "rideDateAndTime", "finalAddress", "allowedSpaces", "rideDriver", "status", "participants")
+
     def __init__(self, rideDateAndTime, finalAddress, allowedSpaces, rideDriver, status="ready", participants=None,
                  rideId=None):
         self.id = rideId
@@ -0,0 +1,174 @@
+import sys
+
+from src.models.user import ParticipationStatus, RideStatus
+
+# marca de campo ausente: el dict original no tenia esa clave
+MISSING = object()
+
+_STATUSES = {status.value: status.value for status in (*RideStatus, *ParticipationStatus)}
+
+
+def intern_status(value):
+    """un solo str compartido por cada estado en vez de uno por entidad"""
+    if isinstance(value, str):
+        return _STATUSES.get(value) or sys.intern(value)
+    return value
+
+
+def _user_reference(value):
+    # una referencia {"alias": ...} se guarda como el alias solo
+    if isinstance(value, dict) and len(value) == 1 and isinstance(value.get("alias"), str):
+        return sys.intern(value["alias"])
+    return value
+
+
+def _user_dict(value):
+    return {"alias": value} if isinstance(value, str) else value
+
+
+class Record:
+    """
+    representacion compacta de una entidad: un atributo por campo conocido
+    (con __slots__, sin dict por instancia) y las claves desconocidas en
+    extra. get/to_dict devuelven los valores con la forma de dict de siempre
+    """
+    __slots__ = ("extra",)
+    FIELDS = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for field in cls.FIELDS:
+            value = data.get(field, MISSING)
+            setattr(record, field, value if value is MISSING else record._store(field, value))
+        if data.keys() <= set(cls.FIELDS):
+            record.extra = None
+        else:
+            record.extra = {k: v for k, v in data.items() if k not in cls.FIELDS}
+        return record
+
+    def _store(self, field, value):
+        return value
+
+    def _export(self, field, value):
+        return value
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            return default if value is MISSING else self._export(key, value)
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def copy(self, updates=None):
+        """otro registro con los mismos valores (compartidos) y updates aplicados"""
+        record = self.__class__.__new__(self.__class__)
+        for field in self.FIELDS:
+            setattr(record, field, getattr(self, field))
+        record.extra = dict(self.extra) if self.extra is not None else None
+        if updates:
+            record.update(updates)
+        return record
+
+    def update(self, updates):
+        for key, value in updates.items():
+            if key in self.FIELDS:
+                setattr(self, key, self._store(key, value))
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def to_dict(self):
+        data = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not MISSING:
+                data[field] = self._export(field, value)
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+class UserRecord(Record):
+    __slots__ = ("alias", "name", "car_plate")
+    FIELDS = __slots__
+
+    def _store(self, field, value):
+        return sys.intern(value) if field == "alias" and isinstance(value, str) else value
+
+
+class ParticipationRecord(Record):
+    __slots__ = ("confirmation", "destination", "occupiedSpaces", "participant", "status")
+    FIELDS = __slots__
+
+    def _store(self, field, value):
+        if field == "participant":
+            return _user_reference(value)
+        if field == "status":
+            return intern_status(value)
+        return value
+
+    def _export(self, field, value):
+        return _user_dict(value) if field == "participant" else value
+
+    @property
+    def participant_alias(self):
+        value = self.participant
+        if isinstance(value, str):
+            return value
+        return value.get("alias") if isinstance(value, dict) else None
+
+
+class RideRecord(Record):
+    __slots__ = ("id", "rideDateAndTime", "finalAddress", "allowedSpaces", "rideDriver", "status", "participants",
+                 "confirmedSeats", "pendingSeats")
+    FIELDS = __slots__
+
+    def _store(self, field, value):
+        if field == "rideDriver":
+            return _user_reference(value)
+        if field == "status":
+            return intern_status(value)
+        if field == "participants" and isinstance(value, list):
+            return [ParticipationRecord.from_dict(p) if isinstance(p, dict) else p for p in value]
+        return value
+
+    def _export(self, field, value):
+        if field == "rideDriver":
+            return _user_dict(value)
+        if field == "participants" and isinstance(value, list):
+            return [p.to_dict() if isinstance(p, Record) else p for p in value]
+        return value
+
+    def participant_statuses(self):
+        """(alias, estado) de cada participacion, sin armar dicts"""
+        participants = self.participants
+        if not isinstance(participants, list):
+            return []
+        return [(p.participant_alias, p.status) if isinstance(p, ParticipationRecord)
+                else (p.get("participant", {}).get("alias"), p.get("status")) if isinstance(p, dict)
+                else (None, None)
+                for p in participants]
+
+
+# entidades que DataHandler guarda en memoria como registros compactos
+RECORDS = {
+    "User": UserRecord,
+    "Ride": RideRecord,
+}
+
+
+def to_record(name_entity, entity):
+    record_class = RECORDS.get(name_entity)
+    if record_class is None or not isinstance(entity, dict):
+        return entity
+    return record_class.from_dict(entity)
+
+
+def to_dict(entity):
+    # siempre una copia: quien la recibe puede modificarla sin tocar lo guardado
+    if isinstance(entity, Record):
+        return entity.to_dict()
+    return dict(entity) if isinstance(entity, dict) else entity
@@ -6,6 +6,7 @@ from enum import Enum
 class RideStatus(Enum):
     READY = "ready"
     INPROGRESS = "inprogress"
+    COMPLETED = "completed"
     DONE = "done"
 
 
@@ -16,11 +17,12 @@ class ParticipationStatus(Enum):
     MISSING = "missing"
     NOTMARKED = "notmarked"
     INPROGRESS = "inprogress"
+    COMPLETED = "completed"
     DONE = "done"
 
 
 class RideParticipation:
-    def _init_(self, confirmation: datetime, destination: str,
+    def __init__(self, confirmation: datetime, destination: str,
                occupied_spaces: int, status: ParticipationStatus):
         self.confirmation = confirmation
         self.destination = destination
@@ -29,7 +31,7 @@ class RideParticipation:
 
 
 class User:
-    def _init_(self, alias: str, name: str, car_plate: Optional[str] = None):
+    def __init__(self, alias: str, name: str, car_plate: Optional[str] = None):
         self.alias = alias
         self.name = name
         self.car_plate = car_plate  
@@ -37,7 +39,7 @@ class User:
 
 
 class Ride:
-    def _init_(self, ride_date_and_time: datetime, final_address: str,
+    def __init__(self, ride_date_and_time: datetime, final_address: str,
                allowed_spaces: int, ride_driver: User, status: RideStatus):
         self.ride_date_and_time = ride_date_and_time
         self.final_address = final_address
@@ -48,7 +50,7 @@ class Ride:
 
 
 class DataHandler:
-    def _init_(self):
+    def __init__(self):
         self.users: List[User] = []
         self.rides: List[Ride] = []
 
@@ -68,7 +70,7 @@ class DataHandler:
         return [ride for ride in self.rides if ride.ride_driver == driver]
 
 
-if _name_ == "_main_":
+if __name__ == "__main__":
     data_handler = DataHandler()
 
     driver = User("john_doe", "John Doe", "ABC-123")
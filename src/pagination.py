@@ -0,0 +1,129 @@
+import base64
+import json
+from datetime import datetime
+
+from werkzeug.exceptions import BadRequest
+
+MAX_LIMIT = 1000
+STREAM_CHUNK = 500
+
+
+def encode_cursor(position):
+    if position is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise BadRequest("El cursor no es válido")
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise BadRequest(f"El parámetro '{name}' debe ser un entero")
+    if value < 0:
+        raise BadRequest(f"El parámetro '{name}' no puede ser negativo")
+    return value
+
+
+def parse_pagination(args):
+    """
+    lee limit, offset, cursor y stream de los query params. Devuelve None si
+    no se pidio paginacion (respuesta completa, como antes)
+    """
+    limit = _int_arg(args, "limit")
+    offset = _int_arg(args, "offset")
+    cursor = args.get("cursor")
+    stream = args.get("stream", "").lower() in ("1", "true")
+    if limit is None and offset is None and cursor is None and not stream:
+        return None
+    if limit is not None and limit > MAX_LIMIT:
+        raise BadRequest(f"El parámetro 'limit' no puede superar {MAX_LIMIT}")
+    return {
+        "limit": MAX_LIMIT if limit is None else limit,
+        "offset": offset or 0,
+        "after": decode_cursor(cursor) if cursor else None,
+        "stream": stream,
+    }
+
+
+def parse_time_window(args):
+    """
+    lee from y to (fechas ISO 8601) de los query params como operadores de
+    rango sobre rideDateAndTime, normalizados al formato con que se guardan.
+    Devuelve None si no vino ninguno
+    """
+    window = {}
+    for name, op in (("from", "gte"), ("to", "lte")):
+        value = args.get(name)
+        if value is None:
+            continue
+        try:
+            window[op] = datetime.fromisoformat(value).isoformat()
+        except ValueError:
+            raise BadRequest(f"El parámetro '{name}' debe ser una fecha ISO 8601")
+    return window or None
+
+
+def parse_seats(args):
+    """lee seats (asientos libres pedidos, 1 por defecto) de los query params"""
+    seats = _int_arg(args, "seats")
+    if seats == 0:
+        raise BadRequest("El parámetro 'seats' debe ser mayor que cero")
+    return 1 if seats is None else seats
+
+
+def parse_event_filters(args, headers):
+    """
+    lee los filtros del stream de eventos: rideId y/o alias (al menos uno) y
+    el ultimo evento que recibio el cliente, del header Last-Event-ID que
+    manda el navegador al reconectar o del parametro lastEventId
+    """
+    ride_id = _int_arg(args, "rideId")
+    alias = args.get("alias") or None
+    if ride_id is None and alias is None:
+        raise BadRequest("Se requiere el parámetro 'rideId' o 'alias'")
+    last_event_id = headers.get("Last-Event-ID") or args.get("lastEventId")
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            raise BadRequest("El último evento debe ser un entero")
+    return {"ride_id": ride_id, "alias": alias, "last_event_id": last_event_id}
+
+
+def get_page(data_handler, name_entity, filters, pagination):
+    """devuelve (entidades, cursor de la pagina siguiente o None)"""
+    items, position = data_handler.get_entities_page(
+        name_entity, filters, limit=pagination["limit"], offset=pagination["offset"], after=pagination["after"])
+    return data_handler.join(name_entity, items or []), encode_cursor(position)
+
+
+def stream_entities(data_handler, name_entity, filters=None, offset=0, after=None, chunk_size=STREAM_CHUNK):
+    """
+    genera un arreglo JSON por partes: cada parte se lee y serializa con un
+    read() corto, asi la memoria queda acotada al tamaño de la parte y no se
+    bloquea a los escritores durante toda la respuesta
+    """
+    yield "["
+    first = True
+    while True:
+        with data_handler.read():
+            items, after = data_handler.get_entities_page(name_entity, filters, limit=chunk_size,
+                                                          offset=offset, after=after)
+            offset = 0
+            chunk = ",".join(json.dumps(item) for item in data_handler.join(name_entity, items or []))
+        if chunk:
+            yield chunk if first else "," + chunk
+            first = False
+        if after is None:
+            break
+    yield "]"
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from src.storage_backend import ride_seats
+
+# decision sobre una participacion: (evento que publica, estado en que la deja)
+DECISIONES = {
+    "accept": ("accepted", "confirmed"),
+    "reject": ("rejected", "rejected"),
+    "unload": ("unloaded", "completed"),
+}
+
+
+def decidir_participaciones(ride, decisiones):
+    """
+    aplica sobre una copia de los participantes del ride las decisiones
+    (fila, alias del participante, "accept", "reject" o "unload"). Si hay
+    aceptaciones la capacidad se chequea una sola vez para todas; rechazar o
+    bajar participantes no ocupa asientos. Devuelve (participantes, errores)
+    """
+    participantes = [dict(p) for p in ride.get("participants", [])]
+    por_alias = {p.get("participant", {}).get("alias"): p for p in participantes}
+    confirmados, _ = ride_seats(ride)
+    ahora = datetime.now().isoformat()
+    errores, decididos = [], set()
+    hay_aceptados = False
+
+    for fila, alias_participante, decision in decisiones:
+        participacion = por_alias.get(alias_participante)
+        if participacion is None:
+            errores.append({"fila": fila, "error": f"Participante '{alias_participante}' no encontrado en este ride"})
+        elif alias_participante in decididos:
+            errores.append({"fila": fila, "error": f"El participante '{alias_participante}' tiene más de una decisión"})
+        elif decision == "unload":
+            if ride.get("status") != "inprogress":
+                errores.append({"fila": fila, "error": "Solo se puede bajar de un ride en estado 'inprogress'"})
+            elif participacion.get("status") != "inprogress":
+                errores.append({"fila": fila, "error": "Solo se puede bajar un participante en estado 'inprogress'"})
+            else:
+                decididos.add(alias_participante)
+                participacion["status"] = "completed"
+        elif participacion.get("status") != "waiting":
+            errores.append({"fila": fila, "error": "Solo se puede decidir sobre una solicitud en estado 'waiting'"})
+        elif decision == "accept":
+            decididos.add(alias_participante)
+            hay_aceptados = True
+            participacion["status"] = "confirmed"
+            participacion["confirmation"] = ahora
+            confirmados += participacion.get("occupiedSpaces", 1)
+        else:
+            decididos.add(alias_participante)
+            participacion["status"] = "rejected"
+
+    if hay_aceptados and confirmados > ride.get("allowedSpaces"):
+        errores.append({"rideId": ride.get("id"), "error": "No hay espacios suficientes disponibles"})
+    return participantes, errores
@@ -0,0 +1,173 @@
+import operator
+from itertools import islice
+
+from src.models.records import Record
+
+RANGE_OPERATORS = {
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+OPERATORS = ("eq", "in", "exists") + tuple(RANGE_OPERATORS)
+
+
+def _path_getter(path):
+    """
+    funcion que devuelve la lista de valores de un campo. "a.b" da un solo
+    valor (None si falta) y "participants[].participant.alias" uno por
+    elemento de la lista
+    """
+    parts = [(part[:-2], True) if part.endswith("[]") else (part, False) for part in path.split(".")]
+
+    if not any(fan_out for _, fan_out in parts):
+        names = [name for name, _ in parts]
+
+        def get_one(entity):
+            value = entity
+            for name in names:
+                if not isinstance(value, (dict, Record)):
+                    return [None]
+                value = value.get(name)
+            return [value]
+        return get_one
+
+    def get_many(entity):
+        values = [entity]
+        for name, fan_out in parts:
+            found = []
+            for value in values:
+                if not isinstance(value, (dict, Record)):
+                    continue
+                value = value.get(name)
+                if fan_out:
+                    if isinstance(value, list):
+                        found.extend(value)
+                else:
+                    found.append(value)
+            values = found
+        return values
+    return get_many
+
+
+def _value_check(op, argument):
+    if op == "eq":
+        return lambda value: value == argument
+    if op == "in":
+        try:
+            allowed = frozenset(argument)
+        except TypeError:
+            allowed = list(argument)
+
+        def check_in(value):
+            try:
+                return value in allowed
+            except TypeError:
+                return False
+        return check_in
+    compare = RANGE_OPERATORS[op]
+
+    def check_range(value):
+        if value is None:
+            return False
+        try:
+            return compare(value, argument)
+        except TypeError:
+            return False
+    return check_range
+
+
+class Query:
+    """
+    condiciones sobre campos compiladas una vez. where es un dict de ruta a
+    condicion; la condicion es un valor (igualdad) o un dict de operadores:
+
+        {"rideDriver.alias": "ana",
+         "status": {"in": ["ready", "inprogress"]},
+         "rideDateAndTime": {"gte": "2025-07-16T18:00:00"},
+         "participants[].participant.alias": "luis",
+         "car_plate": {"exists": True}}
+
+    Con "[]" basta que un elemento de la lista cumpla todos los operadores
+    de esa ruta. Un campo ausente vale None, y exists pide que no sea None
+    """
+
+    def __init__(self, where=None):
+        self.where = dict(where or {})
+        self._conditions = [self._compile(path, condition) for path, condition in self.where.items()]
+        # entidades revisadas por filter, para las metricas
+        self.scanned = 0
+
+    @staticmethod
+    def operators(condition):
+        """el dict de operadores de una condicion ({"eq": valor} si es un valor)"""
+        if isinstance(condition, dict) and condition and all(key in OPERATORS for key in condition):
+            return condition
+        return {"eq": condition}
+
+    def _compile(self, path, condition):
+        ops = self.operators(condition)
+        getter = _path_getter(path)
+        checks = [_value_check(op, argument) for op, argument in ops.items() if op != "exists"]
+        exists = ops.get("exists")
+
+        def test(entity):
+            values = getter(entity)
+            if exists is not None and any(value is not None for value in values) != bool(exists):
+                return False
+            return not checks or any(all(check(value) for check in checks) for value in values)
+        return test
+
+    def matches(self, entity):
+        for test in self._conditions:
+            if not test(entity):
+                return False
+        return True
+
+    def filter(self, entities, limit=None):
+        """generador de las entidades que cumplen, cortando a los limit primeros"""
+        found = (entity for entity in self._count(entities) if self.matches(entity))
+        return found if limit is None else islice(found, limit)
+
+    def _count(self, entities):
+        for entity in entities:
+            self.scanned += 1
+            yield entity
+
+    def index_hints(self):
+        """
+        (ruta, valores) de las condiciones eq/in sobre rutas sin "[]": toda
+        entidad que cumple tiene en esa ruta uno de esos valores, asi que un
+        indice sobre la ruta da los candidatos
+        """
+        hints = []
+        for path, condition in self.where.items():
+            if "[]" in path:
+                continue
+            ops = self.operators(condition)
+            if "eq" in ops:
+                hints.append((path, [ops["eq"]]))
+            elif "in" in ops:
+                hints.append((path, list(ops["in"])))
+        return hints
+
+    def range_bounds(self, path):
+        """los operadores de rango (gt, gte, lt, lte) sobre una ruta"""
+        condition = self.where.get(path)
+        if condition is None:
+            return {}
+        return {op: arg for op, arg in self.operators(condition).items() if op in RANGE_OPERATORS}
+
+    def ranges(self):
+        """(ruta, operadores de rango) de las rutas sin "[]" que tienen alguno"""
+        return [(path, self.range_bounds(path)) for path in self.where
+                if "[]" not in path and self.range_bounds(path)]
+
+    def equalities(self):
+        """las condiciones que son solo una igualdad, como filtro simple"""
+        equal = {}
+        for path, condition in self.where.items():
+            ops = self.operators(condition)
+            if "[]" not in path and list(ops) == ["eq"]:
+                equal[path] = ops["eq"]
+        return equal
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def ride_dependencies(rides, stats=False):
+    """
+    claves de version de los usuarios que aparecen en una respuesta con
+    rides (conductor y participantes, que join expande); con stats=True
+    tambien los rides de cada participante, de los que salen sus estadisticas
+    """
+    keys = set()
+    for ride in rides:
+        driver = ride.get("rideDriver")
+        if isinstance(driver, dict):
+            keys.add(("User", driver.get("alias")))
+        for p in ride.get("participants") or []:
+            alias = (p.get("participant") or {}).get("alias")
+            keys.add(("User", alias))
+            if stats:
+                keys.add(("Ride.participant", alias))
+    return keys
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "headers", "versions")
+
+    def __init__(self, body, headers, versions):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.headers = headers
+        self.versions = versions
+
+
+class ResponseCache:
+    """
+    cuerpos JSON ya codificados de las rutas GET, por ruta y argumentos.
+    Cada entrada guarda la version (DataHandler.version) de las claves de
+    las que depende y deja de valer en cuanto alguna cambia, es decir cuando
+    DataHandler muta ese usuario o ride. Si el backend lo comparten varios
+    procesos no se cachea, pero igual se calcula el ETag
+    """
+
+    def __init__(self, data_handler, max_entries=1024):
+        self.data_handler = data_handler
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return not self.data_handler.shared
+
+    def get_or_build(self, key, build):
+        """
+        devuelve la entrada de key o la arma con build(), que debe devolver
+        (payload, dependencias, headers). Todo corre dentro de
+        data_handler.read(), asi las versiones corresponden a lo leido
+        """
+        with self.data_handler.read():
+            if self.enabled:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and self._valid(entry):
+                        self._entries.move_to_end(key)
+                        return entry
+
+            payload, dependencies, headers = build()
+            versions = {dep: self.data_handler.version(dep) for dep in dependencies}
+            entry = CachedResponse(json.dumps(payload).encode(), headers or {}, versions)
+
+            if self.enabled:
+                with self._lock:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return entry
+
+    def _valid(self, entry):
+        return all(self.data_handler.version(dep) == version for dep, version in entry.versions.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
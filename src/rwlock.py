@@ -0,0 +1,96 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """
+    lock de lectores/escritor: varias lecturas en paralelo, una sola
+    escritura a la vez y sin lectores activos. Los escritores en espera tienen
+    prioridad sobre lectores nuevos para no quedarse sin turno.
+
+    Es reentrante por hilo: quien tiene la escritura puede volver a tomarla o
+    tomar lectura; quien ya lee puede volver a leer. Pasar de lectura a
+    escritura no esta permitido porque dos hilos haciendolo se bloquean.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def _read_depth(self):
+        return getattr(self._local, "depth", 0)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me or self._read_depth() > 0:
+                self._local.depth = self._read_depth() + 1
+                if self._writer != me:
+                    self._readers += 1
+                return
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+            self._local.depth = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            self._local.depth = self._read_depth() - 1
+            if self._writer == me:
+                # las lecturas del escritor no se cuentan como lectores
+                return
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if self._read_depth() > 0:
+                raise RuntimeError("No se puede pasar de lectura a escritura con el mismo lock")
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                if self._read_depth() > 0:
+                    # suelta la escritura pero sigue dentro de una lectura
+                    self._readers += 1
+                self._cond.notify_all()
+
+    def held(self):
+        """True si el hilo actual tiene la lectura o la escritura"""
+        return self._writer == threading.get_ident() or self._read_depth() > 0
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
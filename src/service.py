@@ -1,4 +1,4 @@
-from data_handler import DataHandler
+from src.data_handler import DataHandler
 from src.class_error import NotFound, BusinessValidacion
 
 
@@ -0,0 +1,312 @@
+import heapq
+import os
+import zlib
+from contextlib import ExitStack, contextmanager
+from itertools import chain, islice
+
+from src.data_handler import DataHandler, Snapshot, join_entities
+from src.storage_backend import empty_participant_stats, free_seats, get_path, sort_key
+
+# campo que decide la particion de cada entidad; las demas van a la primera
+SHARD_KEYS = {
+    "User": "alias",
+    "Ride": "rideDriver.alias",
+}
+
+
+def shard_of(key, shards):
+    """particion de una clave; estable entre procesos y reinicios (hash() no lo es)"""
+    return zlib.crc32(str(key).encode("utf-8")) % shards
+
+
+def shard_filename(filename, index, shards):
+    """data.json -> data.shard<index>.json; con una sola particion el mismo archivo"""
+    if shards == 1:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.shard{index}{ext}"
+
+
+def open_data_handler(filename='data.json', shards=1, **options):
+    """DataHandler comun con una particion, ShardedDataHandler con mas"""
+    if shards == 1:
+        return DataHandler(filename=filename, **options)
+    return ShardedDataHandler(filename=filename, shards=shards, **options)
+
+
+class ShardedDataHandler:
+    """
+    DataHandler repartido en varias particiones, cada una un DataHandler con
+    su archivo (data.shard<N>.json), su lock y su hilo de escritura. Los
+    usuarios van a la particion de su alias y los rides a la de su
+    conductor, asi todo lo que toca un conductor queda en una particion y
+    las escrituras de conductores distintos no se esperan entre si.
+
+    Los ids de rides de la particion k son congruentes con k modulo la
+    cantidad de particiones, y get_by_key("Ride", id) va directo a la suya
+    (los ids anteriores a particionar se buscan en todas).
+
+    shard(alias) da la particion de un alias, para validar y mutar con su
+    transaction(). Dentro de esa transaccion no hay que leer otras
+    particiones: dos transacciones que se leen en cruz se bloquean. read() y
+    transaction() sin particion toman todas en orden, y las lecturas sin
+    particion (listados, busquedas, estadisticas) consultan todas y juntan
+    los resultados.
+
+    Con backend_factory(filename) cada particion usa ese backend; con
+    SQLiteBackend varias particiones o procesos pueden compartir archivos.
+    """
+
+    def __init__(self, filename='data.json', shards=2, backend_factory=None, **options):
+        if shards < 1:
+            raise ValueError("La cantidad de particiones debe ser mayor que cero")
+        self.filename = filename
+        self.shards = []
+        for index in range(shards):
+            name = shard_filename(filename, index, shards)
+            backend = backend_factory(name) if backend_factory is not None else None
+            self.shards.append(DataHandler(filename=name, backend=backend, shard=(index, shards), **options))
+        self.primary_keys = self.shards[0].primary_keys
+        self._align_sequences()
+
+    def _align_sequences(self):
+        # ningun id nuevo puede repetir uno que ya exista en otra particion
+        last = [shard.backend.next_id("Ride", 0) - 1 for shard in self.shards]
+        for shard, current in zip(self.shards, last):
+            if max(last) > current:
+                shard.backend.next_id("Ride", max(last) - current)
+
+    @property
+    def shared(self):
+        return any(shard.shared for shard in self.shards)
+
+    def shard(self, key):
+        """el DataHandler de la particion de key (alias de un usuario o de un conductor)"""
+        return self.shards[shard_of(key, len(self.shards))]
+
+    def _owner(self, name_entity, entity):
+        path = SHARD_KEYS.get(name_entity)
+        key = get_path(entity, path) if path is not None else None
+        return self.shard(key) if key is not None else self.shards[0]
+
+    def _routed(self, name_entity, filters):
+        # particiones donde puede estar lo que cumple filters: una si fija el
+        # campo de particion, todas si no
+        value = filters.get(SHARD_KEYS.get(name_entity)) if isinstance(filters, dict) else None
+        if isinstance(value, str):
+            return [self.shard(value)]
+        return self.shards
+
+    @contextmanager
+    def read(self):
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.read())
+            yield
+
+    @contextmanager
+    def transaction(self):
+        """bloque exclusivo sobre todas las particiones, tomadas siempre en el mismo orden"""
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.transaction())
+            yield
+
+    def snapshot(self):
+        """un Snapshot con todas las particiones, tomadas juntas"""
+        with self.read():
+            frozen = [shard.backend.freeze() for shard in self.shards]
+        entities = {}
+        for shard_entities in frozen:
+            for name_entity, found in shard_entities.items():
+                entities[name_entity] = entities.get(name_entity, ()) + tuple(found)
+        return Snapshot(entities, self.primary_keys)
+
+    def save_data(self, wait=None):
+        """save_data en cada particion; devuelve sus FlushTicket"""
+        return [shard.save_data(wait) for shard in self.shards]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def load_data(self):
+        for shard in self.shards:
+            shard.load_data()
+
+    def archive_rides(self, ride_ids=None):
+        return sum(shard.archive_rides(ride_ids) for shard in self.shards)
+
+    def version(self, key):
+        return sum(shard.version(key) for shard in self.shards)
+
+    @staticmethod
+    def _as_dict(entity):
+        if hasattr(entity, 'to_dict') and callable(entity.to_dict):
+            return entity.to_dict()
+        if not isinstance(entity, dict):
+            raise TypeError("Entidad no válida: debe ser un dict o tener .to_dict()")
+        return entity
+
+    def add_entity(self, name_entity, entity):
+        entity = self._as_dict(entity)
+        self._owner(name_entity, entity).add_entity(name_entity, entity)
+
+    def batch(self, name_entity, operations):
+        """
+        DataHandler.batch repartido: cada alta va a la particion de la
+        entidad y cada update o delete a todas, que aplican sus lotes con
+        todas las particiones tomadas
+        """
+        lots = {id(shard): (shard, []) for shard in self.shards}
+        for operation in operations:
+            operation = dict(operation)
+            if operation.get("op") not in ("add", "update", "delete"):
+                raise ValueError(f"Operación desconocida: {operation.get('op')}")
+            if operation["op"] == "add":
+                operation["data"] = self._as_dict(operation["data"])
+                lots[id(self._owner(name_entity, operation["data"]))][1].append(operation)
+            else:
+                for _, lot in lots.values():
+                    lot.append(operation)
+        with self.transaction():
+            for shard, lot in lots.values():
+                if lot:
+                    shard.batch(name_entity, lot)
+
+    def add_entities(self, name_entity, entities):
+        self.batch(name_entity, [{"op": "add", "data": entity} for entity in entities])
+
+    def get_entities_filter(self, name_entity, filters):
+        with self.read():
+            found = [shard.get_entities_filter(name_entity, filters) for shard in self._routed(name_entity, filters)]
+        if all(entities is None for entities in found):
+            return None
+        return list(chain.from_iterable(entities or [] for entities in found))
+
+    def delete_entity_filter(self, name_entity, filters):
+        with self.transaction():
+            for shard in self._routed(name_entity, filters):
+                shard.delete_entity_filter(name_entity, filters)
+
+    def update_entity_filter(self, name_entity, filters, updates):
+        with self.transaction():
+            return sum(shard.update_entity_filter(name_entity, filters, updates)
+                       for shard in self._routed(name_entity, filters))
+
+    def query(self, name_entity, where, limit=None, order_by=None):
+        """DataHandler.query en las particiones que corresponden, mezclando en orden si hay order_by"""
+        with self.read():
+            found = [shard.query(name_entity, where, limit, order_by) for shard in self._routed(name_entity, where)]
+        if order_by is not None:
+            merged = heapq.merge(*found, key=lambda entity: sort_key(get_path(entity, order_by)))
+        else:
+            merged = chain.from_iterable(found)
+        return list(islice(merged, limit))
+
+    def search(self, name_entity, text, where=None, limit=None):
+        with self.read():
+            found = [shard.search(name_entity, text, where, limit) for shard in self.shards]
+        return list(islice(heapq.merge(*found, key=lambda item: -item[1]), limit))
+
+    def rides_with_free_seats(self, seats, limit=None):
+        with self.read():
+            found = [shard.rides_with_free_seats(seats, limit) for shard in self.shards]
+        return list(islice(heapq.merge(*found, key=free_seats), limit))
+
+    def get_entities(self, name_entity):
+        with self.read():
+            found = [shard.get_entities(name_entity) for shard in self.shards]
+        if all(entities is None for entities in found):
+            return None
+        return list(chain.from_iterable(entities or [] for entities in found))
+
+    def get_entities_page(self, name_entity, filters=None, limit=None, offset=0, after=None):
+        """
+        DataHandler.get_entities_page recorriendo las particiones una tras
+        otra; la posicion es [particion, posicion dentro de la particion]
+        """
+        index, inner = after if after is not None else (0, None)
+        items, found = [], False
+        with self.read():
+            while index < len(self.shards):
+                if limit is not None and len(items) >= limit:
+                    return items, [index, inner]
+                # el offset se pide como filas de mas y se descarta aca
+                wanted = None if limit is None else limit - len(items) + offset
+                page, position = self.shards[index].get_entities_page(name_entity, filters, wanted, 0, inner)
+                if page is not None:
+                    found = True
+                    skipped = min(offset, len(page))
+                    offset -= skipped
+                    items.extend(page[skipped:])
+                if position is not None:
+                    inner = position
+                else:
+                    index, inner = index + 1, None
+        return (items if found else None), None
+
+    def get_by_key(self, name_entity, key):
+        if name_entity == "User":
+            return self.shard(key).get_by_key(name_entity, key)
+        if name_entity not in self.primary_keys:
+            raise KeyError(f"La entidad '{name_entity}' no tiene clave primaria")
+        first = self.shards[key % len(self.shards)] if isinstance(key, int) else self.shards[0]
+        found = first.get_by_key(name_entity, key)
+        for shard in self.shards:
+            if found is not None:
+                break
+            if shard is not first:
+                found = shard.get_by_key(name_entity, key)
+        return found
+
+    def join(self, name_entity, entities):
+        with self.read():
+            return join_entities(name_entity, entities, lambda alias: self.get_by_key("User", alias))
+
+    def expand(self, name_entity, entity):
+        if entity is None:
+            return None
+        return self.join(name_entity, [entity])[0]
+
+    def normalize_rides(self):
+        return sum(shard.normalize_rides() for shard in self.shards)
+
+    def create_index(self, name_entity, path):
+        for shard in self.shards:
+            shard.create_index(name_entity, path)
+
+    def next_id(self, name_entity, count=1, key=None):
+        """next_id en la particion de key, que es donde va la entidad"""
+        shard = self.shard(key) if key is not None else self.shards[0]
+        return shard.next_id(name_entity, count)
+
+    def get_participant_stats(self, alias):
+        """un participante puede estar en rides de cualquier conductor: se suma en todas"""
+        stats = empty_participant_stats()
+        with self.read():
+            for shard in self.shards:
+                for field, value in shard.get_participant_stats(alias).items():
+                    stats[field] += value
+        return stats
+
+    def compact(self, background=False):
+        for shard in self.shards:
+            shard.compact(background)
+
+    def import_from(self, data_handler):
+        """
+        reparte en las particiones los usuarios y rides (tambien los
+        archivados) de un DataHandler sin particionar, para pasar a este modo;
+        los ids de los rides se conservan
+        """
+        with data_handler.read():
+            users = data_handler.get_entities("User") or []
+            rides = data_handler.get_entities("Ride") or []
+            if data_handler.archive is not None:
+                rides += data_handler.archive.find({})
+        self.add_entities("User", users)
+        self.add_entities("Ride", rides)
+        self.archive_rides()
+        self._align_sequences()
+        self.save_data(wait=True)
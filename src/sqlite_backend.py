@@ -0,0 +1,418 @@
+import json
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from src.query import Query
+from src.storage_backend import StorageBackend, PARTICIPANT_STATS, ENTITIES_SCANNED, empty_participant_stats, get_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    alias TEXT PRIMARY KEY,
+    name TEXT,
+    car_plate TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rides (
+    pk INTEGER PRIMARY KEY,
+    id INTEGER UNIQUE,
+    ride_date TEXT,
+    final_address TEXT,
+    allowed_spaces INTEGER,
+    driver_alias TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rides_driver ON rides (driver_alias);
+CREATE INDEX IF NOT EXISTS rides_status ON rides (status, ride_date);
+CREATE INDEX IF NOT EXISTS rides_date ON rides (ride_date);
+CREATE TABLE IF NOT EXISTS participations (
+    ride_pk INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    participant_alias TEXT,
+    destination TEXT,
+    occupied_spaces INTEGER,
+    status TEXT,
+    confirmation TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (ride_pk, position)
+);
+CREATE INDEX IF NOT EXISTS participations_alias ON participations (participant_alias, status);
+CREATE TABLE IF NOT EXISTS entities (
+    pk INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entities_name ON entities (name);
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# columnas de cada tabla y el campo del dict que guardan
+USER_COLUMNS = {
+    "alias": "alias",
+    "name": "name",
+    "car_plate": "car_plate",
+}
+RIDE_COLUMNS = {
+    "id": "id",
+    "rideDateAndTime": "ride_date",
+    "finalAddress": "final_address",
+    "allowedSpaces": "allowed_spaces",
+    "rideDriver.alias": "driver_alias",
+    "status": "status",
+}
+PARTICIPATION_COLUMNS = {
+    "participant.alias": "participant_alias",
+    "destination": "destination",
+    "occupiedSpaces": "occupied_spaces",
+    "status": "status",
+    "confirmation": "confirmation",
+}
+
+DEFAULT_ENTITIES = ("entities", "User", "Ride")
+
+# solo rutas simples se pueden poner dentro de json_extract
+PATH_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+# limite de parametros por consulta IN (...)
+CHUNK = 500
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    entidades en tablas SQLite con indices: users, rides y participations
+    (una fila por participacion), y una tabla generica para el resto. Los
+    filtros se traducen a WHERE sobre columnas o json_extract, asi que no hay
+    que cargar todo en memoria, y varios procesos pueden usar el mismo
+    archivo (modo WAL).
+    """
+    shared = True
+
+    def __init__(self, filename='data.db', timeout=30):
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def _begin(self, mode):
+        conn = self._conn()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute(f"BEGIN {mode}")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = 0
+            conn.rollback()
+            raise
+        self._local.depth = 0
+        conn.commit()
+
+    def read_transaction(self):
+        return self._begin("DEFERRED")
+
+    def transaction(self):
+        # IMMEDIATE toma el lock de escritura de la base al empezar, asi el
+        # chequeo y la escritura quedan atomicos tambien entre procesos
+        return self._begin("IMMEDIATE")
+
+    def load(self):
+        self._conn().executescript(SCHEMA)
+
+    def save(self):
+        # cada transaccion ya queda confirmada en la base
+        pass
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def import_entities(self, dict_entities):
+        """carga un dict con la forma de data.json (por ejemplo para migrar)"""
+        with self.transaction():
+            for name_entity, entities in dict_entities.items():
+                if not isinstance(entities, list):
+                    continue
+                for entity in entities:
+                    self.add(name_entity, entity)
+
+    def has_entity(self, name_entity):
+        if name_entity in DEFAULT_ENTITIES:
+            return True
+        with self.read_transaction() as conn:
+            return conn.execute("SELECT 1 FROM entities WHERE name = ? LIMIT 1", (name_entity,)).fetchone() is not None
+
+    # filas <-> dicts
+
+    def _user_row(self, user):
+        return (user.get("alias"), user.get("name"), user.get("car_plate"), json.dumps(user))
+
+    def _ride_row(self, ride):
+        data = {k: v for k, v in ride.items() if k != "participants"}
+        return tuple(get_path(ride, path) for path in RIDE_COLUMNS) + (json.dumps(data),)
+
+    def _insert_participations(self, conn, ride_pk, participants):
+        conn.executemany(
+            "INSERT INTO participations (ride_pk, position, participant_alias, destination, occupied_spaces, "
+            "status, confirmation, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(ride_pk, position) + tuple(get_path(p, path) for path in PARTICIPATION_COLUMNS) + (json.dumps(p),)
+             for position, p in enumerate(participants or [])])
+
+    def _rides_from_rows(self, conn, rows):
+        rides = {}
+        for pk, data in rows:
+            ride = json.loads(data)
+            ride["participants"] = []
+            rides[pk] = ride
+        pks = list(rides)
+        for start in range(0, len(pks), CHUNK):
+            chunk = pks[start:start + CHUNK]
+            marks = ",".join("?" * len(chunk))
+            for ride_pk, data in conn.execute(
+                    f"SELECT ride_pk, data FROM participations WHERE ride_pk IN ({marks}) ORDER BY ride_pk, position",
+                    chunk):
+                rides[ride_pk]["participants"].append(json.loads(data))
+        return [(pk, ride) for pk, ride in rides.items()]
+
+    # consultas
+
+    def _table(self, name_entity):
+        if name_entity == "User":
+            return "users", "rowid", USER_COLUMNS
+        if name_entity == "Ride":
+            return "rides", "pk", RIDE_COLUMNS
+        return "entities", "pk", {}
+
+    def _where(self, name_entity, filters):
+        """
+        separa los filtros en condiciones SQL y los que se evaluan en Python
+        (valores compuestos o rutas dentro de participants)
+        """
+        table, _, _ = self._table(name_entity)
+        clauses, params, rest = [], [], {}
+        if table == "entities":
+            clauses.append("name = ?")
+            params.append(name_entity)
+        for key, value in filters.items():
+            column = self._column(name_entity, key)
+            condition = self._condition(column, Query.operators(value)) if column is not None else None
+            if condition is None:
+                rest[key] = value
+            else:
+                clauses.extend(condition[0])
+                params.extend(condition[1])
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, params, rest
+
+    def _condition(self, column, ops):
+        # operadores de Query como SQL; None si alguno necesita Python
+        # (valores compuestos)
+        clauses, params = [], []
+        for op, argument in ops.items():
+            if op == "exists":
+                clauses.append(f"{column} IS {'NOT ' if argument else ''}NULL")
+            elif op == "in":
+                values = list(argument)
+                if not values or any(isinstance(v, (dict, list)) or v is None for v in values):
+                    return None
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif isinstance(argument, (dict, list)):
+                return None
+            elif op == "eq":
+                if argument is None:
+                    clauses.append(f"{column} IS NULL")
+                else:
+                    clauses.append(f"{column} = ?")
+                    params.append(argument)
+            elif argument is None:
+                return None
+            else:
+                sql_op = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}[op]
+                clauses.append(f"{column} {sql_op} ?")
+                params.append(argument)
+        return clauses, params
+
+    def _select(self, conn, name_entity, filters):
+        table, key, _ = self._table(name_entity)
+        where, params, rest = self._where(name_entity, filters)
+        rows = conn.execute(f"SELECT {key}, data FROM {table}{where} ORDER BY {key}", params).fetchall()
+        ENTITIES_SCANNED.observe(len(rows), entity=name_entity)
+        if table == "rides":
+            found = self._rides_from_rows(conn, rows)
+        else:
+            found = [(pk, json.loads(data)) for pk, data in rows]
+        if rest:
+            query = Query(rest)
+            found = [(pk, entity) for pk, entity in found if query.matches(entity)]
+        return found
+
+    def find(self, name_entity, filters):
+        with self.read_transaction() as conn:
+            return [entity for _, entity in self._select(conn, name_entity, filters)]
+
+    def _column(self, name_entity, path):
+        # columna o json_extract de una ruta; None si solo se evalua en Python
+        _, _, columns = self._table(name_entity)
+        column = columns.get(path)
+        if column is None and PATH_RE.match(path) and not path.startswith("participants"):
+            column = f"json_extract(data, '$.{path}')"
+        return column
+
+    def page(self, name_entity, filters, limit=None, offset=0, after=None):
+        return self._scan(name_entity, filters, limit, offset, after)
+
+    def _scan(self, name_entity, filters, limit=None, offset=0, after=None, order=None):
+        table, key, _ = self._table(name_entity)
+        where, params, rest = self._where(name_entity, filters)
+        if after is not None:
+            where += (" AND " if where else " WHERE ") + f"{key} > ?"
+            params.append(after)
+        # order: columna extra por la que ordenar antes que la clave, con los
+        # NULL al final como en los otros backends
+        order_sql = f"{order} IS NULL, {order}, {key}" if order is not None else key
+        sql = f"SELECT {key}, data FROM {table}{where} ORDER BY {order_sql}"
+        if not rest:
+            # sin filtros en Python el limite y el offset van en la consulta
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset]
+            offset = 0
+
+        query = Query(rest) if rest else None
+        items, last, scanned = [], None, 0
+        try:
+            with self.read_transaction() as conn:
+                cursor = conn.execute(sql, params)
+                while limit is None or len(items) < limit:
+                    rows = cursor.fetchmany(CHUNK if rest or limit is None else limit - len(items))
+                    if not rows:
+                        return items, None
+                    scanned += len(rows)
+                    found = self._rides_from_rows(conn, rows) if table == "rides" else \
+                        [(pk, json.loads(data)) for pk, data in rows]
+                    for pk, entity in found:
+                        last = pk
+                        if query is not None and not query.matches(entity):
+                            continue
+                        if offset:
+                            offset -= 1
+                            continue
+                        items.append(entity)
+                        if limit is not None and len(items) == limit:
+                            break
+            return items, last
+        finally:
+            ENTITIES_SCANNED.observe(scanned, entity=name_entity)
+
+    def query(self, name_entity, query, limit=None, order_by=None):
+        # _scan ya lleva a SQL lo que puede (tambien el orden, que usa el
+        # indice de la columna) y recorre el resto por partes
+        order = None
+        if order_by is not None:
+            order = self._column(name_entity, order_by)
+            if order is None:
+                return super().query(name_entity, query, limit, order_by)
+        items, _ = self._scan(name_entity, query.where, limit, order=order)
+        return items
+
+    def all(self, name_entity):
+        return self.find(name_entity, {})
+
+    def get_by_key(self, name_entity, key):
+        found = self.find(name_entity, {self.primary_keys[name_entity]: key})
+        return found[0] if found else None
+
+    # mutaciones
+
+    def add(self, name_entity, entity):
+        with self.transaction() as conn:
+            if name_entity == "User":
+                conn.execute("INSERT INTO users (alias, name, car_plate, data) VALUES (?, ?, ?, ?)",
+                             self._user_row(entity))
+            elif name_entity == "Ride":
+                cursor = conn.execute(
+                    "INSERT INTO rides (id, ride_date, final_address, allowed_spaces, driver_alias, status, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", self._ride_row(entity))
+                self._insert_participations(conn, cursor.lastrowid, entity.get("participants"))
+            else:
+                conn.execute("INSERT INTO entities (name, data) VALUES (?, ?)", (name_entity, json.dumps(entity)))
+
+    def update(self, name_entity, filters, updates):
+        with self.transaction() as conn:
+            for pk, entity in self._select(conn, name_entity, filters):
+                entity.update(updates)
+                if name_entity == "User":
+                    conn.execute("UPDATE users SET alias = ?, name = ?, car_plate = ?, data = ? WHERE rowid = ?",
+                                 self._user_row(entity) + (pk,))
+                elif name_entity == "Ride":
+                    conn.execute(
+                        "UPDATE rides SET id = ?, ride_date = ?, final_address = ?, allowed_spaces = ?, "
+                        "driver_alias = ?, status = ?, data = ? WHERE pk = ?", self._ride_row(entity) + (pk,))
+                    if "participants" in updates:
+                        conn.execute("DELETE FROM participations WHERE ride_pk = ?", (pk,))
+                        self._insert_participations(conn, pk, entity.get("participants"))
+                else:
+                    conn.execute("UPDATE entities SET data = ? WHERE pk = ?", (json.dumps(entity), pk))
+
+    def delete(self, name_entity, filters):
+        table, key, _ = self._table(name_entity)
+        with self.transaction() as conn:
+            pks = [(pk,) for pk, _ in self._select(conn, name_entity, filters)]
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", pks)
+            if table == "rides":
+                conn.executemany("DELETE FROM participations WHERE ride_pk = ?", pks)
+
+    def create_index(self, name_entity, path):
+        table, _, columns = self._table(name_entity)
+        column = columns.get(path)
+        if column is None:
+            if not PATH_RE.match(path):
+                raise ValueError(f"Ruta de índice no válida: {path}")
+            column = f"json_extract(data, '$.{path}')"
+        if table == "entities":
+            column = f"name, {column}"
+        name = "idx_" + re.sub(r'\W', '_', f"{table}_{path}")
+        with self.transaction() as conn:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})")
+
+    def participant_stats(self, alias):
+        stats = empty_participant_stats()
+        with self.read_transaction() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM participations WHERE participant_alias = ? GROUP BY status", (alias,))
+            for status, count in rows:
+                stats["previousRidesTotal"] += count
+                field = PARTICIPANT_STATS.get(status)
+                if field:
+                    stats[field] += count
+        return stats
+
+    def next_id(self, name_entity, count=1):
+        base = "SELECT COALESCE(MAX(id), 0) FROM rides" if name_entity == "Ride" else "SELECT 0"
+        with self.transaction() as conn:
+            conn.execute(f"INSERT OR IGNORE INTO sequences (name, value) VALUES (?, ({base}))", (name_entity,))
+            conn.execute(f"UPDATE sequences SET value = MAX(value, ({base})) + ? WHERE name = ?", (count, name_entity))
+            last = conn.execute("SELECT value FROM sequences WHERE name = ?", (name_entity,)).fetchone()[0]
+            return last - count + 1
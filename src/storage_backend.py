@@ -0,0 +1,258 @@
+from contextlib import contextmanager
+
+from src.metrics import REGISTRY
+from src.models.records import Record
+from src.query import Query
+from src.text_index import TextIndex
+
+
+ENTITIES_SCANNED = REGISTRY.histogram(
+    "datahandler_entities_scanned", "entidades revisadas por consulta", ("entity",),
+    buckets=(1, 10, 100, 1000, 10000, 100000, 1000000))
+
+
+def get_path(entity, path):
+    """devuelve el valor de un campo anidado, p. ej. rideDriver.alias"""
+    value = entity
+    for part in path.split('.'):
+        if not isinstance(value, (dict, Record)):
+            return None
+        value = value.get(part)
+    return value
+
+
+def sort_key(value):
+    # los valores None van despues de todos los demas
+    return value is None, value
+
+
+def matches(entity, filters):
+    """
+    si la entidad cumple filters; acepta los operadores de Query. Para
+    muchas entidades conviene compilar Query(filters) una sola vez
+    """
+    return Query(filters).matches(entity)
+
+
+# contador de reputacion que incrementa cada estado de participacion
+PARTICIPANT_STATS = {
+    "completed": "previousRidesCompleted",
+    "missing": "previousRidesMissing",
+    "notmarked": "previousRidesNotMarked",
+    "not_marked": "previousRidesNotMarked",
+    "rejected": "previousRidesRejected",
+}
+
+
+def empty_participant_stats():
+    return {
+        "previousRidesTotal": 0,
+        "previousRidesCompleted": 0,
+        "previousRidesMissing": 0,
+        "previousRidesNotMarked": 0,
+        "previousRidesRejected": 0
+    }
+
+
+# estados de participacion que ocupan asientos: confirmados o pendientes
+# de que el conductor responda
+SEAT_STATUSES = {
+    "confirmed": "confirmedSeats",
+    "inprogress": "confirmedSeats",
+    "done": "confirmedSeats",
+    "completed": "confirmedSeats",
+    "waiting": "pendingSeats",
+}
+
+
+# campos internos de un ride guardado con sus contadores (ver seat_counters);
+# no son parte de las respuestas de la API
+SEAT_COUNTERS = ("confirmedSeats", "pendingSeats")
+
+
+def seat_counters(participants):
+    """asientos confirmados y pendientes de una lista de participaciones"""
+    counters = {"confirmedSeats": 0, "pendingSeats": 0}
+    for p in participants or []:
+        field = SEAT_STATUSES.get(p.get("status"))
+        if field:
+            counters[field] += p.get("occupiedSpaces", 1)
+    return counters
+
+
+def ride_seats(ride):
+    """(confirmados, pendientes) de un ride, de sus contadores o de sus participantes si no los tiene"""
+    confirmed, pending = ride.get("confirmedSeats"), ride.get("pendingSeats")
+    if confirmed is None or pending is None:
+        counters = seat_counters(ride.get("participants"))
+        confirmed, pending = counters["confirmedSeats"], counters["pendingSeats"]
+    return confirmed, pending
+
+
+def free_seats(ride):
+    """asientos que quedan para nuevas solicitudes: ni confirmados ni pendientes"""
+    confirmed, pending = ride_seats(ride)
+    return (ride.get("allowedSpaces") or 0) - confirmed - pending
+
+
+class StorageBackend:
+    """
+    interfaz de almacenamiento detras de DataHandler. DataHandler se encarga
+    del locking entre hilos; el backend solo guarda y consulta entidades.
+    Las entidades entran y salen con la forma de dict que usan los
+    controladores, los filtros son igualdades sobre campos (con punto para
+    campos anidados).
+    """
+
+    # clave primaria de cada entidad
+    primary_keys = {
+        "User": "alias",
+        "Ride": "id",
+    }
+    # indices secundarios declarados por defecto
+    secondary_indexes = {
+        "Ride": ("rideDriver.alias", "status"),
+    }
+    # indices ordenados, para rangos y orden por ese campo
+    sorted_indexes = {
+        "Ride": ("rideDateAndTime",),
+    }
+    # campos de texto para search, con su peso en el puntaje
+    text_indexes = {
+        "Ride": (("finalAddress", 2), ("participants[].destination", 1)),
+    }
+    # True si otros procesos pueden escribir el mismo almacenamiento; en ese
+    # caso lo que se cachea en un proceso puede quedar desactualizado
+    shared = False
+    # False si lo cargado puede tener rides guardados antes de las
+    # referencias a usuarios; DataHandler los migra al cargar (ver
+    # DataHandler.normalize_rides)
+    normalized = True
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self):
+        raise NotImplementedError
+
+    def prepare_save(self):
+        """
+        parte de save() que necesita el lock de DataHandler; devuelve una
+        funcion con el resto, que DataHandler llama ya sin el lock
+        """
+        self.save()
+        return lambda: None
+
+    def freeze(self):
+        """
+        vista de solo lectura del estado actual: {tipo de entidad: tupla de
+        entidades} que no cambia con las mutaciones posteriores
+        """
+        return {name: tuple(self.all(name)) for name in self.primary_keys if self.has_entity(name)}
+
+    def close(self):
+        pass
+
+    def has_entity(self, name_entity):
+        raise NotImplementedError
+
+    def add(self, name_entity, entity):
+        raise NotImplementedError
+
+    def all(self, name_entity):
+        raise NotImplementedError
+
+    def find(self, name_entity, filters):
+        raise NotImplementedError
+
+    def query(self, name_entity, query, limit=None, order_by=None):
+        """
+        entidades que cumplen un Query (ver src/query.py), a lo sumo limit,
+        ordenadas por el campo order_by si se indica (sin valor al final);
+        por defecto recorre todas
+        """
+        if order_by is None:
+            found = list(query.filter(self.all(name_entity), limit))
+        else:
+            found = sorted(query.filter(self.all(name_entity)), key=lambda e: sort_key(get_path(e, order_by)))
+            found = found if limit is None else found[:limit]
+        ENTITIES_SCANNED.observe(query.scanned, entity=name_entity)
+        return found
+
+    def search(self, name_entity, text, query=None, limit=None):
+        """
+        (entidad, puntaje) de las entidades cuyos campos de text_indexes
+        tienen las palabras de text (ver TextIndex.search) y cumplen query,
+        de mayor a menor puntaje; por defecto indexa todas en cada llamada
+        """
+        index = TextIndex(self.text_indexes.get(name_entity, ()))
+        for entity in self.all(name_entity):
+            if query is None or query.matches(entity):
+                index.add(entity)
+        found = index.search(text)
+        return found if limit is None else found[:limit]
+
+    def rides_with_free_seats(self, seats, limit=None):
+        """
+        rides en estado ready con al menos seats asientos libres (free_seats),
+        los de menos asientos libres primero; por defecto recorre los ready
+        """
+        found = [(free_seats(ride), ride) for ride in self.query("Ride", Query({"status": "ready"}))]
+        found = sorted((item for item in found if item[0] >= seats), key=lambda item: item[0])
+        return [ride for _, ride in found[:limit]]
+
+    def get_by_key(self, name_entity, key):
+        raise NotImplementedError
+
+    def page(self, name_entity, filters, limit=None, offset=0, after=None):
+        """
+        devuelve (entidades, siguiente) con a lo sumo limit entidades que
+        cumplen filters, saltando offset o continuando despues de la posicion
+        after; siguiente es la posicion para pedir la pagina que sigue (un
+        valor serializable a JSON) o None si no hay mas
+        """
+        raise NotImplementedError
+
+    def update(self, name_entity, filters, updates):
+        raise NotImplementedError
+
+    def delete(self, name_entity, filters):
+        raise NotImplementedError
+
+    def batch(self, name_entity, operations):
+        """
+        aplica en orden una lista de mutaciones sobre un tipo de entidad:
+        {"op": "add", "data": ...}, {"op": "update", "filters": ...,
+        "updates": ...} o {"op": "delete", "filters": ...}. Por defecto las
+        hace una por una dentro de una sola transaccion
+        """
+        with self.transaction():
+            for operation in operations:
+                if operation["op"] == "add":
+                    self.add(name_entity, operation["data"])
+                elif operation["op"] == "update":
+                    self.update(name_entity, operation["filters"], operation["updates"])
+                elif operation["op"] == "delete":
+                    self.delete(name_entity, operation["filters"])
+                else:
+                    raise ValueError(f"Operación desconocida: {operation['op']}")
+
+    def create_index(self, name_entity, path):
+        raise NotImplementedError
+
+    def participant_stats(self, alias):
+        raise NotImplementedError
+
+    def next_id(self, name_entity, count=1):
+        raise NotImplementedError
+
+    def compact(self, background=False):
+        pass
+
+    @contextmanager
+    def read_transaction(self):
+        yield
+
+    @contextmanager
+    def transaction(self):
+        yield
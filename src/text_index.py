@@ -0,0 +1,111 @@
+import math
+import re
+import unicodedata
+from bisect import bisect_left, insort
+
+from src.query import _path_getter
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """palabras en minusculas y sin tildes: "Av. Javier Prado" da av, javier, prado"""
+    if not isinstance(text, str):
+        return []
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(text)
+
+
+def field_weights(entity, fields):
+    """
+    peso de cada palabra de la entidad: la suma de los pesos de los campos
+    (path, peso) donde aparece, contando cada aparicion
+    """
+    weights = {}
+    for getter, weight in fields:
+        for value in getter(entity):
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+class TextIndex:
+    """
+    indice invertido de palabras a entidades, sobre los campos de texto
+    indicados con su peso. El vocabulario se mantiene ordenado, asi una
+    palabra incompleta encuentra sus palabras con busqueda binaria y el costo
+    depende de las palabras y entidades que coinciden, no del total
+    """
+
+    def __init__(self, fields):
+        self.fields = [(_path_getter(path), weight) for path, weight in fields]
+        self._postings = {}
+        self._vocabulary = []
+        self._docs = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, entity):
+        weights = field_weights(entity, self.fields)
+        self._docs[id(entity)] = (entity, weights)
+        for token, weight in weights.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                insort(self._vocabulary, token)
+            posting[id(entity)] = weight
+
+    def remove(self, entity):
+        _, weights = self._docs.pop(id(entity), (None, {}))
+        for token in weights:
+            posting = self._postings[token]
+            posting.pop(id(entity), None)
+            if not posting:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _expand(self, word, prefix):
+        # palabras del vocabulario iguales a word o, con prefix, que empiezan con word
+        if not prefix:
+            return [word] if word in self._postings else []
+        start = bisect_left(self._vocabulary, word)
+        found = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(word):
+                break
+            found.append(token)
+        return found
+
+    def search(self, text, prefix=True):
+        """
+        (entidad, puntaje) de las entidades que tienen todas las palabras de
+        text (con prefix, alguna palabra que empiece con cada una), de mayor a
+        menor puntaje. El puntaje suma por palabra el peso del campo por su
+        idf; una coincidencia por prefijo vale la fraccion de la palabra que
+        se escribio
+        """
+        words = list(dict.fromkeys(tokenize(text)))
+        if not words:
+            return []
+        total = len(self._docs)
+        scores = None
+        for word in words:
+            word_scores = {}
+            for token in self._expand(word, prefix):
+                posting = self._postings[token]
+                idf = math.log(1 + total / len(posting))
+                factor = idf * len(word) / len(token)
+                for doc, weight in posting.items():
+                    score = weight * factor
+                    if score > word_scores.get(doc, 0):
+                        word_scores[doc] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {doc: score + word_scores[doc] for doc, score in scores.items() if doc in word_scores}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        return [(self._docs[doc][0], score) for doc, score in ranked]
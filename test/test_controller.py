@@ -0,0 +1,110 @@
+import atexit
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from src.data_handler import DataHandler
+from src.response_cache import ResponseCache
+
+try:
+    import flask
+except ImportError:
+    flask = None
+
+
+@unittest.skipIf(flask is None, "Flask no está instalado")
+class controller_decisiones_tests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # el modulo abre data.json del directorio actual al importarse: se
+        # importa desde un directorio vacio y ese handler se cierra
+        cls.tmpdir = tempfile.mkdtemp()
+        fresh = "src.controller" not in sys.modules
+        cwd = os.getcwd()
+        os.chdir(cls.tmpdir)
+        try:
+            cls.controller = importlib.import_module("src.controller")
+        finally:
+            os.chdir(cwd)
+        if fresh:
+            atexit.unregister(cls.controller.data_handler.close)
+            cls.controller.data_handler.close()
+        cls.controller.app.config["TESTING"] = True
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def setUp(self):
+        self.filename = os.path.join(tempfile.mkdtemp(dir=self.tmpdir), "data.json")
+        self.handler = DataHandler(self.filename, journal=True, archive=True)
+        self.controller.data_handler = self.handler
+        self.controller.service.data_handler = self.handler
+        self.controller.response_cache = ResponseCache(self.handler)
+        self.client = self.controller.app.test_client()
+
+        for alias in ("ana", "luis", "maria", "pedro"):
+            self.handler.add_entity("User", {"alias": alias, "name": alias.title(), "car_plate": None})
+        participantes = [{"participant": {"alias": alias}, "status": "waiting", "occupiedSpaces": 1,
+                          "destination": "Lima", "confirmation": None} for alias in ("luis", "maria", "pedro")]
+        self.handler.add_entity("Ride", {"id": 1, "rideDateAndTime": "2025-07-16T18:00:00", "finalAddress": "Lima",
+                                         "allowedSpaces": 2, "rideDriver": {"alias": "ana"}, "status": "ready",
+                                         "participants": participantes})
+
+    def tearDown(self):
+        self.handler.close()
+
+    def estados(self):
+        ride = self.handler.get_by_key("Ride", 1)
+        return {p["participant"]["alias"]: p["status"] for p in ride["participants"]}
+
+    def test_exito_decisiones_de_un_ride(self):
+        # prueba de éxito: las decisiones se aplican juntas y se devuelven con los datos del participante
+        respuesta = self.client.post("/usuarios/ana/rides/1/decisions", json={"decisiones": [
+            {"participantAlias": "luis", "decision": "accept"},
+            {"participantAlias": "maria", "decision": "accept"},
+            {"participantAlias": "pedro", "decision": "reject"}]})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self.estados(), {"luis": "confirmed", "maria": "confirmed", "pedro": "rejected"})
+        participaciones = respuesta.get_json()["participaciones"]
+        self.assertEqual([p["participant"]["name"] for p in participaciones], ["Luis", "Maria", "Pedro"])
+
+    def test_exito_rechazo_en_ride_sobre_capacidad(self):
+        # prueba de éxito: un lote sin aceptaciones no depende de los asientos libres
+        self.handler.update_entity_filter("Ride", {"id": 1}, {"allowedSpaces": 0})
+        respuesta = self.client.post("/usuarios/ana/rides/1/decisions",
+                                     json=[{"participantAlias": "pedro", "decision": "reject"}])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self.estados()["pedro"], "rejected")
+
+    def test_error_lote_sobre_capacidad_no_aplica_nada(self):
+        # error controlado: si las aceptaciones no entran no se aplica ninguna decisión del lote
+        respuesta = self.client.post("/usuarios/ana/rides/1/decisions", json=[
+            {"participantAlias": "luis", "decision": "accept"},
+            {"participantAlias": "maria", "decision": "accept"},
+            {"participantAlias": "pedro", "decision": "accept"},
+            {"participantAlias": "luis", "decision": "maybe"}])
+
+        self.assertEqual(respuesta.status_code, 422)
+        errores = respuesta.get_json()["errores"]
+        self.assertEqual(errores[0]["fila"], 3)
+        self.assertEqual(errores[1]["error"], "No hay espacios suficientes disponibles")
+        self.assertEqual(set(self.estados().values()), {"waiting"})
+
+    def test_error_ride_de_otro_conductor(self):
+        # error controlado: el ride tiene que ser del conductor de la ruta y el lote no puede venir vacío
+        respuesta = self.client.post("/usuarios/luis/rides/1/decisions",
+                                     json=[{"participantAlias": "maria", "decision": "reject"}])
+        self.assertEqual(respuesta.status_code, 404)
+        respuesta = self.client.post("/usuarios/ana/rides/1/decisions", json={"decisiones": []})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(set(self.estados().values()), {"waiting"})
+
+
+if __name__ == '__main__':
+    unittest.main()
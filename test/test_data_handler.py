@@ -0,0 +1,550 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from src.data_handler import DataHandler
+from src.query import Query
+
+
+class data_handler_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "data.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def nuevo_handler(self, **kwargs):
+        return DataHandler(filename=self.filename, **kwargs)
+
+    def test_journal_reproduce_mutaciones_al_cargar(self):
+        # prueba de éxito: las mutaciones se recuperan del log sin reescribir el snapshot
+        handler = self.nuevo_handler(journal=True)
+        handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": []})
+        handler.update_entity_filter("Ride", {"id": 1}, {"status": "inprogress"})
+        handler.save_data()
+
+        self.assertFalse(os.path.exists(self.filename))
+        recargado = self.nuevo_handler(journal=True)
+        self.assertEqual(recargado.get_entities_filter("Ride", {"id": 1})[0]["status"], "inprogress")
+        self.assertEqual(len(recargado.get_entities("User")), 1)
+
+    def test_journal_compactacion_descarta_log(self):
+        # prueba de éxito: al compactar el estado queda en el snapshot y el log se vacía
+        handler = self.nuevo_handler(journal=True, compact_every=3)
+        for i in range(5):
+            handler.add_entity("User", {"alias": f"u{i}", "name": "x", "car_plate": None})
+        handler.delete_entity_filter("User", {"alias": "u0"})
+        handler.compact()
+
+        with open(self.filename) as f:
+            self.assertEqual(len(json.load(f)["User"]), 4)
+        self.assertFalse(os.path.exists(handler.backend.journal_filename))
+        recargado = self.nuevo_handler(journal=True)
+        self.assertEqual([u["alias"] for u in recargado.get_entities("User")], ["u1", "u2", "u3", "u4"])
+
+    def test_error_journal_linea_truncada(self):
+        # error controlado: una línea incompleta al final del log se ignora
+        handler = self.nuevo_handler(journal=True)
+        handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        handler.save_data()
+        with open(handler.backend.journal_filename, "a") as f:
+            f.write('{"op": "add", "entity": "User", "da')
+
+        recargado = self.nuevo_handler(journal=True)
+        self.assertEqual(len(recargado.get_entities("User")), 1)
+
+    def test_indice_clave_primaria_tras_mutaciones(self):
+        # prueba de éxito: get_by_key sigue los cambios de add, update y delete
+        handler = self.nuevo_handler()
+        handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": []})
+        handler.update_entity_filter("User", {"alias": "ana"}, {"alias": "ana2"})
+        handler.delete_entity_filter("Ride", {"id": 1})
+
+        self.assertIsNone(handler.get_by_key("User", "ana"))
+        self.assertEqual(handler.get_by_key("User", "ana2")["name"], "Ana")
+        self.assertIsNone(handler.get_by_key("Ride", 1))
+        self.assertEqual(handler.get_entities("Ride"), [])
+
+    def test_error_get_by_key_entidad_sin_clave(self):
+        # error controlado: una entidad sin clave primaria declarada no se puede consultar por clave
+        handler = self.nuevo_handler()
+        with self.assertRaises(KeyError):
+            handler.get_by_key("entities", 1)
+
+    def test_indice_secundario_campo_anidado(self):
+        # prueba de éxito: el filtro por rideDriver.alias y status usa los índices y sigue las actualizaciones
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "rideDriver": {"alias": "ana"}, "participants": []})
+        handler.add_entity("Ride", {"id": 2, "status": "ready", "rideDriver": {"alias": "luis"}, "participants": []})
+        handler.add_entity("Ride", {"id": 3, "status": "ready", "rideDriver": {"alias": "ana"}, "participants": []})
+        handler.update_entity_filter("Ride", {"id": 3}, {"status": "inprogress"})
+
+        self.assertEqual([r["id"] for r in handler.get_entities_filter("Ride", {"rideDriver.alias": "ana"})], [1, 3])
+        self.assertEqual([r["id"] for r in handler.get_entities_filter(
+            "Ride", {"rideDriver.alias": "ana", "status": "ready"})], [1])
+        self.assertEqual([r.to_dict() for r in handler.backend._candidates("Ride", {"rideDriver.alias": "luis"})],
+                         [handler.get_by_key("Ride", 2)])
+
+    def test_filtro_sin_indice_recorre_entidades(self):
+        # prueba de éxito: un campo anidado sin índice se resuelve recorriendo las entidades
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "origin": {"district": "Surco"}})
+        handler.add_entity("Ride", {"id": 2, "status": "ready", "origin": {"district": "Lima"}})
+
+        self.assertEqual([r["id"] for r in handler.get_entities_filter("Ride", {"origin.district": "Lima"})], [2])
+        handler.create_index("Ride", "origin.district")
+        self.assertEqual(len(handler.backend._candidates("Ride", {"origin.district": "Lima"})), 1)
+
+    def test_estadisticas_participante_incrementales(self):
+        # prueba de éxito: los contadores siguen las transiciones aunque el dict se modifique en el lugar
+        handler = self.nuevo_handler()
+        participantes = [{"participant": {"alias": "ana"}, "status": "waiting"},
+                         {"participant": {"alias": "luis"}, "status": "waiting"}]
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": participantes})
+        handler.add_entity("Ride", {"id": 2, "status": "completed",
+                                    "participants": [{"participant": {"alias": "ana"}, "status": "missing"}]})
+
+        participantes[0]["status"] = "completed"
+        participantes[1]["status"] = "rejected"
+        handler.update_entity_filter("Ride", {"id": 1}, {"participants": participantes})
+
+        stats = handler.get_participant_stats("ana")
+        self.assertEqual(stats["previousRidesTotal"], 2)
+        self.assertEqual(stats["previousRidesCompleted"], 1)
+        self.assertEqual(stats["previousRidesMissing"], 1)
+        self.assertEqual(handler.get_participant_stats("luis")["previousRidesRejected"], 1)
+
+        handler.delete_entity_filter("Ride", {"id": 2})
+        self.assertEqual(handler.get_participant_stats("ana")["previousRidesMissing"], 0)
+
+    def test_error_estadisticas_participante_desconocido(self):
+        # error controlado: un alias sin participaciones devuelve contadores en cero
+        handler = self.nuevo_handler()
+        self.assertEqual(handler.get_participant_stats("nadie")["previousRidesTotal"], 0)
+
+    def test_secuencia_ids_persistente(self):
+        # prueba de éxito: la secuencia parte del mayor id existente y sobrevive a un reinicio
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", {"id": 7, "status": "ready"})
+        self.assertEqual(handler.next_id("Ride"), 8)
+        self.assertEqual(handler.next_id("Ride"), 9)
+
+        recargado = self.nuevo_handler()
+        self.assertEqual(recargado.next_id("Ride"), 10)
+
+    def test_secuencia_ids_concurrente(self):
+        # prueba de éxito: hilos en paralelo nunca reciben el mismo id
+        handler = self.nuevo_handler()
+        ids = []
+        hilos = [threading.Thread(target=lambda: ids.extend(handler.next_id("Ride") for _ in range(20)))
+                 for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(sorted(ids), list(range(1, 81)))
+
+    def test_transaccion_serializa_chequeo_y_escritura(self):
+        # prueba de éxito: validar capacidad y escribir dentro de transaction() no sobrevende espacios
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", {"id": 1, "allowedSpaces": 5, "participants": []})
+
+        def unirse(alias):
+            with handler.transaction():
+                ride = handler.get_by_key("Ride", 1)
+                if len(ride["participants"]) < ride["allowedSpaces"]:
+                    handler.update_entity_filter("Ride", {"id": 1},
+                                                 {"participants": ride["participants"] + [{"participant": {"alias": alias}}]})
+
+        hilos = [threading.Thread(target=unirse, args=(f"u{i}",)) for i in range(20)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(len(handler.get_by_key("Ride", 1)["participants"]), 5)
+
+    def test_lecturas_en_paralelo(self):
+        # prueba de éxito: dos lectores pueden estar dentro de read() al mismo tiempo
+        handler = self.nuevo_handler()
+        barrera = threading.Barrier(2, timeout=2)
+        errores = []
+
+        def leer():
+            with handler.read():
+                try:
+                    barrera.wait()
+                except threading.BrokenBarrierError as error:
+                    errores.append(error)
+
+        hilos = [threading.Thread(target=leer) for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+
+    def test_error_lectura_a_escritura(self):
+        # error controlado: no se puede abrir una transacción desde dentro de una lectura
+        handler = self.nuevo_handler()
+        with handler.read():
+            with self.assertRaises(RuntimeError):
+                with handler.transaction():
+                    pass
+
+    def test_paginacion_por_cursor(self):
+        # prueba de éxito: las páginas encadenadas por cursor recorren todo sin repetir, aunque haya borrados
+        handler = self.nuevo_handler()
+        for i in range(1, 8):
+            handler.add_entity("Ride", {"id": i, "status": "ready" if i % 2 else "inprogress"})
+
+        primera, siguiente = handler.get_entities_page("Ride", {"status": "ready"}, limit=2)
+        self.assertEqual([r["id"] for r in primera], [1, 3])
+        handler.delete_entity_filter("Ride", {"id": 1})
+        segunda, siguiente = handler.get_entities_page("Ride", {"status": "ready"}, limit=2, after=siguiente)
+        self.assertEqual([r["id"] for r in segunda], [5, 7])
+        self.assertIsNone(siguiente)
+
+        por_offset, _ = handler.get_entities_page("Ride", None, limit=3, offset=2)
+        self.assertEqual([r["id"] for r in por_offset], [4, 5, 6])
+
+    def test_carga_lazy_decodifica_solo_lo_usado(self):
+        # prueba de éxito: con lazy solo se decodifica el tipo de entidad consultado y el log se aplica al decodificarlo
+        handler = self.nuevo_handler(journal=True)
+        handler.add_entity("User", {"alias": "ana", "name": "Ana \u00f1", "car_plate": None})
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": []})
+        handler.compact()
+        handler.update_entity_filter("Ride", {"id": 1}, {"status": "inprogress"})
+        handler.save_data()
+
+        recargado = self.nuevo_handler(journal=True, lazy=True)
+        self.assertEqual(recargado.get_by_key("User", "ana")["name"], "Ana \u00f1")
+        self.assertNotIn("Ride", recargado.backend.dict_entities)
+        self.assertEqual(recargado.get_by_key("Ride", 1)["status"], "inprogress")
+        self.assertEqual(recargado.next_id("Ride"), 2)
+
+    def test_carga_lazy_archivo_sin_secciones(self):
+        # prueba de éxito: un data.json escrito sin índice de secciones se carga completo
+        with open(self.filename, "w") as f:
+            json.dump({"entities": [], "User": [{"alias": "ana"}], "Ride": []}, f)
+
+        handler = self.nuevo_handler(lazy=True)
+        self.assertEqual(handler.get_by_key("User", "ana"), {"alias": "ana"})
+        handler.add_entity("User", {"alias": "luis"})
+        handler.save_data()
+        recargado = self.nuevo_handler(lazy=True)
+        self.assertEqual([u["alias"] for u in recargado.get_entities("User")], ["ana", "luis"])
+        self.assertEqual(self.nuevo_handler().get_entities("Ride"), [])
+
+    def test_rides_guardan_referencias_y_join_expande(self):
+        # prueba de éxito: el ride guarda solo alias y join devuelve los datos actuales del usuario
+        handler = self.nuevo_handler()
+        handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": "ABC-123"})
+        handler.add_entity("User", {"alias": "luis", "name": "Luis", "car_plate": None})
+        luis = handler.get_by_key("User", "luis")
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": [],
+                                    "rideDriver": {"alias": "ana", "name": "Ana", "car_plate": "ABC-123"}})
+        handler.update_entity_filter("Ride", {"id": 1}, {"participants": [
+            {"participant": luis, "status": "waiting", "destination": "Lima"}]})
+        handler.update_entity_filter("User", {"alias": "ana"}, {"name": "Ana María"})
+
+        guardado = handler.get_by_key("Ride", 1)
+        self.assertEqual(guardado["rideDriver"], {"alias": "ana"})
+        self.assertEqual(guardado["participants"][0]["participant"], {"alias": "luis"})
+        ride = handler.expand("Ride", guardado)
+        self.assertEqual(guardado["confirmedSeats"], 0)
+        self.assertNotIn("confirmedSeats", ride)
+        self.assertNotIn("pendingSeats", ride)
+        self.assertEqual(ride["rideDriver"]["name"], "Ana María")
+        self.assertEqual(ride["participants"][0]["participant"], luis)
+        self.assertEqual(handler.get_participant_stats("luis")["previousRidesTotal"], 1)
+
+    def test_normalizar_rides_con_copias(self):
+        # prueba de éxito: un data.json con copias completas de usuarios se reduce a referencias al cargarlo
+        with open(self.filename, "w") as f:
+            json.dump({"entities": [], "User": [{"alias": "ana", "name": "Ana"}], "Ride": [
+                {"id": 1, "status": "ready", "rideDriver": {"alias": "ana", "name": "Ana"},
+                 "participants": [{"participant": {"alias": "borrado", "name": "X"}, "status": "waiting"}]}]}, f)
+
+        handler = self.nuevo_handler(journal=True, lazy=True)
+        ride = handler.get_by_key("Ride", 1)
+        self.assertEqual(ride["rideDriver"], {"alias": "ana"})
+        self.assertEqual(ride["pendingSeats"], 1)
+        self.assertEqual(handler.expand("Ride", ride)["participants"][0]["participant"], {"alias": "borrado"})
+        handler.close()
+
+        # la migracion queda en el snapshot: la proxima carga lazy no decodifica los rides
+        with open(self.filename) as f:
+            self.assertEqual(json.load(f)["Ride"][0]["rideDriver"], {"alias": "ana"})
+        recargado = self.nuevo_handler(journal=True, lazy=True)
+        self.assertTrue(recargado.backend.normalized)
+        self.assertNotIn("Ride", recargado.backend.dict_entities)
+        recargado.close()
+
+    def test_guardado_agrupa_pedidos_concurrentes(self):
+        # prueba de éxito: varios save_data a la vez se resuelven con menos escrituras y todos vuelven ya guardados
+        handler = self.nuevo_handler()
+        guardados = []
+        guardar = handler.backend.save
+
+        def guardar_lento():
+            time.sleep(0.02)
+            guardar()
+            guardados.append(1)
+        handler.backend.save = guardar_lento
+
+        def crear(i):
+            with handler.transaction():
+                handler.add_entity("User", {"alias": f"u{i}", "name": "x", "car_plate": None})
+                handler.save_data()
+            self.assertTrue(os.path.exists(self.filename))
+
+        hilos = [threading.Thread(target=crear, args=(i,)) for i in range(10)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertLess(len(guardados), 10)
+        self.assertEqual(len(self.nuevo_handler().get_entities("User")), 10)
+
+    def test_guardado_por_intervalo_y_ticket(self):
+        # prueba de éxito: con durabilidad por intervalo save_data no espera, el ticket sí
+        handler = self.nuevo_handler(durability="interval", flush_interval_ms=10000)
+        handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        ticket = handler.save_data()
+        self.assertFalse(ticket.done)
+        self.assertTrue(ticket.wait(timeout=5))
+        self.assertEqual(len(self.nuevo_handler().get_entities("User")), 1)
+
+    def test_guardado_al_cerrar(self):
+        # prueba de éxito: con durabilidad "shutdown" el archivo se escribe recién en close()
+        handler = self.nuevo_handler(durability="shutdown")
+        handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        handler.save_data()
+        self.assertFalse(os.path.exists(self.filename))
+        handler.close()
+        self.assertEqual(len(self.nuevo_handler().get_entities("User")), 1)
+
+    def test_error_durabilidad_desconocida(self):
+        # error controlado: una durabilidad que no existe se rechaza al crear el handler
+        with self.assertRaises(ValueError):
+            self.nuevo_handler(durability="nunca")
+
+    def test_consulta_con_operadores_y_rutas_anidadas(self):
+        # prueba de éxito: eq/in/rango/exists y rutas dentro de participants en una sola consulta
+        handler = self.nuevo_handler()
+        for i, (driver, status, fecha) in enumerate([("ana", "ready", "2025-07-16T08:00:00"),
+                                                     ("ana", "inprogress", "2025-07-16T10:00:00"),
+                                                     ("luis", "ready", "2025-07-16T12:00:00"),
+                                                     ("ana", "completed", "2025-07-15T09:00:00")], start=1):
+            handler.add_entity("Ride", {"id": i, "status": status, "rideDateAndTime": fecha,
+                                        "rideDriver": {"alias": driver},
+                                        "participants": [{"participant": {"alias": "rosa"}, "status": "waiting"}]
+                                        if i % 2 else []})
+
+        ids = lambda rides: [r["id"] for r in rides]
+        self.assertEqual(ids(handler.query("Ride", {"rideDriver.alias": "ana",
+                                                    "status": {"in": ["ready", "inprogress"]}})), [1, 2])
+        self.assertEqual(ids(handler.query("Ride", {"rideDateAndTime": {"gte": "2025-07-16T09:00:00",
+                                                                        "lt": "2025-07-16T12:00:00"}})), [2])
+        self.assertEqual(ids(handler.query("Ride", {"participants[].participant.alias": "rosa"})), [1, 3])
+        self.assertEqual(ids(handler.query("Ride", {"participants[].status": {"exists": False}})), [2, 4])
+        self.assertEqual(ids(handler.query("Ride", {"status": "ready"}, limit=1)), [1])
+        self.assertEqual(len(handler.backend._candidates(
+            "Ride", Query({"status": {"in": ["inprogress", "completed"]}}))), 2)
+        self.assertEqual(handler.query("Ride", {"id": {"in": [3, 9]}})[0]["rideDriver"], {"alias": "luis"})
+
+    def test_ventana_de_tiempo_con_indice_ordenado(self):
+        # prueba de éxito: rango y orden por rideDateAndTime salen del indice ordenado y siguen las mutaciones
+        handler = self.nuevo_handler()
+        for i, hora in enumerate(["12", "08", "10", "09", "11"], start=1):
+            handler.add_entity("Ride", {"id": i, "status": "ready", "rideDateAndTime": f"2025-07-16T{hora}:00:00"})
+        handler.add_entity("Ride", {"id": 6, "status": "ready"})
+        handler.update_entity_filter("Ride", {"id": 2}, {"rideDateAndTime": "2025-07-16T13:00:00"})
+        handler.delete_entity_filter("Ride", {"id": 4})
+
+        ids = lambda rides: [r["id"] for r in rides]
+        ventana = {"status": "ready", "rideDateAndTime": {"gte": "2025-07-16T09:00:00", "lte": "2025-07-16T12:00:00"}}
+        self.assertEqual(ids(handler.query("Ride", ventana, order_by="rideDateAndTime")), [3, 5, 1])
+        self.assertEqual(ids(handler.query("Ride", ventana, limit=2, order_by="rideDateAndTime")), [3, 5])
+        self.assertEqual(ids(handler.query("Ride", {}, order_by="rideDateAndTime")), [3, 5, 1, 2, 6])
+        self.assertEqual(len(handler.backend._candidates(
+            "Ride", Query({"rideDateAndTime": {"gt": "2025-07-16T11:00:00"}}))), 2)
+        # sin indice ordenado se ordena en memoria
+        self.assertEqual(ids(handler.query("Ride", {"status": "ready"}, limit=2, order_by="id")), [1, 2])
+
+    def test_busqueda_de_texto_por_destino(self):
+        # prueba de éxito: palabras sin tildes y por prefijo, con ranking y el indice al dia tras mutaciones
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "finalAddress": "Av. Javier Prado 123",
+                                    "participants": []})
+        handler.add_entity("Ride", {"id": 2, "status": "ready", "finalAddress": "Aeropuerto Jorge Chávez",
+                                    "participants": [{"participant": {"alias": "rosa"}, "destination": "Javier Prado"}]})
+        handler.add_entity("Ride", {"id": 3, "status": "completed", "finalAddress": "Javier Prado Este",
+                                    "participants": []})
+
+        ids = lambda found: [ride["id"] for ride, _ in found]
+        self.assertEqual(ids(handler.search("Ride", "chavez")), [2])
+        self.assertEqual(ids(handler.search("Ride", "javier pra", {"status": "ready"})), [1, 2])
+        self.assertEqual(ids(handler.search("Ride", "jav", limit=1)), [1])
+        self.assertEqual(handler.search("Ride", "prado lima"), [])
+
+        handler.update_entity_filter("Ride", {"id": 2}, {"participants": []})
+        handler.delete_entity_filter("Ride", {"id": 1})
+        self.assertEqual(ids(handler.search("Ride", "javier")), [3])
+        self.assertEqual(len(handler.backend._text_index["Ride"]), 2)
+
+
+    def test_contadores_y_buckets_de_asientos_libres(self):
+        # prueba de éxito: los contadores cambian con cada transicion y los buckets siguen a los rides ready
+        handler = self.nuevo_handler()
+        esperando = {"participant": {"alias": "rosa"}, "occupiedSpaces": 2, "status": "waiting"}
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "allowedSpaces": 4, "participants": [esperando]})
+        handler.add_entity("Ride", {"id": 2, "status": "ready", "allowedSpaces": 3, "participants": []})
+        handler.add_entity("Ride", {"id": 3, "status": "inprogress", "allowedSpaces": 4, "participants": []})
+
+        ride = handler.get_by_key("Ride", 1)
+        self.assertEqual((ride["confirmedSeats"], ride["pendingSeats"]), (0, 2))
+        handler.update_entity_filter("Ride", {"id": 1}, {"participants": [
+            dict(esperando, status="confirmed"), {"participant": {"alias": "luis"}, "status": "waiting"}]})
+        ride = handler.get_by_key("Ride", 1)
+        self.assertEqual((ride["confirmedSeats"], ride["pendingSeats"]), (2, 1))
+
+        ids = lambda rides: [r["id"] for r in rides]
+        self.assertEqual(ids(handler.rides_with_free_seats(1)), [1, 2])
+        self.assertEqual(ids(handler.rides_with_free_seats(2)), [2])
+        handler.update_entity_filter("Ride", {"id": 2}, {"status": "inprogress"})
+        self.assertEqual(ids(handler.rides_with_free_seats(1, limit=5)), [1])
+        self.assertEqual(handler.rides_with_free_seats(2), [])
+
+    def test_normalizar_rides_agrega_contadores(self):
+        # prueba de éxito: un ride guardado sin contadores los recibe al normalizar
+        with open(self.filename, "w") as f:
+            json.dump({"entities": [], "User": [], "Ride": [
+                {"id": 1, "status": "ready", "allowedSpaces": 3, "rideDriver": {"alias": "ana"},
+                 "participants": [{"participant": {"alias": "luis"}, "status": "confirmed"}]}]}, f)
+        handler = self.nuevo_handler()
+        self.assertEqual([r["id"] for r in handler.rides_with_free_seats(2)], [1])
+        handler.normalize_rides()
+        ride = handler.get_by_key("Ride", 1)
+        self.assertEqual((ride["confirmedSeats"], ride["pendingSeats"]), (1, 0))
+
+
+    def test_lote_un_solo_registro_de_journal(self):
+        # prueba de éxito: altas y cambios de un lote se aplican juntos y se recuperan del log al cargar
+        handler = self.nuevo_handler(journal=True)
+        primero = handler.next_id("Ride", 3)
+        handler.add_entities("Ride", [{"id": primero + i, "status": "ready", "participants": []} for i in range(3)])
+        handler.batch("Ride", [{"op": "update", "filters": {"id": primero}, "updates": {"status": "inprogress"}},
+                               {"op": "delete", "filters": {"id": primero + 2}}])
+        handler.save_data()
+        with open(self.filename + ".log") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        self.assertEqual(handler.next_id("Ride"), primero + 3)
+        handler.close()
+
+        recargado = self.nuevo_handler(journal=True, lazy=True)
+        self.assertEqual([(r["id"], r["status"]) for r in recargado.get_entities("Ride")],
+                         [(primero, "inprogress"), (primero + 1, "ready")])
+
+    def test_error_lote_con_operacion_desconocida(self):
+        # error controlado: una operación desconocida en el lote se rechaza
+        handler = self.nuevo_handler()
+        with self.assertRaises(ValueError):
+            handler.batch("User", [{"op": "upsert", "data": {"alias": "ana"}}])
+
+
+    def test_archivo_de_rides_terminados(self):
+        # prueba de éxito: los rides terminados salen de memoria y se siguen leyendo del archivo
+        handler = self.nuevo_handler(journal=True, archive=True)
+        participantes = [{"participant": {"alias": "luis"}, "status": "completed"}]
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "rideDriver": {"alias": "ana"},
+                                    "participants": participantes})
+        handler.add_entity("Ride", {"id": 2, "status": "ready", "rideDriver": {"alias": "ana"}, "participants": []})
+        handler.update_entity_filter("Ride", {"id": 1}, {"status": "completed"})
+        self.assertEqual(handler.archive_rides([1, 2]), 1)
+        handler.save_data()
+
+        self.assertEqual([r["id"] for r in handler.get_entities("Ride")], [2])
+        self.assertEqual(handler.get_by_key("Ride", 1)["status"], "completed")
+        self.assertEqual([r["id"] for r in handler.get_entities_filter("Ride", {"rideDriver.alias": "ana"})], [2, 1])
+        self.assertEqual(handler.get_entities_filter("Ride", {"status": "ready"})[0]["id"], 2)
+        self.assertEqual(handler.get_participant_stats("luis")["previousRidesCompleted"], 1)
+        # el archivo es de solo lectura: un update sobre un ride archivado no encuentra nada
+        self.assertEqual(handler.update_entity_filter("Ride", {"id": 1}, {"participants": []}), 0)
+        self.assertEqual(handler.get_by_key("Ride", 1)["participants"][0]["status"], "completed")
+        self.assertEqual(handler.update_entity_filter("Ride", {"id": 2}, {"status": "inprogress"}), 1)
+        handler.close()
+
+        recargado = self.nuevo_handler(journal=True, archive=True)
+        self.assertEqual(len(recargado.archive), 1)
+        self.assertEqual(recargado.get_entities_filter("Ride", {"participants[].participant.alias": "luis"})[0]["id"], 1)
+        recargado.close()
+
+    def test_archivo_se_recupera_de_una_caida(self):
+        # prueba de éxito: un ride escrito sin su linea de indice se reindexa y una linea cortada se descarta
+        with open(self.filename, "w") as f:
+            json.dump({"entities": [], "User": [], "Ride": [
+                {"id": 1, "status": "completed", "rideDriver": {"alias": "ana"}, "participants": []},
+                {"id": 2, "status": "done", "rideDriver": {"alias": "ana"}, "participants": []}]}, f)
+        handler = self.nuevo_handler(archive=True)
+        self.assertEqual(handler.get_entities("Ride"), [])
+        handler.close()
+
+        archivo = self.filename + ".archive"
+        with open(archivo + ".idx", "r+") as f:
+            primera = f.readline()
+            f.truncate(len(primera))
+        with open(archivo, "a") as f:
+            f.write('{"id": 3, "status": "compl')
+
+        recargado = self.nuevo_handler(archive=True)
+        self.assertEqual(len(recargado.archive), 2)
+        self.assertEqual(recargado.get_by_key("Ride", 2)["status"], "done")
+        recargado.archive.append([{"id": 4, "status": "completed", "rideDriver": {"alias": "ana"}}])
+        self.assertEqual(recargado.get_by_key("Ride", 4)["id"], 4)
+        recargado.close()
+
+    def test_snapshot_no_cambia_con_escrituras(self):
+        # prueba de éxito: una vista tomada antes de un update sigue viendo el estado anterior
+        handler = self.nuevo_handler()
+        handler.add_entity("User", {"alias": "ana", "name": "Ana"})
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "rideDriver": {"alias": "ana"}, "participants": []})
+        vista = handler.snapshot()
+        self.assertIs(handler.snapshot()._entities, vista._entities)
+
+        handler.update_entity_filter("Ride", {"id": 1}, {"status": "inprogress"})
+        handler.get_by_key("User", "ana")["name"] = "modificado afuera"
+        self.assertEqual(vista.get_by_key("Ride", 1)["status"], "ready")
+        self.assertEqual(vista.query("Ride", {"status": "ready"})[0]["id"], 1)
+        self.assertEqual(handler.snapshot().get_by_key("Ride", 1)["status"], "inprogress")
+        self.assertEqual(handler.snapshot().join("Ride", [vista.get_by_key("Ride", 1)])[0]["rideDriver"]["name"],
+                         "Ana")
+        handler.close()
+
+    def test_guardado_serializa_fuera_del_lock(self):
+        # prueba de éxito: lo que se escribe es el estado de cuando se tomo la vista, aunque despues haya escrituras
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": []})
+        with handler.read():
+            escribir = handler.backend.prepare_save()
+        handler.update_entity_filter("Ride", {"id": 1}, {"status": "inprogress"})
+        handler.add_entity("Ride", {"id": 2, "status": "ready", "participants": []})
+        escribir()
+
+        with open(self.filename) as f:
+            guardado = json.load(f)
+        self.assertEqual([(r["id"], r["status"]) for r in guardado["Ride"]], [(1, "ready")])
+        handler.close()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
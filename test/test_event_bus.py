@@ -0,0 +1,60 @@
+import threading
+import unittest
+
+from src.event_bus import SUBSCRIBERS, EventBus
+
+
+def ride(ride_id, driver, participants=(), status="ready"):
+    return {"id": ride_id, "status": status, "rideDriver": {"alias": driver},
+            "participants": [{"participant": {"alias": alias}, "status": "waiting"} for alias in participants]}
+
+
+class event_bus_tests(unittest.TestCase):
+
+    def test_entrega_solo_lo_que_coincide(self):
+        # prueba de éxito: cada suscripción recibe los eventos de su ride o de su alias
+        bus = EventBus()
+        del_ride = bus.subscribe(ride_id=1)
+        de_beto = bus.subscribe(alias="beto")
+        otro = bus.subscribe(ride_id=2)
+
+        bus.publish("requestToJoin", ride(1, "ana", ["beto"]), "beto", status="waiting")
+        bus.publish("started", ride(3, "carla", ["beto"], status="inprogress"))
+
+        self.assertEqual([e["type"] for e in del_ride.get(0)], ["requestToJoin"])
+        eventos = de_beto.get(0)
+        self.assertEqual([(e["type"], e["rideId"]) for e in eventos], [("requestToJoin", 1), ("started", 3)])
+        self.assertEqual(eventos[1]["rideStatus"], "inprogress")
+        self.assertEqual(otro.get(0), [])
+
+    def test_reconexion_con_ultimo_evento(self):
+        # prueba de éxito: al reconectar con Last-Event-ID llegan solo los eventos que faltaban
+        bus = EventBus(history=2)
+        primero = bus.publish("accepted", ride(1, "ana", ["beto"]), "beto", status="confirmed")
+        bus.publish("rejected", ride(1, "ana", ["carla"]), "carla", status="rejected")
+        bus.publish("started", ride(1, "ana"))
+
+        faltantes = bus.subscribe(ride_id=1, last_event_id=primero["id"] + 1).get(0)
+        self.assertEqual([e["type"] for e in faltantes], ["started"])
+        # el evento siguiente al ultimo recibido ya salio del historial
+        perdidos = bus.subscribe(ride_id=1, last_event_id=primero["id"] - 1).get(0)
+        self.assertEqual([e["type"] for e in perdidos], ["reset", "rejected", "started"])
+
+    def test_stream_espera_y_se_desuscribe(self):
+        # prueba de éxito: el stream despierta con cada evento y al cerrarse suelta la suscripción
+        bus = EventBus()
+        conectados = SUBSCRIBERS.value()
+        stream = bus.stream(alias="ana", keepalive=5)
+        self.assertEqual(next(stream), "retry: 3000\n\n")
+        threading.Timer(0.05, bus.publish, ("ended", ride(7, "ana", status="completed"))).start()
+
+        texto = next(stream)
+        self.assertTrue(texto.startswith("id: 1\nevent: ended\ndata: "))
+        self.assertEqual(SUBSCRIBERS.value(), conectados + 1)
+        stream.close()
+        self.assertEqual(SUBSCRIBERS.value(), conectados)
+        self.assertEqual(bus._by_alias, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
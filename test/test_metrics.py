@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.data_handler import DataHandler, OPERATION_SECONDS
+from src.json_backend import BYTES_WRITTEN
+from src.metrics import Registry
+from src.storage_backend import ENTITIES_SCANNED
+
+
+class metrics_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_formato_prometheus(self):
+        # prueba de éxito: contadores, gauges e histogramas acumulados en formato de texto
+        registry = Registry()
+        requests = registry.counter("http_requests_total", "requests", ("route", "status"))
+        requests.inc(route="/rides", status=200)
+        requests.inc(2, route="/rides", status=200)
+        registry.gauge("en_curso", "requests en curso").inc()
+        latencia = registry.histogram("latencia_seconds", "latencia", ("route",), buckets=(0.1, 1))
+        latencia.observe(0.05, route='/a"b')
+        latencia.observe(0.5, route='/a"b')
+
+        texto = registry.render()
+        self.assertIn('http_requests_total{route="/rides",status="200"} 3', texto)
+        self.assertIn("# TYPE latencia_seconds histogram", texto)
+        self.assertIn('latencia_seconds_bucket{route="/a\\"b",le="0.1"} 1', texto)
+        self.assertIn('latencia_seconds_bucket{route="/a\\"b",le="+Inf"} 2', texto)
+        self.assertIn('latencia_seconds_count{route="/a\\"b"} 2', texto)
+        self.assertIn("en_curso 1", texto)
+        self.assertIs(registry.counter("http_requests_total", "requests", ("route", "status")), requests)
+
+    def test_error_etiquetas_incorrectas(self):
+        # error controlado: etiquetas que no son las declaradas o un contador que baja
+        registry = Registry()
+        requests = registry.counter("http_requests_total", "requests", ("route",))
+        with self.assertRaises(ValueError):
+            requests.inc(status=200)
+        with self.assertRaises(ValueError):
+            requests.inc(-1, route="/")
+        with self.assertRaises(ValueError):
+            registry.gauge("http_requests_total", "otro tipo")
+
+    def test_operaciones_de_data_handler(self):
+        # prueba de éxito: tiempos por operación, entidades revisadas y bytes escritos
+        handler = DataHandler(filename=os.path.join(self.tmpdir, "data.json"), journal=True)
+        consultas = OPERATION_SECONDS.count(operation="query")
+        revisadas = ENTITIES_SCANNED.count(entity="Ride")
+        bytes_journal = BYTES_WRITTEN.value(file="journal")
+
+        handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": []})
+        handler.query("Ride", {"status": "ready"})
+        handler.save_data()
+
+        self.assertEqual(OPERATION_SECONDS.count(operation="query"), consultas + 1)
+        self.assertEqual(ENTITIES_SCANNED.count(entity="Ride"), revisadas + 1)
+        self.assertGreater(BYTES_WRITTEN.value(file="journal"), bytes_journal)
+        handler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ import sys
 import os
 
 from src.models.app import User
+from src.models.records import RideRecord, to_dict, to_record
 
 
 class usuario_tests(unittest.TestCase):
@@ -45,5 +46,28 @@ class usuario_tests(unittest.TestCase):
         self.assertEqual(usuario.rides, [])
 
 
+class registro_tests(unittest.TestCase):
+
+    def test_exito_ride_vuelve_a_la_misma_forma(self):
+        # prueba de éxito: el registro compacto devuelve el mismo dict, con claves extra y sin las que faltaban
+        ride = {"id": 7, "status": "ready", "rideDriver": {"alias": "ana"}, "origin": {"district": "Lima"},
+                "participants": [{"participant": {"alias": "luis"}, "status": "waiting", "occupiedSpaces": 2}]}
+        registro = to_record("Ride", ride)
+        self.assertIsInstance(registro, RideRecord)
+        self.assertEqual(to_dict(registro), ride)
+        self.assertEqual(registro.get("rideDriver"), {"alias": "ana"})
+        self.assertEqual(registro.participant_statuses(), [("luis", "waiting")])
+
+    def test_exito_estados_compartidos(self):
+        # prueba de éxito: el mismo estado en dos rides es el mismo objeto str
+        uno = to_record("Ride", {"id": 1, "status": "".join(["rea", "dy"])})
+        dos = to_record("Ride", {"id": 2, "status": "".join(["re", "ady"])})
+        self.assertIs(uno.status, dos.status)
+
+    def test_error_entidad_sin_registro(self):
+        # error controlado: las entidades sin registro compacto quedan como dict
+        self.assertEqual(to_record("entities", {"x": 1}), {"x": 1})
+
+
 if __name__ == '__main__':
     unittest.main()
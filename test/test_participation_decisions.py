@@ -0,0 +1,60 @@
+import unittest
+
+from src.participation_decisions import decidir_participaciones
+
+
+def participacion(alias, status="waiting", espacios=1):
+    return {"participant": {"alias": alias}, "status": status, "occupiedSpaces": espacios, "destination": "Lima"}
+
+
+def ride(participantes, espacios=2, status="ready"):
+    return {"id": 1, "status": status, "allowedSpaces": espacios, "rideDriver": {"alias": "ana"},
+            "participants": participantes}
+
+
+class participation_decisions_tests(unittest.TestCase):
+
+    def test_exito_acepta_y_rechaza_en_una_pasada(self):
+        # prueba de éxito: las decisiones se aplican sobre una copia y el ride original no cambia
+        original = ride([participacion("luis"), participacion("maria"), participacion("pedro")])
+        participantes, errores = decidir_participaciones(
+            original, [(0, "luis", "accept"), (1, "maria", "accept"), (2, "pedro", "reject")])
+
+        self.assertEqual(errores, [])
+        self.assertEqual([p["status"] for p in participantes], ["confirmed", "confirmed", "rejected"])
+        self.assertIn("confirmation", participantes[0])
+        self.assertNotIn("confirmation", participantes[2])
+        self.assertEqual([p["status"] for p in original["participants"]], ["waiting"] * 3)
+
+    def test_exito_rechazar_en_ride_lleno(self):
+        # prueba de éxito: rechazar o bajar no ocupa asientos, aunque el ride ya supere su capacidad
+        lleno = ride([participacion("luis", "confirmed", 2), participacion("maria")], espacios=1)
+        participantes, errores = decidir_participaciones(lleno, [(0, "maria", "reject")])
+        self.assertEqual(errores, [])
+        self.assertEqual(participantes[1]["status"], "rejected")
+
+        en_curso = ride([participacion("luis", "inprogress", 2)], espacios=1, status="inprogress")
+        participantes, errores = decidir_participaciones(en_curso, [(0, "luis", "unload")])
+        self.assertEqual(errores, [])
+        self.assertEqual(participantes[0]["status"], "completed")
+
+    def test_error_capacidad_para_todas_las_aceptaciones(self):
+        # error controlado: cada aceptación entra sola, pero juntas superan la capacidad
+        participantes, errores = decidir_participaciones(
+            ride([participacion("luis"), participacion("maria", espacios=2)]),
+            [(0, "luis", "accept"), (1, "maria", "accept")])
+        self.assertEqual(errores, [{"rideId": 1, "error": "No hay espacios suficientes disponibles"}])
+
+    def test_error_filas_invalidas(self):
+        # error controlado: cada fila inválida se informa con su número
+        participantes, errores = decidir_participaciones(
+            ride([participacion("luis"), participacion("maria", "confirmed")]),
+            [(0, "nadie", "accept"), (1, "luis", "reject"), (2, "luis", "accept"), (3, "maria", "reject"),
+             (4, "maria", "unload")])
+        self.assertEqual([e["fila"] for e in errores], [0, 2, 3, 4])
+        self.assertIn("más de una decisión", errores[1]["error"])
+        self.assertIn("'inprogress'", errores[3]["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
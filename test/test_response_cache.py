@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.data_handler import DataHandler
+from src.response_cache import ResponseCache, ride_dependencies
+from src.sqlite_backend import SQLiteBackend
+
+
+class response_cache_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.handler = DataHandler(filename=os.path.join(self.tmpdir, "data.json"))
+        self.handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        self.handler.add_entity("User", {"alias": "luis", "name": "Luis", "car_plate": None})
+        self.handler.add_entity("Ride", {"id": 1, "status": "ready", "rideDriver": {"alias": "ana"},
+                                         "participants": [{"participant": {"alias": "luis"}, "status": "waiting"}]})
+        self.handler.add_entity("Ride", {"id": 2, "status": "ready", "rideDriver": {"alias": "luis"},
+                                         "participants": []})
+        self.construcciones = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def construir_ride(self, ride_id):
+        def construir():
+            self.construcciones += 1
+            ride = self.handler.get_by_key("Ride", ride_id)
+            return self.handler.expand("Ride", ride), {("Ride", ride_id)} | ride_dependencies([ride]), None
+        return construir
+
+    def test_exito_reutiliza_hasta_que_cambia_una_dependencia(self):
+        # prueba de éxito: la entrada se reutiliza y se invalida solo al mutar su ride o sus usuarios
+        cache = ResponseCache(self.handler)
+        primera = cache.get_or_build(("ride", 1), self.construir_ride(1))
+        self.assertIs(cache.get_or_build(("ride", 1), self.construir_ride(1)), primera)
+
+        self.handler.update_entity_filter("Ride", {"id": 2}, {"status": "inprogress"})
+        self.handler.add_entity("User", {"alias": "rosa", "name": "Rosa", "car_plate": None})
+        self.assertIs(cache.get_or_build(("ride", 1), self.construir_ride(1)), primera)
+
+        self.handler.update_entity_filter("User", {"alias": "luis"}, {"name": "Luis Alberto"})
+        segunda = cache.get_or_build(("ride", 1), self.construir_ride(1))
+        self.assertEqual(self.construcciones, 2)
+        self.assertIn(b"Luis Alberto", segunda.body)
+        self.assertNotEqual(segunda.etag, primera.etag)
+
+    def test_exito_etag_estable_para_el_mismo_cuerpo(self):
+        # prueba de éxito: reconstruir sin cambios de contenido da el mismo ETag
+        cache = ResponseCache(self.handler)
+        primera = cache.get_or_build(("ride", 1), self.construir_ride(1))
+        self.handler.update_entity_filter("Ride", {"id": 1}, {"status": "ready"})
+        segunda = cache.get_or_build(("ride", 1), self.construir_ride(1))
+        self.assertEqual(self.construcciones, 2)
+        self.assertEqual(segunda.etag, primera.etag)
+
+    def test_error_backend_compartido_no_cachea(self):
+        # error controlado: con un backend que comparten varios procesos no se reutilizan entradas
+        filename = os.path.join(self.tmpdir, "data.db")
+        self.handler = DataHandler(filename=filename, backend=SQLiteBackend(filename))
+        self.handler.add_entity("Ride", {"id": 1, "status": "ready", "participants": []})
+        cache = ResponseCache(self.handler)
+        cache.get_or_build(("ride", 1), self.construir_ride(1))
+        cache.get_or_build(("ride", 1), self.construir_ride(1))
+        self.assertEqual(self.construcciones, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.data_handler import DataHandler
+from src.sharded_data_handler import ShardedDataHandler, shard_of
+
+# con dos particiones: ana y beto van a la 0, carla y dario a la 1
+SHARDS = 2
+
+
+def ride(ride_id, driver, date, participants=()):
+    return {"id": ride_id, "rideDateAndTime": date, "finalAddress": "Av. Javier Prado", "allowedSpaces": 3,
+            "status": "ready", "rideDriver": {"alias": driver},
+            "participants": [{"participant": {"alias": alias}, "status": status, "occupiedSpaces": 1}
+                             for alias, status in participants]}
+
+
+class sharded_data_handler_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "data.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def nuevo_handler(self, **kwargs):
+        return ShardedDataHandler(filename=self.filename, shards=SHARDS, **kwargs)
+
+    def test_particiona_por_alias_del_conductor(self):
+        # prueba de éxito: cada ride queda en la particion de su conductor y las lecturas cruzadas juntan todo
+        self.assertEqual([shard_of(a, SHARDS) for a in ("ana", "beto", "carla", "dario")], [0, 0, 1, 1])
+        handler = self.nuevo_handler()
+        handler.add_entities("User", [{"alias": a, "name": a.title()} for a in ("ana", "beto", "carla", "dario")])
+        primero = handler.next_id("Ride", key="carla")
+        self.assertEqual(primero % SHARDS, 1)
+        handler.add_entity("Ride", ride(primero, "carla", "2030-01-02T08:00:00", [("ana", "rejected")]))
+        otro = handler.next_id("Ride", 2, key="ana")
+        self.assertEqual(otro % SHARDS, 0)
+        self.assertEqual(handler.shard("ana").id_step, SHARDS)
+        handler.add_entities("Ride", [ride(otro, "ana", "2030-01-01T08:00:00", [("carla", "rejected")]),
+                                      ride(otro + SHARDS, "beto", "2030-01-03T08:00:00", [("ana", "missing")])])
+        handler.save_data()
+
+        self.assertEqual([r["id"] for r in handler.shards[1].get_entities("Ride")], [primero])
+        self.assertEqual(handler.get_by_key("Ride", primero)["rideDriver"], {"alias": "carla"})
+        self.assertEqual(len(handler.get_entities_filter("Ride", {"rideDriver.alias": "ana"})), 1)
+        ordenados = handler.query("Ride", {"status": "ready"}, limit=2, order_by="rideDateAndTime")
+        self.assertEqual([r["rideDriver"]["alias"] for r in ordenados], ["ana", "carla"])
+        self.assertEqual(handler.get_participant_stats("ana")["previousRidesTotal"], 2)
+        self.assertEqual(handler.expand("Ride", ordenados[1])["participants"][0]["participant"]["name"], "Ana")
+
+        # paginas que cruzan particiones, con el cursor de la anterior
+        vistos, cursor = [], None
+        while True:
+            pagina, cursor = handler.get_entities_page("User", limit=3, after=cursor)
+            vistos += [u["alias"] for u in pagina]
+            if cursor is None:
+                break
+        self.assertEqual(sorted(vistos), ["ana", "beto", "carla", "dario"])
+        handler.close()
+
+        recargado = self.nuevo_handler()
+        self.assertEqual(len(recargado.get_entities("Ride")), 3)
+        recargado.close()
+
+    def test_importa_datos_sin_particionar(self):
+        # prueba de éxito: los datos de data.json se reparten y los ids nuevos no repiten los anteriores
+        original = DataHandler(filename=os.path.join(self.tmpdir, "original.json"))
+        original.add_entities("User", [{"alias": "ana", "name": "Ana"}, {"alias": "carla", "name": "Carla"}])
+        original.add_entities("Ride", [ride(1, "ana", "2030-01-01T08:00:00"), ride(2, "ana", "2030-01-02T08:00:00"),
+                                       ride(5, "carla", "2030-01-03T08:00:00")])
+        handler = self.nuevo_handler()
+        handler.import_from(original)
+
+        # el ride 1 quedo en la particion 0 aunque su id apunta a la 1
+        self.assertEqual(handler.get_by_key("Ride", 1)["rideDriver"]["alias"], "ana")
+        self.assertEqual(len(handler.get_entities("Ride")), 3)
+        self.assertGreater(handler.next_id("Ride", key="ana"), 5)
+        self.assertGreater(handler.next_id("Ride", key="carla"), 5)
+        original.close()
+        handler.close()
+
+    def test_error_particiones_y_operacion_desconocida(self):
+        # error controlado: cero particiones o un lote con una operacion que no existe
+        with self.assertRaises(ValueError):
+            ShardedDataHandler(filename=self.filename, shards=0)
+        handler = self.nuevo_handler()
+        with self.assertRaises(ValueError):
+            handler.batch("Ride", [{"op": "add", "data": ride(1, "ana", None)}, {"op": "upsert"}])
+        self.assertEqual(handler.get_entities("Ride"), [])
+        handler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
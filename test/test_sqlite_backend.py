@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.data_handler import DataHandler
+from src.sqlite_backend import SQLiteBackend
+
+
+class sqlite_backend_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "data.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def nuevo_handler(self):
+        return DataHandler(filename=self.filename, backend=SQLiteBackend(self.filename))
+
+    def nuevo_ride(self, ride_id, driver, status="ready", participants=None):
+        return {"id": ride_id, "rideDateAndTime": "2025-07-16T18:00:00", "finalAddress": "Av. Javier Prado 123",
+                "allowedSpaces": 4, "rideDriver": {"alias": driver, "name": driver, "car_plate": None},
+                "status": status, "participants": participants or []}
+
+    def test_exito_filtros_y_actualizacion(self):
+        # prueba de éxito: los filtros por columna, campo anidado y participantes devuelven los mismos dicts
+        handler = self.nuevo_handler()
+        handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        handler.add_entity("Ride", self.nuevo_ride(1, "ana"))
+        handler.add_entity("Ride", self.nuevo_ride(2, "luis"))
+        participantes = [{"confirmation": None, "destination": "Lima", "occupiedSpaces": 1,
+                          "participant": {"alias": "luis"}, "status": "waiting"}]
+        handler.update_entity_filter("Ride", {"id": 1}, {"participants": participantes, "status": "inprogress"})
+
+        ride = handler.get_by_key("Ride", 1)
+        self.assertEqual(ride["status"], "inprogress")
+        self.assertEqual(ride["participants"], participantes)
+        self.assertEqual([r["id"] for r in handler.get_entities_filter("Ride", {"rideDriver.alias": "luis"})], [2])
+        self.assertEqual([r["id"] for r in handler.get_entities_filter("Ride", {"finalAddress": "Av. Javier Prado 123",
+                                                                                "status": "inprogress"})], [1])
+        self.assertEqual(handler.get_by_key("User", "ana")["name"], "Ana")
+
+        handler.delete_entity_filter("Ride", {"id": 2})
+        self.assertEqual(len(handler.get_entities("Ride")), 1)
+
+    def test_exito_estadisticas_y_secuencia(self):
+        # prueba de éxito: las estadísticas salen de la tabla de participaciones y la secuencia parte del mayor id
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", self.nuevo_ride(5, "ana", "completed", [
+            {"participant": {"alias": "luis"}, "status": "completed"},
+            {"participant": {"alias": "rosa"}, "status": "missing"}]))
+        handler.add_entity("Ride", self.nuevo_ride(6, "ana", "ready", [
+            {"participant": {"alias": "luis"}, "status": "rejected"}]))
+
+        stats = handler.get_participant_stats("luis")
+        self.assertEqual(stats["previousRidesTotal"], 2)
+        self.assertEqual(stats["previousRidesCompleted"], 1)
+        self.assertEqual(stats["previousRidesRejected"], 1)
+        self.assertEqual(handler.next_id("Ride"), 7)
+        self.assertEqual(handler.next_id("Ride"), 8)
+
+    def test_exito_dos_handlers_misma_base(self):
+        # prueba de éxito: dos instancias (como dos workers) ven las escrituras de la otra
+        uno = self.nuevo_handler()
+        dos = self.nuevo_handler()
+        uno.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+        self.assertEqual(dos.get_by_key("User", "ana")["name"], "Ana")
+        self.assertNotEqual(uno.next_id("Ride"), dos.next_id("Ride"))
+
+    def test_error_transaccion_revierte(self):
+        # error controlado: si falla algo dentro de transaction() no queda nada escrito
+        handler = self.nuevo_handler()
+        with self.assertRaises(ValueError):
+            with handler.transaction():
+                handler.add_entity("User", {"alias": "ana", "name": "Ana", "car_plate": None})
+                raise ValueError("falla")
+        self.assertIsNone(handler.get_by_key("User", "ana"))
+
+    def test_exito_paginacion(self):
+        # prueba de éxito: limit/offset van en la consulta y el cursor continúa desde la última fila
+        handler = self.nuevo_handler()
+        for i in range(1, 6):
+            handler.add_entity("Ride", self.nuevo_ride(i, "ana", "ready" if i != 3 else "completed"))
+
+        primera, siguiente = handler.get_entities_page("Ride", {"status": "ready"}, limit=2)
+        segunda, _ = handler.get_entities_page("Ride", {"status": "ready"}, limit=2, after=siguiente)
+        self.assertEqual([r["id"] for r in primera + segunda], [1, 2, 4, 5])
+        por_offset, _ = handler.get_entities_page("Ride", {}, limit=2, offset=3)
+        self.assertEqual([r["id"] for r in por_offset], [4, 5])
+
+    def test_exito_consulta_con_operadores(self):
+        # prueba de éxito: in y rangos van a SQL, las rutas dentro de participants se evalúan en Python
+        handler = self.nuevo_handler()
+        for i, status in enumerate(["ready", "inprogress", "completed", "ready"], start=1):
+            ride = self.nuevo_ride(i, "ana", status, [{"participant": {"alias": "luis"}, "status": "waiting"}]
+                                   if i > 2 else [])
+            ride["rideDateAndTime"] = f"2025-07-16T1{i}:00:00"
+            handler.add_entity("Ride", ride)
+
+        rides = handler.query("Ride", {"status": {"in": ["ready", "completed"]},
+                                       "rideDateAndTime": {"gte": "2025-07-16T12:00:00"}})
+        self.assertEqual([r["id"] for r in rides], [3, 4])
+        rides = handler.query("Ride", {"participants[].participant.alias": "luis", "status": "ready"})
+        self.assertEqual([r["id"] for r in rides], [4])
+        self.assertEqual(len(handler.query("Ride", {"allowedSpaces": {"gt": 1}}, limit=2)), 2)
+
+    def test_exito_ventana_ordenada_por_fecha(self):
+        # prueba de éxito: el orden va a SQL con los rides sin fecha al final
+        handler = self.nuevo_handler()
+        for i, hora in enumerate(["12", "08", None, "10"], start=1):
+            ride = self.nuevo_ride(i, "ana")
+            ride["rideDateAndTime"] = f"2025-07-16T{hora}:00:00" if hora else None
+            handler.add_entity("Ride", ride)
+
+        rides = handler.query("Ride", {"rideDateAndTime": {"gte": "2025-07-16T09:00:00"}}, limit=1,
+                              order_by="rideDateAndTime")
+        self.assertEqual([r["id"] for r in rides], [4])
+        rides = handler.query("Ride", {"status": "ready"}, order_by="rideDateAndTime")
+        self.assertEqual([r["id"] for r in rides], [2, 4, 1, 3])
+
+    def test_exito_busqueda_de_texto(self):
+        # prueba de éxito: sin indice propio la busqueda recorre los rides que cumplen el filtro
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", self.nuevo_ride(1, "ana"))
+        ride = self.nuevo_ride(2, "luis")
+        ride["finalAddress"] = "Aeropuerto Jorge Chávez"
+        handler.add_entity("Ride", ride)
+
+        found = handler.search("Ride", "aeropuerto jor", {"status": "ready"})
+        self.assertEqual([r["id"] for r, _ in found], [2])
+
+    def test_exito_rides_con_asientos_libres(self):
+        # prueba de éxito: los contadores se guardan con el ride y la consulta usa el recorrido por defecto
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", self.nuevo_ride(1, "ana", participants=[
+            {"participant": {"alias": "luis"}, "occupiedSpaces": 3, "status": "confirmed"}]))
+        handler.add_entity("Ride", self.nuevo_ride(2, "ana"))
+
+        self.assertEqual(handler.get_by_key("Ride", 1)["confirmedSeats"], 3)
+        self.assertEqual([r["id"] for r in handler.rides_with_free_seats(2)], [2])
+
+    def test_exito_indices_por_columna_y_json(self):
+        # prueba de éxito: create_index crea el índice SQL de una columna y de un campo dentro de data
+        handler = self.nuevo_handler()
+        handler.add_entity("Ride", self.nuevo_ride(1, "ana"))
+        handler.add_entity("Ride", self.nuevo_ride(2, "beto"))
+        handler.create_index("Ride", "rideDriver.alias")
+        handler.create_index("Ride", "finalAddress")
+        handler.create_index("Config", "clave")
+
+        with handler.backend.read_transaction() as conn:
+            indices = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({"idx_rides_rideDriver_alias", "idx_rides_finalAddress", "idx_entities_clave"} <= indices)
+        self.assertEqual([r["id"] for r in handler.get_entities_filter("Ride", {"rideDriver.alias": "beto"})], [2])
+
+    def test_error_indice_ruta_no_valida(self):
+        # error controlado: una ruta que no es un campo no llega al SQL
+        handler = self.nuevo_handler()
+        with self.assertRaises(ValueError):
+            handler.create_index("Ride", "status); DROP TABLE rides; --")
+
+    def test_error_lote_revierte_completo(self):
+        # error controlado: si falla una fila del lote no queda ninguna
+        handler = self.nuevo_handler()
+        primero = handler.next_id("Ride", 2)
+        self.assertEqual(handler.next_id("Ride"), primero + 2)
+        with self.assertRaises(Exception):
+            handler.add_entities("User", [{"alias": "ana", "name": "Ana"}, {"alias": "ana", "name": "Otra"}])
+        self.assertEqual(handler.get_entities("User"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()